@@ -61,3 +61,21 @@ class Aluno(models.Model):
 
     def __str__(self):
         return self.nome_completo
+
+    def save(self, *args, **kwargs):
+        anterior = (
+            Aluno.objects.filter(pk=self.pk).values("turma_id", "plano_financeiro_id").first()
+            if self.pk
+            else None
+        )
+        if not anterior or anterior == {
+            "turma_id": self.turma_id,
+            "plano_financeiro_id": self.plano_financeiro_id,
+        }:
+            super().save(*args, **kwargs)
+            return
+        from apps.financeiro.resumo import acompanhar_resumo
+
+        # Trocar turma ou plano move os pagamentos do aluno no resumo financeiro.
+        with acompanhar_resumo(self.pagamentos.all()):
+            super().save(*args, **kwargs)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "apps.api"
+
+    def ready(self):
+        from .cache import conectar_invalidacao
+
+        conectar_invalidacao()
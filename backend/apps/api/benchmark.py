@@ -0,0 +1,149 @@
+# Sem imports de models aqui: este modulo e carregado pelos processos do benchmark
+# (multiprocessing "spawn") antes do django.setup().
+import math
+import multiprocessing
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.commands.createcachetable import Command as CreateCacheTable
+from django.db import connection
+from django.utils.module_loading import import_string
+
+BACKENDS = ("locmem", "file", "db")
+
+TABELA_BENCHMARK = "cejamsys_cache_benchmark"
+
+_cache = None
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    if not ordenados:
+        return None
+    # Nearest-rank.
+    posicao = max(math.ceil(p / 100 * len(ordenados)) - 1, 0)
+    return ordenados[min(posicao, len(ordenados) - 1)]
+
+
+def _payload(indice):
+    # Mesmo formato e tamanho aproximado do payload de DashboardView/FinanceiroDashboardView.
+    meses = [f"2026-{mes:02d}" for mes in range(1, 13)]
+    return {
+        "stats": {"total_alunos": 500 + indice, "receita_mes": "123456.78"},
+        "charts": {
+            nome: [
+                {"mes": mes, "total": f"{indice * 1000 + posicao}.00"}
+                for posicao, mes in enumerate(meses)
+            ]
+            for nome in ("receita_mensal", "previsto_vs_realizado", "inadimplencia_heatmap")
+        },
+        "recent_activity": [
+            {"type": "pagamento", "message": f"Pagamento recebido: Aluno {indice}-{item}"}
+            for item in range(4)
+        ],
+    }
+
+
+def _iniciar(config):
+    global _cache
+    import django
+
+    django.setup()
+    backend = import_string(config["BACKEND"])
+    _cache = backend(config["LOCATION"], config)
+
+
+def simular(semente, requisicoes, chaves, custo_ms, ttl):
+    """Requisicoes de um worker: le a chave e, se faltar, "calcula" e grava.
+
+    Retorna uma lista de ``(acertou, latencia em ms)``.
+    """
+    aleatorio = random.Random(semente)
+    medicoes = []
+    for _ in range(requisicoes):
+        indice = aleatorio.randrange(chaves)
+        inicio = time.perf_counter()
+        acertou = _cache.get(f"dashboard:{indice}") is not None
+        if not acertou:
+            time.sleep(custo_ms / 1000)
+            _cache.set(f"dashboard:{indice}", _payload(indice), ttl)
+        medicoes.append((acertou, (time.perf_counter() - inicio) * 1000))
+    return medicoes
+
+
+def _config(backend, diretorio):
+    config = {
+        **settings.CACHE_BACKENDS[backend],
+        "OPTIONS": {"MAX_ENTRIES": settings.CACHE_MAX_ENTRIES},
+    }
+    if backend == "file":
+        config["LOCATION"] = diretorio
+    elif backend == "db":
+        config["LOCATION"] = TABELA_BENCHMARK
+    return config
+
+
+def medir(backend, workers, requisicoes, chaves, custo_ms, ttl):
+    """Roda ``workers`` processos ao mesmo tempo sobre um cache vazio do backend."""
+    resultado = {"backend": backend, "workers": workers, "requisicoes": requisicoes * workers}
+    diretorio = tempfile.mkdtemp(prefix="cejamsys-cache-")
+    if backend == "db":
+        criar_tabela = CreateCacheTable()
+        criar_tabela.verbosity = 0
+        criar_tabela.create_table("default", TABELA_BENCHMARK, dry_run=False)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_iniciar,
+            initargs=(_config(backend, diretorio),),
+        ) as executor:
+            inicio = time.perf_counter()
+            medicoes = list(
+                executor.map(
+                    simular,
+                    range(workers),
+                    [requisicoes] * workers,
+                    [chaves] * workers,
+                    [custo_ms] * workers,
+                    [ttl] * workers,
+                )
+            )
+            total = time.perf_counter() - inicio
+    except Exception as exc:
+        resultado["erro"] = str(exc)
+        return resultado
+    finally:
+        shutil.rmtree(diretorio, ignore_errors=True)
+        if backend == "db":
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE {connection.ops.quote_name(TABELA_BENCHMARK)}")
+
+    todas = [medicao for lista in medicoes for medicao in lista]
+    latencias = [latencia for _, latencia in todas]
+    leituras = [latencia for acertou, latencia in todas if acertou]
+    resultado.update(
+        {
+            "segundos": round(total, 4),
+            "throughput_por_s": round(len(todas) / total, 1) if total else None,
+            "hit_rate": round(len(leituras) / len(todas), 4),
+            "calculos": len(todas) - len(leituras),
+            "latencia_ms": {
+                "media": round(sum(latencias) / len(latencias), 3),
+                "p50": round(percentil(latencias, 50), 3),
+                "p95": round(percentil(latencias, 95), 3),
+                "p99": round(percentil(latencias, 99), 3),
+                "max": round(max(latencias), 3),
+            },
+            # Custo do backend em si: so as requisicoes atendidas pelo cache.
+            "acerto_ms": {
+                "p50": round(percentil(leituras, 50), 3) if leituras else None,
+                "p95": round(percentil(leituras, 95), 3) if leituras else None,
+            },
+        }
+    )
+    return resultado
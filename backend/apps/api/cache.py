@@ -0,0 +1,187 @@
+"""Cache dos dashboards e relatorios, com versoes por dominio.
+
+Cada dominio (alunos, turmas, contratos, pagamentos) tem uma versao guardada no
+cache; uma gravacao troca a versao do dominio depois do commit. Cada payload fica
+em uma entrada junto com as versoes dos dominios que leu e o instante em que
+expira. Uma entrada da versao atual expirada ha menos de DASHBOARD_CACHE_STALE
+segundos continua sendo servida enquanto uma unica thread a recalcula
+(stale-while-revalidate). Uma entrada com versao antiga nunca e servida: depois de
+uma gravacao a requisicao espera o recalculo. Uma trava no cache impede que mais
+de um worker calcule a mesma chave ao mesmo tempo.
+"""
+
+import threading
+import time
+import uuid
+from functools import partial
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection, transaction
+from django.db.models.signals import post_delete, post_save
+
+ESPERA_TRAVA = 0.1
+
+DOMINIOS = {
+    "alunos": ("alunos.Aluno",),
+    "turmas": ("turmas.Turma",),
+    "contratos": ("contratos.Contrato",),
+    "pagamentos": ("financeiro.PagamentoAluno", "financeiro.PlanoEducacional"),
+}
+
+
+def _chave_versao(dominio):
+    return f"versao:{dominio}"
+
+
+def _nova_versao():
+    # Valor novo a cada troca (e nao um contador): se a chave da versao sumir do
+    # cache, a proxima nao repete uma versao usada por payloads ainda gravados.
+    return time.time_ns()
+
+
+def versoes(*dominios):
+    """Versoes atuais dos dominios, juntas em uma string para compor chaves."""
+    chaves = [_chave_versao(dominio) for dominio in dominios]
+    atuais = cache.get_many(chaves)
+    for chave in chaves:
+        if chave not in atuais:
+            cache.add(chave, _nova_versao(), timeout=None)
+            atuais[chave] = cache.get(chave) or _nova_versao()
+    return ".".join(str(atuais[chave]) for chave in chaves)
+
+
+def _gravar(chave, versao, valor):
+    ttl = getattr(settings, "DASHBOARD_CACHE_TTL", 30)
+    entrada = {"versao": versao, "expira": time.time() + ttl, "valor": valor}
+    cache.set(chave, entrada, timeout=ttl + getattr(settings, "DASHBOARD_CACHE_STALE", 0))
+
+
+def _travar(chave):
+    """Retorna um token se conseguiu a trava de calculo da chave, senao None."""
+    token = uuid.uuid4().hex
+    timeout = getattr(settings, "DASHBOARD_CACHE_LOCK_TIMEOUT", 30)
+    if cache.add(f"trava:{chave}", token, timeout=timeout):
+        return token
+    return None
+
+
+def _liberar(chave, token):
+    # Sem compare-and-delete nos backends do Django: so apaga se a trava ainda
+    # for nossa (ela pode ter expirado e sido pega por outro worker).
+    if cache.get(f"trava:{chave}") == token:
+        cache.delete(f"trava:{chave}")
+
+
+def _renovar(chave, versao, calcular, token):
+    close_old_connections()
+    try:
+        _gravar(chave, versao, calcular())
+    finally:
+        # Se calcular() falhar a entrada antiga continua la e a proxima
+        # requisicao tenta de novo.
+        _liberar(chave, token)
+        connection.close()
+
+
+def _aguardar(chave, versao):
+    """Espera o worker que tem a trava gravar a entrada da versao atual."""
+    limite = time.monotonic() + getattr(settings, "DASHBOARD_CACHE_LOCK_TIMEOUT", 30)
+    while time.monotonic() < limite:
+        time.sleep(ESPERA_TRAVA)
+        entrada = cache.get(chave)
+        if entrada is not None and entrada["versao"] == versao:
+            return entrada
+        if cache.get(f"trava:{chave}") is None:
+            # Quem tinha a trava terminou sem gravar esta versao (falhou, ou
+            # renovava uma versao anterior): o chamador tenta calcular.
+            break
+    return None
+
+
+def obter_ou_calcular(prefixo, dominios, partes, calcular, versao=None):
+    """Payload em cache de ``prefixo``/``partes`` ou o resultado de ``calcular()``.
+
+    ``calcular`` nao recebe argumentos e nao pode depender da requisicao: uma
+    entrada vencida da versao atual e devolvida na hora e ``calcular`` roda em
+    uma thread.
+    ``versao`` evita reler as versoes quando a view monta varias chaves.
+    """
+    chave = ":".join([prefixo, *(str(parte) for parte in partes)])
+    versao = versao or versoes(*dominios)
+    entrada = cache.get(chave)
+    if entrada is not None and entrada["versao"] == versao:
+        if entrada["expira"] > time.time():
+            return entrada["valor"]
+        if getattr(settings, "DASHBOARD_CACHE_STALE", 0):
+            token = _travar(chave)
+            if token:
+                threading.Thread(
+                    target=_renovar,
+                    args=(chave, versao, calcular, token),
+                    name=f"cache:{chave}",
+                    daemon=True,
+                ).start()
+            return entrada["valor"]
+
+    # Sem entrada da versao atual: so quem pega a trava calcula; os demais esperam.
+    token = _travar(chave)
+    if token is None:
+        entrada = _aguardar(chave, versao)
+        if entrada is not None:
+            return entrada["valor"]
+        token = _travar(chave)
+    try:
+        valor = calcular()
+        _gravar(chave, versao, valor)
+        return valor
+    finally:
+        if token:
+            _liberar(chave, token)
+
+
+def _trocar_versoes(dominios):
+    cache.set_many({_chave_versao(dominio): _nova_versao() for dominio in dominios}, timeout=None)
+
+
+def invalidar(*dominios):
+    """Troca a versao dos dominios quando a transacao atual for confirmada.
+
+    Trocar antes do commit deixaria outra requisicao recalcular com os dados
+    antigos e gravar o resultado na versao nova.
+    """
+    transaction.on_commit(partial(_trocar_versoes, dominios))
+
+
+def _ao_gravar(dominio, campos, sender, update_fields=None, **kwargs):
+    if campos and update_fields is not None and not campos.intersection(update_fields):
+        return
+    invalidar(dominio)
+
+
+def _ao_excluir(dominio, sender, **kwargs):
+    invalidar(dominio)
+
+
+def conectar_invalidacao():
+    from apps.financeiro.resumo import CAMPOS_RESUMO
+
+    # Gravacoes com update_fields fora destes campos (fila de NF, por exemplo) nao
+    # mudam nenhum payload em cache.
+    campos_relevantes = {"financeiro.PagamentoAluno": CAMPOS_RESUMO}
+    for dominio, rotulos in DOMINIOS.items():
+        for rotulo in rotulos:
+            modelo = apps.get_model(rotulo)
+            post_save.connect(
+                partial(_ao_gravar, dominio, campos_relevantes.get(rotulo)),
+                sender=modelo,
+                weak=False,
+                dispatch_uid=f"api.cache.gravar.{rotulo}",
+            )
+            post_delete.connect(
+                partial(_ao_excluir, dominio),
+                sender=modelo,
+                weak=False,
+                dispatch_uid=f"api.cache.excluir.{rotulo}",
+            )
@@ -0,0 +1,114 @@
+import re
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+
+CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _etag(pdf_hash):
+    return f'"{pdf_hash}"' if pdf_hash else None
+
+
+def _etag_confere(cabecalho, etag):
+    if not cabecalho or not etag:
+        return False
+    valores = [valor.strip() for valor in cabecalho.split(",")]
+    return "*" in valores or etag in valores or f"W/{etag}" in valores
+
+
+def _intervalo(cabecalho, tamanho):
+    """``(inicio, fim)`` inclusivos, ``None`` sem Range valido ou ``False`` se insatisfazivel."""
+    match = _RANGE_RE.match(cabecalho.strip())
+    if not match:
+        # Multiplos intervalos ou unidade desconhecida: responde o arquivo inteiro.
+        return None
+    inicio, fim = match.groups()
+    if not inicio and not fim:
+        return None
+    if not inicio:
+        sufixo = int(fim)
+        if sufixo == 0:
+            return False
+        return max(tamanho - sufixo, 0), tamanho - 1
+    inicio = int(inicio)
+    fim = min(int(fim), tamanho - 1) if fim else tamanho - 1
+    if inicio >= tamanho or inicio > fim:
+        return False
+    return inicio, fim
+
+
+def _ler_trecho(arquivo, inicio, quantidade):
+    try:
+        arquivo.seek(inicio)
+        while quantidade > 0:
+            bloco = arquivo.read(min(CHUNK_SIZE, quantidade))
+            if not bloco:
+                break
+            quantidade -= len(bloco)
+            yield bloco
+    finally:
+        arquivo.close()
+
+
+def _cabecalhos(resposta, etag, nome):
+    resposta["Accept-Ranges"] = "bytes"
+    resposta["Cache-Control"] = "private, no-cache"
+    resposta["Content-Disposition"] = content_disposition_header(False, nome)
+    if etag:
+        resposta["ETag"] = etag
+    return resposta
+
+
+def pdf_download_response(request, arquivo, pdf_hash, nome):
+    """Resposta de download do PDF com ETag, 304 e Range.
+
+    Com PDF_X_ACCEL_PREFIX definido, o envio dos bytes (inclusive Range) fica com o
+    proxy via X-Accel-Redirect.
+    """
+    if not arquivo:
+        raise Http404("PDF nao gerado.")
+    etag = _etag(pdf_hash)
+    if _etag_confere(request.headers.get("If-None-Match"), etag):
+        return _cabecalhos(HttpResponse(status=304), etag, nome)
+
+    prefixo = getattr(settings, "PDF_X_ACCEL_PREFIX", "")
+    if prefixo:
+        resposta = HttpResponse(content_type="application/pdf")
+        resposta["X-Accel-Redirect"] = f"{prefixo.rstrip('/')}/{arquivo.name}"
+        return _cabecalhos(resposta, etag, nome)
+
+    try:
+        tamanho = arquivo.size
+        conteudo = arquivo.storage.open(arquivo.name, "rb")
+    except FileNotFoundError as exc:
+        raise Http404("Arquivo do PDF nao encontrado.") from exc
+
+    cabecalho_range = request.headers.get("Range")
+    if_range = request.headers.get("If-Range")
+    intervalo = None
+    if cabecalho_range and (not if_range or (etag and if_range.strip() == etag)):
+        intervalo = _intervalo(cabecalho_range, tamanho)
+    if intervalo is False:
+        conteudo.close()
+        resposta = HttpResponse(status=416)
+        resposta["Content-Range"] = f"bytes */{tamanho}"
+        return _cabecalhos(resposta, etag, nome)
+    if intervalo is None:
+        resposta = FileResponse(conteudo, content_type="application/pdf")
+        resposta.block_size = CHUNK_SIZE
+        resposta["Content-Length"] = str(tamanho)
+        return _cabecalhos(resposta, etag, nome)
+
+    inicio, fim = intervalo
+    resposta = StreamingHttpResponse(
+        _ler_trecho(conteudo, inicio, fim - inicio + 1),
+        status=206,
+        content_type="application/pdf",
+    )
+    resposta["Content-Length"] = str(fim - inicio + 1)
+    resposta["Content-Range"] = f"bytes {inicio}-{fim}/{tamanho}"
+    return _cabecalhos(resposta, etag, nome)
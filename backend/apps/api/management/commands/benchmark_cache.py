@@ -0,0 +1,108 @@
+import json
+import os
+import platform
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.api.benchmark import BACKENDS, medir
+
+
+def _lista(valor):
+    return [item.strip() for item in valor.split(",") if item.strip()]
+
+
+class Command(BaseCommand):
+    help = "Mede hit rate e latencia dos backends de cache com varios workers simultaneos."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backends",
+            default=",".join(BACKENDS),
+            help="Backends separados por virgula (locmem, file, db).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Processos simultaneos, como os workers do gunicorn.",
+        )
+        parser.add_argument(
+            "--requisicoes",
+            type=int,
+            default=500,
+            help="Requisicoes por worker.",
+        )
+        parser.add_argument(
+            "--chaves",
+            type=int,
+            default=50,
+            help="Chaves distintas (por exemplo, usuarios abrindo o dashboard).",
+        )
+        parser.add_argument(
+            "--custo-ms",
+            type=float,
+            default=20.0,
+            help="Tempo simulado para recalcular um payload ausente do cache.",
+        )
+        parser.add_argument(
+            "--ttl",
+            type=int,
+            default=300,
+            help="Validade das entradas gravadas, em segundos.",
+        )
+        parser.add_argument(
+            "--saida",
+            help="Arquivo JSON de resultado (padrao: imprime na saida).",
+        )
+
+    def handle(self, *args, **options):
+        backends = _lista(options["backends"])
+        invalidos = set(backends) - set(BACKENDS)
+        if invalidos:
+            raise CommandError(f"Backend invalido: {', '.join(sorted(invalidos))}.")
+        workers = max(options["workers"], 1)
+        requisicoes = max(options["requisicoes"], 1)
+
+        resultados = []
+        for backend in backends:
+            resultado = medir(
+                backend,
+                workers,
+                requisicoes,
+                max(options["chaves"], 1),
+                max(options["custo_ms"], 0),
+                options["ttl"],
+            )
+            resultados.append(resultado)
+            if "erro" in resultado:
+                self.stderr.write(f"{backend}: {resultado['erro']}")
+                continue
+            self.stderr.write(
+                f"{backend}/{workers}: hit rate {resultado['hit_rate']:.1%}, "
+                f"p50 {resultado['latencia_ms']['p50']} ms, "
+                f"p95 {resultado['latencia_ms']['p95']} ms"
+            )
+
+        relatorio = {
+            "gerado_em": timezone.now().isoformat(),
+            "python": sys.version.split()[0],
+            "plataforma": platform.platform(),
+            "cpus": os.cpu_count(),
+            "parametros": {
+                "workers": workers,
+                "requisicoes_por_worker": requisicoes,
+                "chaves": options["chaves"],
+                "custo_ms": options["custo_ms"],
+                "ttl": options["ttl"],
+            },
+            "resultados": resultados,
+        }
+        conteudo = json.dumps(relatorio, ensure_ascii=False, indent=2)
+        if options["saida"]:
+            with open(options["saida"], "w", encoding="utf-8") as destino:
+                destino.write(conteudo)
+            self.stdout.write(self.style.SUCCESS(f"Resultado gravado em {options['saida']}."))
+        else:
+            self.stdout.write(conteudo)
@@ -8,6 +8,7 @@ from .financeiro import (
     PagamentoAlunoSerializer,
     PagamentoProfessorSerializer,
     PlanoEducacionalSerializer,
+    RecalculoJobSerializer,
 )
 
 __all__ = [
@@ -27,4 +28,5 @@ __all__ = [
     "PagamentoAlunoSerializer",
     "PagamentoProfessorSerializer",
     "PlanoEducacionalSerializer",
+    "RecalculoJobSerializer",
 ]
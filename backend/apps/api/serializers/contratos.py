@@ -1,6 +1,7 @@
 from rest_framework import serializers
 
 from apps.contratos.models import Assinatura, Contrato, TemplateContrato
+from apps.contratos.snapshots import expandir_snapshot
 
 
 class TemplateContratoSerializer(serializers.ModelSerializer):
@@ -35,6 +36,13 @@ class ContratoSerializer(serializers.ModelSerializer):
     def get_qr_payload(self, obj):
         return obj.qr_payload()
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Cache no contexto: numa listagem cada parte do snapshot e buscada uma vez.
+        cache = self.context.setdefault("snapshot_partes", {})
+        data["snapshot"] = expandir_snapshot(data.get("snapshot"), cache=cache)
+        return data
+
 
 class AssinaturaSerializer(serializers.ModelSerializer):
     contrato_numero = serializers.CharField(source="contrato.numero", read_only=True)
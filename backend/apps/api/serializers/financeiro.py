@@ -6,6 +6,7 @@ from apps.financeiro.models import (
     PagamentoAlunoHistorico,
     PagamentoProfessor,
     PlanoEducacional,
+    RecalculoJob,
 )
 
 
@@ -33,8 +34,16 @@ class PagamentoAlunoSerializer(serializers.ModelSerializer):
             "valor_total",
             "nf_numero",
             "nf_pdf",
+            "nf_hash",
             "nf_emitida_em",
+            "nf_status",
+            "nf_tentativas",
+            "nf_proxima_tentativa",
+            "nf_erro",
+            "nf_solicitada_por",
             "pagamento_registrado_em",
+            "recalculado_em",
+            "referencia_calculo",
         )
 
     def get_nf_pdf_url(self, obj):
@@ -54,8 +63,25 @@ class PagamentoAlunoSerializer(serializers.ModelSerializer):
         return ""
 
     def get_valor_total(self, obj):
+        valor_total = getattr(obj, "valor_total_atual", None)
+        if valor_total is not None:
+            return str(valor_total)
         return str(obj.valor_total)
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Querysets com anotar_encargos trazem os encargos calculados na consulta.
+        if hasattr(instance, "status_atual"):
+            data["status"] = instance.status_atual
+            data["dias_atraso"] = instance.dias_atraso_atual
+            data["multa"] = serializers.DecimalField(
+                max_digits=10, decimal_places=2
+            ).to_representation(instance.multa_atual)
+            data["juros"] = serializers.DecimalField(
+                max_digits=10, decimal_places=2
+            ).to_representation(instance.juros_atual)
+        return data
+
 
 class PagamentoAlunoHistoricoSerializer(serializers.ModelSerializer):
     class Meta:
@@ -63,6 +89,26 @@ class PagamentoAlunoHistoricoSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+class RecalculoJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RecalculoJob
+        fields = (
+            "id",
+            "status",
+            "parametros",
+            "total",
+            "processados",
+            "atualizados",
+            "historicos",
+            "erros",
+            "iniciado_em",
+            "finalizado_em",
+            "created_at",
+            "updated_at",
+        )
+        read_only_fields = fields
+
+
 class PagamentoProfessorSerializer(serializers.ModelSerializer):
     professor_nome = serializers.CharField(source="professor.nome_completo", read_only=True)
 
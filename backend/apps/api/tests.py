@@ -0,0 +1,697 @@
+import io
+import threading
+import time
+import zipfile
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.financeiro.arquivo import arquivar_historico
+from apps.financeiro.avaliacao import arredondar_monetarios
+from apps.financeiro.jobs import processar_job
+from apps.financeiro.models import (
+    HistoricoArquivo,
+    PagamentoAluno,
+    PagamentoAlunoHistorico,
+    PlanoEducacional,
+    RecalculoJob,
+)
+from apps.financeiro.tests import REFERENCIA, MidiaTemporariaMixin, criar_aluno, criar_turma
+
+from .cache import _gravar, invalidar, obter_ou_calcular, versoes
+from .utils import anotar_encargos, shift_month
+
+
+LOCMEM = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM, ALLOWED_HOSTS=["testserver"], FINANCEIRO_CALCULO_VIRTUAL=False)
+class FinanceiroDashboardConsultasTests(TestCase):
+    """O dashboard financeiro faz um numero fixo de consultas, qualquer que seja o volume."""
+
+    CONSULTAS = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = get_user_model().objects.create_superuser(
+            username="admin", email="admin@example.com", password="senha"
+        )
+        cls.turma = criar_turma()
+        cls.plano = PlanoEducacional.objects.create(
+            nome="Plano",
+            valor_mensalidade=Decimal("100.00"),
+            dia_vencimento=10,
+            duracao_meses=12,
+        )
+        cls.alunos = 0
+        cls._criar_pagamentos(3)
+
+    @classmethod
+    def _criar_pagamentos(cls, quantidade):
+        hoje = timezone.localdate()
+        status = [
+            PagamentoAluno.Status.PAGO,
+            PagamentoAluno.Status.EM_ABERTO,
+            PagamentoAluno.Status.ATRASADO,
+            PagamentoAluno.Status.ISENTO,
+        ]
+        for _ in range(quantidade):
+            cls.alunos += 1
+            aluno = criar_aluno(cls.turma, cls.plano, cls.alunos)
+            for meses in range(6):
+                competencia = shift_month(hoje.replace(day=1), -meses)
+                situacao = status[(cls.alunos + meses) % len(status)]
+                PagamentoAluno.objects.create(
+                    aluno=aluno,
+                    competencia=competencia,
+                    valor=Decimal("100.00"),
+                    data_vencimento=competencia.replace(day=10),
+                    data_pagamento=(
+                        competencia.replace(day=5)
+                        if situacao == PagamentoAluno.Status.PAGO
+                        else None
+                    ),
+                    forma_pagamento=PagamentoAluno.FormaPagamento.PIX,
+                    status=situacao,
+                )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+
+    def _dashboard(self):
+        resposta = self.client.get(reverse("financeiro_dashboard"), secure=True)
+        self.assertEqual(resposta.status_code, 200)
+        return resposta.data
+
+    def test_consultas_com_cache_frio(self):
+        with self.assertNumQueries(self.CONSULTAS):
+            self._dashboard()
+
+    def test_consultas_nao_crescem_com_os_pagamentos(self):
+        with self.assertNumQueries(self.CONSULTAS):
+            self._dashboard()
+        self._criar_pagamentos(5)
+        cache.clear()
+        with self.assertNumQueries(self.CONSULTAS):
+            self._dashboard()
+
+    def test_cache_quente_nao_consulta(self):
+        self._dashboard()
+        with self.assertNumQueries(0):
+            self._dashboard()
+
+    @override_settings(FINANCEIRO_CALCULO_VIRTUAL=True)
+    def test_consultas_com_calculo_virtual(self):
+        with self.assertNumQueries(self.CONSULTAS):
+            self._dashboard()
+
+    def test_valores_com_duas_casas(self):
+        kpis = self._dashboard()["kpis"]
+        for campo in ("receita_mes", "receita_periodo", "ticket_medio"):
+            self.assertRegex(kpis[campo], r"^\d+\.\d{2}$")
+
+
+@override_settings(CACHES=LOCMEM, DASHBOARD_CACHE_TTL=30, DASHBOARD_CACHE_STALE=600)
+class ObterOuCalcularTests(TestCase):
+    """Entradas vencidas da versao atual sao servidas; de versao antiga, nunca."""
+
+    def setUp(self):
+        cache.clear()
+        self.chamadas = 0
+
+    def _calcular(self):
+        self.chamadas += 1
+        return self.chamadas
+
+    def _obter(self):
+        return obter_ou_calcular("teste", ("pagamentos",), (), self._calcular)
+
+    def _esperar_renovacao(self):
+        for thread in threading.enumerate():
+            if thread.name == "cache:teste":
+                thread.join()
+
+    def test_entrada_vencida_servida_enquanto_recalcula(self):
+        self.assertEqual(self._obter(), 1)
+        entrada = cache.get("teste")
+        cache.set("teste", {**entrada, "expira": time.time() - 1})
+
+        self.assertEqual(self._obter(), 1)
+        self._esperar_renovacao()
+        self.assertEqual(self._obter(), 2)
+
+    def test_versao_antiga_nao_e_servida(self):
+        self.assertEqual(self._obter(), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidar("pagamentos")
+
+        self.assertEqual(self._obter(), 2)
+        self.assertEqual(self._obter(), 2)
+
+    def test_versao_antiga_espera_quem_tem_a_trava(self):
+        self.assertEqual(self._obter(), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidar("pagamentos")
+        cache.add("trava:teste", "outro worker")
+
+        def outro_worker():
+            time.sleep(0.3)
+            _gravar("teste", versoes("pagamentos"), "novo")
+            cache.delete("trava:teste")
+
+        gravador = threading.Thread(target=outro_worker)
+        gravador.start()
+        self.assertEqual(self._obter(), "novo")
+        gravador.join()
+        self.assertEqual(self.chamadas, 1)
+
+    def test_trava_liberada_sem_gravar_calcula(self):
+        self.assertEqual(self._obter(), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidar("pagamentos")
+        cache.add("trava:teste", "outro worker")
+        threading.Timer(0.3, cache.delete, args=("trava:teste",)).start()
+
+        inicio = time.monotonic()
+        self.assertEqual(self._obter(), 2)
+        self.assertLess(time.monotonic() - inicio, 5)
+
+
+def pdf_em_branco(largura):
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    writer.add_blank_page(width=largura, height=100)
+    saida = io.BytesIO()
+    writer.write(saida)
+    return saida.getvalue()
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"])
+class ExportarNotasFiscaisTests(MidiaTemporariaMixin, TestCase):
+    """Exportacao mensal das NFs em ZIP e em PDF unico, transmitida em blocos."""
+
+    COMPETENCIA = date(2026, 3, 1)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = get_user_model().objects.create_superuser(
+            username="admin", email="admin@example.com", password="senha"
+        )
+        turma = criar_turma()
+        aluno = criar_aluno(turma, None, 0)
+        # Criadas fora de ordem: a exportacao segue nf_numero.
+        for indice in (3, 1, 2):
+            pagamento = PagamentoAluno(
+                aluno=aluno,
+                competencia=cls.COMPETENCIA,
+                valor=Decimal("100.00"),
+                data_vencimento=cls.COMPETENCIA.replace(day=10),
+                forma_pagamento=PagamentoAluno.FormaPagamento.PIX,
+                nf_numero=f"NF-2026-{indice:06d}",
+            )
+            pagamento.nf_pdf.save(
+                f"{pagamento.nf_numero}.pdf", ContentFile(pdf_em_branco(100 + indice))
+            )
+        # Outra competencia fica de fora.
+        PagamentoAluno.objects.create(
+            aluno=aluno,
+            competencia=date(2026, 4, 1),
+            valor=Decimal("100.00"),
+            data_vencimento=date(2026, 4, 10),
+            forma_pagamento=PagamentoAluno.FormaPagamento.PIX,
+            nf_numero="NF-2026-000009",
+            nf_pdf=ContentFile(pdf_em_branco(200), name="NF-2026-000009.pdf"),
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+
+    def _exportar(self, **params):
+        return self.client.get(
+            reverse("pagamentos-alunos-exportar-notas-fiscais"),
+            {"competencia": "2026-03", **params},
+            secure=True,
+        )
+
+    def test_zip_transmitido_com_as_notas_da_competencia(self):
+        resposta = self._exportar(formato="zip")
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(resposta.streaming)
+        self.assertEqual(resposta["Content-Type"], "application/zip")
+        self.assertIn("notas-fiscais-2026-03.zip", resposta["Content-Disposition"])
+        with zipfile.ZipFile(io.BytesIO(b"".join(resposta.streaming_content))) as pacote:
+            self.assertEqual(
+                pacote.namelist(),
+                ["NF-2026-000001.pdf", "NF-2026-000002.pdf", "NF-2026-000003.pdf"],
+            )
+            self.assertEqual(pacote.read("NF-2026-000002.pdf"), pdf_em_branco(102))
+
+    def test_pdf_unico_na_ordem_das_notas(self):
+        from pypdf import PdfReader
+
+        resposta = self._exportar(formato="pdf")
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(resposta.streaming)
+        self.assertEqual(resposta["Content-Type"], "application/pdf")
+        leitor = PdfReader(io.BytesIO(b"".join(resposta.streaming_content)))
+        self.assertEqual([int(pagina.mediabox.width) for pagina in leitor.pages], [101, 102, 103])
+
+    @override_settings(FINANCEIRO_NF_EXPORTACAO_PDF_MAX=2)
+    def test_pdf_unico_acima_do_limite_pede_zip(self):
+        resposta = self._exportar(formato="pdf")
+
+        self.assertEqual(resposta.status_code, 400)
+        self.assertIn("zip", resposta.data["detail"])
+        self.assertEqual(self._exportar(formato="zip").status_code, 200)
+
+    def test_competencia_invalida(self):
+        self.assertEqual(self._exportar(competencia="marco").status_code, 400)
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"], FINANCEIRO_RECALCULO_EM_THREAD=False)
+class RecalculoEndpointTests(TestCase):
+    """POST enfileira (ou devolve o job ativo) e GET acompanha o progresso."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(
+            get_user_model().objects.create_superuser(
+                username="admin", email="admin@example.com", password="senha"
+            )
+        )
+
+    def test_enfileirar_e_acompanhar(self):
+        url = reverse("pagamentos-alunos-recalcular")
+        criado = self.client.post(f"{url}?incremental=1", secure=True)
+        repetido = self.client.post(f"{url}?incremental=true", secure=True)
+
+        self.assertEqual(criado.status_code, 202)
+        self.assertEqual(repetido.status_code, 200)
+        self.assertEqual(repetido.data["id"], criado.data["id"])
+        self.assertEqual(criado.data["status"], RecalculoJob.Status.PENDENTE)
+        self.assertTrue(criado.data["parametros"]["incremental"])
+
+        processar_job(criado.data["id"])
+        progresso = self.client.get(
+            reverse("pagamentos-alunos-recalcular-status", kwargs={"job_id": criado.data["id"]}),
+            secure=True,
+        )
+        self.assertEqual(progresso.status_code, 200)
+        self.assertEqual(progresso.data["status"], RecalculoJob.Status.CONCLUIDO)
+
+    def test_job_inexistente(self):
+        resposta = self.client.get(
+            reverse("pagamentos-alunos-recalcular-status", kwargs={"job_id": 999999}),
+            secure=True,
+        )
+        self.assertEqual(resposta.status_code, 404)
+
+
+class AnotarEncargosTests(TestCase):
+    """O calculo virtual devolve o mesmo que aplicar_regras gravaria."""
+
+    @classmethod
+    def setUpTestData(cls):
+        turma = criar_turma()
+        planos = [
+            None,
+            {"multa_percent": Decimal("2.00"), "juros_percent": Decimal("1.50")},
+            {"multa_percent": Decimal("2.00"), "juros_diario_percent": Decimal("0.03")},
+            {
+                "desconto_percent": Decimal("3.33"),
+                "multa_percent": Decimal("2.00"),
+                "juros_percent": Decimal("1.00"),
+                "juros_diario_percent": Decimal("0.05"),
+            },
+            {
+                "bolsa_tipo": PlanoEducacional.BolsaTipo.PARCIAL,
+                "bolsa_percent": Decimal("12.50"),
+                "multa_percent": Decimal("2.00"),
+                "juros_diario_percent": Decimal("0.03"),
+            },
+            {"bolsa_tipo": PlanoEducacional.BolsaTipo.INTEGRAL, "multa_percent": Decimal("2.00")},
+        ]
+        status = [
+            PagamentoAluno.Status.EM_ABERTO,
+            PagamentoAluno.Status.ATRASADO,
+            PagamentoAluno.Status.PAGO,
+            PagamentoAluno.Status.ISENTO,
+        ]
+        for indice, campos in enumerate(planos):
+            plano = None
+            if campos is not None:
+                plano = PlanoEducacional.objects.create(
+                    nome=f"Plano {indice}",
+                    valor_mensalidade=Decimal("100.00"),
+                    dia_vencimento=10,
+                    duracao_meses=12,
+                    **campos,
+                )
+            aluno = criar_aluno(turma, plano, indice)
+            for valor in ("0.10", "33.33", "100.10", "704.00"):
+                for dias in (-90, -31, -1, 0, 15):
+                    vencimento = REFERENCIA + timedelta(days=dias)
+                    for situacao in status:
+                        pagamento = PagamentoAluno(
+                            aluno=aluno,
+                            competencia=vencimento.replace(day=1),
+                            valor=Decimal(valor),
+                            data_vencimento=vencimento,
+                            forma_pagamento=PagamentoAluno.FormaPagamento.PIX,
+                            status=situacao,
+                        )
+                        if situacao == PagamentoAluno.Status.PAGO:
+                            pagamento.data_pagamento = vencimento + timedelta(days=12)
+                        # Valores gravados pela rotina em REFERENCIA; PAGO fica com os
+                        # encargos da data de pagamento.
+                        pagamento.aplicar_regras(
+                            None if situacao == PagamentoAluno.Status.PAGO else REFERENCIA
+                        )
+                        arredondar_monetarios(pagamento)
+                        pagamento.save()
+
+    def test_mesmos_valores_de_aplicar_regras(self):
+        for dias in (0, 1, 13, 45, 400):
+            referencia = REFERENCIA + timedelta(days=dias)
+            pagamentos = anotar_encargos(
+                PagamentoAluno.objects.select_related("plano", "aluno__plano_financeiro"),
+                referencia=referencia,
+            ).order_by("pk")
+            for pagamento in pagamentos:
+                virtual = (
+                    pagamento.status_atual,
+                    pagamento.dias_atraso_atual,
+                    pagamento.multa_atual,
+                    pagamento.juros_atual,
+                    Decimal(pagamento.valor_total_atual).quantize(Decimal("0.01")),
+                )
+                congelado = pagamento.status in {
+                    PagamentoAluno.Status.PAGO,
+                    PagamentoAluno.Status.ISENTO,
+                }
+                pagamento.aplicar_regras(None if congelado else referencia)
+                arredondar_monetarios(pagamento)
+                esperado = (
+                    pagamento.status,
+                    pagamento.dias_atraso,
+                    pagamento.multa,
+                    pagamento.juros,
+                    pagamento.valor_total,
+                )
+                with self.subTest(referencia=referencia, pagamento=pagamento.pk):
+                    self.assertEqual(virtual, esperado)
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"])
+class HistoricoArquivadoPaginacaoTests(MidiaTemporariaMixin, TestCase):
+    """A listagem pagina o banco e os arquivos mensais como uma lista so."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = get_user_model().objects.create_superuser(
+            username="auditor", email="auditor@example.com", password="senha"
+        )
+        turma = criar_turma()
+        cls.aluno, outro = criar_aluno(turma, None, 0), criar_aluno(turma, None, 1)
+        pagamentos = [
+            PagamentoAluno.objects.create(
+                aluno=aluno,
+                competencia=date(2026, mes, 1),
+                valor=Decimal("100.00"),
+                data_vencimento=date(2026, mes, 10),
+                forma_pagamento=PagamentoAluno.FormaPagamento.PIX,
+            )
+            for aluno, mes in ((cls.aluno, 1), (cls.aluno, 2), (outro, 1))
+        ]
+        cls.pagamento = pagamentos[1]
+        PagamentoAlunoHistorico.objects.all().delete()
+
+        agora = timezone.now()
+        acoes = PagamentoAlunoHistorico.Acao.values
+        # 40 registros recentes e 30 arquivados (em varios meses) do aluno; o
+        # outro aluno tem 5 de cada e nao pode aparecer.
+        recentes = [timedelta(hours=indice + 1) for indice in range(40)]
+        antigos = [timedelta(days=400 + 5 * indice) for indice in range(30)]
+        momentos = [
+            (pagamentos[indice % 2], agora - atraso)
+            for indice, atraso in enumerate(recentes + antigos)
+        ]
+        for indice in range(5):
+            momentos.append((pagamentos[2], agora - timedelta(minutes=30 + indice)))
+            momentos.append((pagamentos[2], agora - timedelta(days=401 + indice)))
+        for indice, (pagamento, momento) in enumerate(momentos):
+            historico = PagamentoAlunoHistorico.objects.create(
+                pagamento=pagamento,
+                acao=acoes[indice % len(acoes)],
+                alterado_por=cls.usuario if indice % 3 == 0 else None,
+            )
+            PagamentoAlunoHistorico.objects.filter(pk=historico.pk).update(created_at=momento)
+
+        cls.esperados = list(
+            PagamentoAlunoHistorico.objects.order_by("-created_at").values_list(
+                "id", "pagamento_id", "pagamento__aluno_id", "acao", "alterado_por_id"
+            )
+        )
+        arquivar_historico(meses=12)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+
+    def listar(self, **params):
+        """Todas as paginas da listagem, conferindo o count de cada uma."""
+        url = reverse("pagamentos-alunos-historico-list")
+        registros, pagina, total = [], 1, None
+        while True:
+            resposta = self.client.get(url, {**params, "page": pagina}, secure=True)
+            self.assertEqual(resposta.status_code, 200)
+            if total is None:
+                total = resposta.data["count"]
+            self.assertEqual(resposta.data["count"], total)
+            registros += resposta.data["results"]
+            if not resposta.data["next"]:
+                break
+            pagina += 1
+        self.assertEqual(len(registros), total)
+        return registros
+
+    def test_arquivamento_preparado(self):
+        self.assertEqual(PagamentoAlunoHistorico.objects.count(), 45)
+        self.assertGreater(HistoricoArquivo.objects.count(), 1)
+
+    def test_paginas_atravessam_a_fronteira_do_arquivo(self):
+        esperados = [linha[0] for linha in self.esperados if linha[2] == self.aluno.pk]
+
+        registros = self.listar(aluno=self.aluno.pk)
+
+        # 50 por pagina: a primeira mistura os 40 recentes e 10 arquivados.
+        self.assertEqual([registro["id"] for registro in registros], esperados)
+        self.assertEqual(
+            [registro.get("arquivado", False) for registro in registros[:50]],
+            [False] * 40 + [True] * 10,
+        )
+
+    def test_ordem_crescente(self):
+        esperados = [linha[0] for linha in self.esperados if linha[2] == self.aluno.pk]
+
+        registros = self.listar(aluno=self.aluno.pk, ordering="created_at")
+
+        self.assertEqual([registro["id"] for registro in registros], esperados[::-1])
+
+    def test_ordem_por_acao(self):
+        esperados = {linha[0] for linha in self.esperados if linha[2] == self.aluno.pk}
+
+        registros = self.listar(aluno=self.aluno.pk, ordering="-acao")
+
+        ids = [registro["id"] for registro in registros]
+        self.assertEqual(len(ids), len(esperados))
+        self.assertEqual(set(ids), esperados)
+        acoes = [registro["acao"] for registro in registros]
+        self.assertEqual(acoes, sorted(acoes, reverse=True))
+
+    def test_filtros(self):
+        por_pagamento = [linha[0] for linha in self.esperados if linha[1] == self.pagamento.pk]
+        por_usuario = [
+            linha[0]
+            for linha in self.esperados
+            if linha[2] == self.aluno.pk and linha[4] == self.usuario.pk
+        ]
+
+        registros = self.listar(pagamento=self.pagamento.pk)
+        self.assertEqual([registro["id"] for registro in registros], por_pagamento)
+
+        registros = self.listar(aluno=self.aluno.pk, search="auditor")
+        self.assertEqual([registro["id"] for registro in registros], por_usuario)
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"], PDF_X_ACCEL_PREFIX="")
+class DownloadPdfTests(MidiaTemporariaMixin, TestCase):
+    """Download da NF com ETag, 304, Range e X-Accel-Redirect."""
+
+    CONTEUDO = bytes(range(256)) * 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = get_user_model().objects.create_superuser(
+            username="admin", email="admin@example.com", password="senha"
+        )
+        cls.pagamento = PagamentoAluno(
+            aluno=criar_aluno(criar_turma(), None, 0),
+            competencia=date(2026, 3, 1),
+            valor=Decimal("100.00"),
+            data_vencimento=date(2026, 3, 10),
+            forma_pagamento=PagamentoAluno.FormaPagamento.PIX,
+            nf_numero="NF-2026-000001",
+            nf_hash="abc123",
+        )
+        cls.pagamento.nf_pdf.save("NF-2026-000001.pdf", ContentFile(cls.CONTEUDO))
+        cls.url = reverse("pagamentos-alunos-download-nf", kwargs={"pk": cls.pagamento.pk})
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+
+    def baixar(self, **cabecalhos):
+        return self.client.get(self.url, secure=True, headers=cabecalhos)
+
+    def test_arquivo_inteiro(self):
+        resposta = self.baixar()
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(b"".join(resposta.streaming_content), self.CONTEUDO)
+        self.assertEqual(resposta["ETag"], '"abc123"')
+        self.assertEqual(resposta["Accept-Ranges"], "bytes")
+        self.assertEqual(resposta["Content-Length"], str(len(self.CONTEUDO)))
+        self.assertIn("NF-2026-000001.pdf", resposta["Content-Disposition"])
+
+    def test_if_none_match(self):
+        for valor in ('"abc123"', 'W/"abc123"', '"outro", "abc123"', "*"):
+            with self.subTest(valor=valor):
+                resposta = self.baixar(if_none_match=valor)
+                self.assertEqual(resposta.status_code, 304)
+                self.assertEqual(resposta.content, b"")
+                self.assertEqual(resposta["ETag"], '"abc123"')
+
+        self.assertEqual(self.baixar(if_none_match='"outro"').status_code, 200)
+
+    def test_range(self):
+        tamanho = len(self.CONTEUDO)
+        casos = {
+            "bytes=10-19": (10, 19),
+            "bytes=1000-": (1000, tamanho - 1),
+            "bytes=-5": (tamanho - 5, tamanho - 1),
+            "bytes=1020-5000": (1020, tamanho - 1),
+        }
+        for cabecalho, (inicio, fim) in casos.items():
+            with self.subTest(range=cabecalho):
+                resposta = self.baixar(range=cabecalho)
+                self.assertEqual(resposta.status_code, 206)
+                self.assertEqual(resposta["Content-Range"], f"bytes {inicio}-{fim}/{tamanho}")
+                self.assertEqual(resposta["Content-Length"], str(fim - inicio + 1))
+                self.assertEqual(
+                    b"".join(resposta.streaming_content), self.CONTEUDO[inicio : fim + 1]
+                )
+
+    def test_range_insatisfazivel_e_if_range(self):
+        resposta = self.baixar(range=f"bytes={len(self.CONTEUDO)}-")
+        self.assertEqual(resposta.status_code, 416)
+        self.assertEqual(resposta["Content-Range"], f"bytes */{len(self.CONTEUDO)}")
+
+        # If-Range de outra versao: manda o arquivo inteiro.
+        resposta = self.baixar(range="bytes=10-19", if_range='"versao-antiga"')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(b"".join(resposta.streaming_content), self.CONTEUDO)
+
+        resposta = self.baixar(range="bytes=10-19", if_range='"abc123"')
+        self.assertEqual(resposta.status_code, 206)
+
+    @override_settings(PDF_X_ACCEL_PREFIX="/protegido/")
+    def test_x_accel_redirect(self):
+        resposta = self.baixar(range="bytes=10-19")
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta["X-Accel-Redirect"], f"/protegido/{self.pagamento.nf_pdf.name}")
+        self.assertEqual(resposta.content, b"")
+        self.assertEqual(resposta["ETag"], '"abc123"')
+        self.assertEqual(resposta["Content-Type"], "application/pdf")
+
+        self.assertEqual(self.baixar(if_none_match='"abc123"').status_code, 304)
+
+
+@override_settings(CACHES=LOCMEM, ALLOWED_HOSTS=["testserver"], DASHBOARD_CACHE_TTL=300)
+class DashboardCacheTests(TestCase):
+    """Cache compartilhado do dashboard: versao trocada no commit e uma entrada por nivel."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.financeiro = get_user_model().objects.create_superuser(
+            username="admin", email="admin@example.com", password="senha"
+        )
+        cls.basico = get_user_model().objects.create_user(username="secretaria", password="senha")
+        cls.turma = criar_turma()
+        hoje = timezone.localdate()
+        PagamentoAluno.objects.create(
+            aluno=criar_aluno(cls.turma, None, 0),
+            competencia=hoje.replace(day=1),
+            valor=Decimal("100.00"),
+            data_vencimento=hoje.replace(day=1) + timedelta(days=9),
+            data_pagamento=hoje,
+            forma_pagamento=PagamentoAluno.FormaPagamento.PIX,
+            status=PagamentoAluno.Status.PAGO,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def dashboard(self, usuario):
+        client = APIClient()
+        client.force_authenticate(usuario)
+        resposta = client.get(reverse("dashboard"), secure=True)
+        self.assertEqual(resposta.status_code, 200)
+        return resposta.data
+
+    def test_gravacao_invalida_depois_do_commit(self):
+        self.assertEqual(self.dashboard(self.financeiro)["stats"]["total_alunos"], 1)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            criar_aluno(self.turma, None, 1)
+            # Antes do commit a versao nao muda e o payload em cache continua valendo.
+            self.assertEqual(self.dashboard(self.financeiro)["stats"]["total_alunos"], 1)
+        self.assertTrue(callbacks)
+        for callback in callbacks:
+            callback()
+
+        self.assertEqual(self.dashboard(self.financeiro)["stats"]["total_alunos"], 2)
+        self.assertEqual(self.dashboard(self.basico)["stats"]["total_alunos"], 2)
+
+    def test_niveis_nao_compartilham_payload(self):
+        for ordem in ((self.basico, self.financeiro), (self.financeiro, self.basico)):
+            cache.clear()
+            with self.subTest(primeiro=ordem[0].username):
+                respostas = {usuario.username: self.dashboard(usuario) for usuario in ordem}
+                # Repetido com o cache quente de ambos os niveis.
+                for usuario in ordem:
+                    self.assertEqual(self.dashboard(usuario), respostas[usuario.username])
+
+                basico, financeiro = respostas["secretaria"], respostas["admin"]
+                self.assertEqual(basico["stats"]["receita_mes"], "0.00")
+                self.assertEqual(financeiro["stats"]["receita_mes"], "100.00")
+                self.assertNotIn(
+                    "pagamento", {atividade["type"] for atividade in basico["recent_activity"]}
+                )
+                self.assertIn(
+                    "pagamento", {atividade["type"] for atividade in financeiro["recent_activity"]}
+                )
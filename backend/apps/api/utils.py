@@ -1,8 +1,24 @@
 import calendar
-from decimal import Decimal
+from decimal import ROUND_HALF_UP, Decimal
 
-from django.db.models import DecimalField, ExpressionWrapper, F, Value
-from django.db.models.functions import Coalesce
+from django.conf import settings
+from django.db.models import (
+    Case,
+    CharField,
+    DateField,
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    Func,
+    IntegerField,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, Greatest, Round
+from django.db.models.lookups import Exact, GreaterThan, In
+from django.utils import timezone
+
+from apps.financeiro.models import PagamentoAluno, PlanoEducacional
 
 
 def can_access_financeiro(user):
@@ -13,6 +29,11 @@ def can_access_financeiro(user):
     return any(perm.startswith("financeiro.") for perm in user.get_all_permissions())
 
 
+def nivel_acesso(user):
+    """Nivel de permissao que define o que os dashboards mostram ao usuario."""
+    return "financeiro" if can_access_financeiro(user) else "basico"
+
+
 def shift_month(date_value, months):
     month_index = (date_value.month - 1) + months
     year = date_value.year + (month_index // 12)
@@ -21,12 +42,145 @@ def shift_month(date_value, months):
     return date_value.replace(year=year, month=month, day=day)
 
 
-def financeiro_expressions():
+class DiasEntre(Func):
+    """Dias inteiros entre duas datas (fim - inicio)."""
+
+    arity = 2
+    template = "(%(expressions)s)"
+    arg_joiner = " - "
+    output_field = IntegerField()
+
+    def __init__(self, inicio, fim, **extra):
+        super().__init__(fim, inicio, **extra)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler,
+            connection,
+            template="CAST(julianday(%(expressions)s) AS INTEGER)",
+            arg_joiner=") - julianday(",
+            **extra_context,
+        )
+
+
+class Percentual(Func):
+    """``expressao / 100`` sem divisao inteira no SQLite.
+
+    O SQLite guarda 704.00 e 2.00 como inteiros e 704 * 2 / 100 daria 14.
+    """
+
+    template = "(%(expressions)s / 100)"
+    output_field = DecimalField(max_digits=14, decimal_places=6)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection, template="(%(expressions)s / 100.0)", **extra_context
+        )
+
+
+def calculo_virtual_ativo():
+    return getattr(settings, "FINANCEIRO_CALCULO_VIRTUAL", False)
+
+
+def encargos_expressions(referencia=None):
+    """Multa, juros, dias de atraso e status calculados na consulta.
+
+    Segue as regras de PagamentoAluno.aplicar_regras para pagamentos em aberto;
+    PAGO e ISENTO mantem os valores gravados.
+    """
+    referencia = referencia or timezone.localdate()
+    decimal_field = DecimalField(max_digits=12, decimal_places=2)
+    zero = Value(Decimal("0.00"), output_field=decimal_field)
+    congelado = {"status__in": [PagamentoAluno.Status.PAGO, PagamentoAluno.Status.ISENTO]}
+
+    def do_plano(campo, padrao=None):
+        return Coalesce(
+            F(f"plano__{campo}"),
+            F(f"aluno__plano_financeiro__{campo}"),
+            padrao if padrao is not None else zero,
+        )
+
+    dias = Greatest(
+        DiasEntre(F("data_vencimento"), Value(referencia, output_field=DateField())),
+        Value(0),
+    )
+    # Base de multa e juros como em aplicar_regras: o valor liquido do plano
+    # (PlanoEducacional.calcular_valor_liquido), com o desconto exato e nao o
+    # gravado, que e arredondado para centavos.
+    valor = Coalesce(F("valor"), zero)
+    bolsa_tipo = do_plano("bolsa_tipo", Value(""))
+    bolsa = Case(
+        When(Exact(bolsa_tipo, PlanoEducacional.BolsaTipo.INTEGRAL), then=valor),
+        When(
+            In(
+                bolsa_tipo,
+                [PlanoEducacional.BolsaTipo.PARCIAL, PlanoEducacional.BolsaTipo.CONVENIO],
+            ),
+            then=Percentual(valor * do_plano("bolsa_percent")),
+        ),
+        default=zero,
+        output_field=DecimalField(max_digits=14, decimal_places=6),
+    )
+    base = Greatest(valor - Percentual(valor * do_plano("desconto_percent")) - bolsa, zero)
+    multa_calculada = Round(Percentual(base * do_plano("multa_percent")), 2)
+    juros_calculado = Round(
+        Percentual(
+            base * (do_plano("juros_percent") + do_plano("juros_diario_percent") * dias)
+        ),
+        2,
+    )
+    return {
+        "dias_atraso": Case(
+            When(**congelado, then=F("dias_atraso")),
+            default=dias,
+            output_field=IntegerField(),
+        ),
+        "multa": Case(
+            When(**congelado, then=Coalesce(F("multa"), zero)),
+            When(GreaterThan(dias, 0), then=multa_calculada),
+            default=zero,
+            output_field=decimal_field,
+        ),
+        "juros": Case(
+            When(**congelado, then=Coalesce(F("juros"), zero)),
+            When(GreaterThan(dias, 0), then=juros_calculado),
+            default=zero,
+            output_field=decimal_field,
+        ),
+        "status": Case(
+            When(**congelado, then=F("status")),
+            When(GreaterThan(dias, 0), then=Value(PagamentoAluno.Status.ATRASADO)),
+            default=Value(PagamentoAluno.Status.EM_ABERTO),
+            output_field=CharField(),
+        ),
+    }
+
+
+def anotar_encargos(queryset, referencia=None):
+    encargos = encargos_expressions(referencia)
+    _, valor_total, _ = financeiro_expressions(referencia=referencia, virtual=True)
+    return queryset.annotate(
+        dias_atraso_atual=encargos["dias_atraso"],
+        multa_atual=encargos["multa"],
+        juros_atual=encargos["juros"],
+        status_atual=encargos["status"],
+        valor_total_atual=valor_total,
+    )
+
+
+def financeiro_expressions(referencia=None, virtual=None):
+    if virtual is None:
+        virtual = calculo_virtual_ativo()
     zero = Value(Decimal("0.00"), output_field=DecimalField(max_digits=12, decimal_places=2))
     valor = Coalesce(F("valor"), zero)
     desconto = Coalesce(F("desconto"), zero)
-    multa = Coalesce(F("multa"), zero)
-    juros = Coalesce(F("juros"), zero)
+    if virtual:
+        encargos = encargos_expressions(referencia)
+        multa = encargos["multa"]
+        juros = encargos["juros"]
+    else:
+        multa = Coalesce(F("multa"), zero)
+        juros = Coalesce(F("juros"), zero)
     valor_total = ExpressionWrapper(
         valor - desconto + multa + juros,
         output_field=DecimalField(max_digits=12, decimal_places=2),
@@ -40,4 +194,5 @@ def financeiro_expressions():
 
 
 def decimal_str(value):
-    return str(value or Decimal("0.00"))
+    # Somas de DecimalField no SQLite voltam com casas extras.
+    return str((value or Decimal("0.00")).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP))
@@ -3,8 +3,9 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 
 from apps.contratos.models import Assinatura, Contrato, TemplateContrato
-from apps.contratos.services import gerar_pdf_contrato
+from apps.contratos.services import emitir_contratos_em_lote, gerar_pdf_contrato
 
+from ..downloads import pdf_download_response
 from ..serializers import AssinaturaSerializer, ContratoSerializer, TemplateContratoSerializer
 
 
@@ -48,6 +49,40 @@ class ContratoViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(contrato)
         return Response(serializer.data)
 
+    @action(detail=True, methods=["get"], url_path="pdf")
+    def download_pdf(self, request, pk=None):
+        contrato = self.get_object()
+        return pdf_download_response(
+            request,
+            contrato.pdf_gerado,
+            contrato.pdf_hash,
+            f"{contrato.numero or f'contrato-{contrato.pk}'}.pdf",
+        )
+
+    @action(detail=False, methods=["post"], url_path="gerar-pdf-lote")
+    def gerar_pdf_lote(self, request):
+        try:
+            ids = [int(pk) for pk in request.data.get("ids") or []]
+        except (TypeError, ValueError):
+            ids = []
+        if not ids:
+            return Response(
+                {"detail": "Informe a lista de ids dos contratos."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        contratos = list(self.filter_queryset(self.get_queryset()).filter(pk__in=ids).order_by("pk"))
+        relatorio = emitir_contratos_em_lote(contratos, request.user)
+        encontrados = {contrato.pk for contrato in contratos}
+        for pk in ids:
+            if pk not in encontrados:
+                relatorio.append(
+                    {"id": pk, "numero": "", "status": "ERRO", "erro": "Contrato nao encontrado."}
+                )
+        emitidos = sum(1 for item in relatorio if item["status"] == Contrato.Status.EMITIDO)
+        return Response(
+            {"emitidos": emitidos, "erros": len(relatorio) - emitidos, "itens": relatorio}
+        )
+
 
 class AssinaturaViewSet(viewsets.ModelViewSet):
     queryset = Assinatura.objects.select_related("contrato").all()
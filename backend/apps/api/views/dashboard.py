@@ -1,7 +1,6 @@
 from decimal import Decimal
+from functools import partial
 
-from django.conf import settings
-from django.core.cache import cache
 from django.db.models import Sum
 from django.utils import timezone
 from rest_framework import permissions
@@ -10,101 +9,132 @@ from rest_framework.views import APIView
 
 from apps.alunos.models import Aluno
 from apps.contratos.models import Contrato
-from apps.financeiro.models import PagamentoAluno
+from apps.financeiro.models import PagamentoAluno, ResumoPagamentoMensal
 from apps.turmas.models import Turma
 
-from ..utils import can_access_financeiro, financeiro_expressions
+from ..cache import obter_ou_calcular, versoes
+from ..utils import decimal_str, nivel_acesso
+
+DOMINIOS_DASHBOARD = ("alunos", "turmas", "contratos", "pagamentos")
+
+# Tipos de atividade recente que cada nivel de acesso pode ver.
+ATIVIDADES_POR_NIVEL = {
+    "basico": {"aluno", "contrato", "turma"},
+    "financeiro": {"aluno", "contrato", "turma", "pagamento"},
+}
+
+
+def _stats(nivel, today):
+    receita_mes = Decimal("0.00")
+    if nivel == "financeiro":
+        receita_mes = (
+            ResumoPagamentoMensal.objects.filter(
+                competencia=today.replace(day=1),
+                status=PagamentoAluno.Status.PAGO,
+            ).aggregate(total=Sum("valor_recebido"))
+        ).get("total") or Decimal("0.00")
+
+    return {
+        "total_alunos": Aluno.objects.count(),
+        "turmas_ativas": Turma.objects.filter(status=Turma.Status.ATIVA).count(),
+        "turnos_ativos": (
+            Turma.objects.filter(status=Turma.Status.ATIVA)
+            .values("turno")
+            .distinct()
+            .count()
+        ),
+        "contratos_emitidos": Contrato.objects.filter(status=Contrato.Status.EMITIDO).count(),
+        "receita_mes": decimal_str(receita_mes),
+    }
+
+
+def _atividades():
+    """Ultima atividade de cada tipo, da mais recente para a mais antiga.
+
+    Inclui todos os tipos; cada requisicao filtra os que o usuario pode ver.
+    """
+    atividades = []
+
+    def adicionar_atividade(tipo, mensagem, timestamp):
+        if not timestamp:
+            return
+        atividades.append(
+            {"type": tipo, "message": mensagem, "timestamp": timestamp}
+        )
+
+    ultimo_aluno = Aluno.objects.order_by("-created_at").first()
+    if ultimo_aluno:
+        adicionar_atividade(
+            "aluno",
+            f"Nova matricula: {ultimo_aluno.nome_completo}",
+            ultimo_aluno.created_at,
+        )
+
+    ultimo_pagamento = (
+        PagamentoAluno.objects.select_related("aluno")
+        .filter(status=PagamentoAluno.Status.PAGO)
+        .order_by("-created_at")
+        .first()
+    )
+    if ultimo_pagamento:
+        adicionar_atividade(
+            "pagamento",
+            f"Pagamento recebido: {ultimo_pagamento.aluno.nome_completo}",
+            ultimo_pagamento.created_at,
+        )
+
+    ultimo_contrato = (
+        Contrato.objects.filter(status=Contrato.Status.EMITIDO)
+        .order_by("-created_at")
+        .first()
+    )
+    if ultimo_contrato:
+        adicionar_atividade(
+            "contrato",
+            f"Contrato emitido: {ultimo_contrato.numero}",
+            ultimo_contrato.created_at,
+        )
+
+    ultima_turma = Turma.objects.order_by("-updated_at").first()
+    if ultima_turma:
+        adicionar_atividade(
+            "turma",
+            f"Turma {ultima_turma.nome} atualizada",
+            ultima_turma.updated_at,
+        )
+
+    atividades.sort(key=lambda item: item["timestamp"], reverse=True)
+    for atividade in atividades:
+        atividade["timestamp"] = atividade["timestamp"].isoformat()
+    return atividades
 
 
 class DashboardView(APIView):
+    """Resumo da tela inicial.
+
+    O cache e compartilhado, nao por usuario: os stats ficam em uma entrada por
+    nivel de acesso e as atividades recentes em uma entrada unica, filtrada por
+    permissao a cada requisicao (ver api.cache.obter_ou_calcular). O primeiro
+    acesso de cada nivel aquece o cache para todos os usuarios desse nivel.
+    """
+
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
         today = timezone.localdate()
-        can_access_financeiro = can_access_financeiro(request.user)
-        cache_key = f"dashboard:{request.user.pk or 'anon'}:{'fin' if can_access_financeiro else 'basic'}"
-        cached = cache.get(cache_key)
-        if cached:
-            return Response(cached)
-        receita_mes = Decimal("0.00")
-
-        if can_access_financeiro:
-            _, _, valor_recebido_expr = financeiro_expressions()
-            receita_mes = (
-                PagamentoAluno.objects.filter(
-                    competencia__year=today.year,
-                    competencia__month=today.month,
-                    status=PagamentoAluno.Status.PAGO,
-                ).aggregate(total=Sum(valor_recebido_expr))
-            ).get("total") or Decimal("0.00")
-
-        stats = {
-            "total_alunos": Aluno.objects.count(),
-            "turmas_ativas": Turma.objects.filter(status=Turma.Status.ATIVA).count(),
-            "turnos_ativos": (
-                Turma.objects.filter(status=Turma.Status.ATIVA)
-                .values("turno")
-                .distinct()
-                .count()
-            ),
-            "contratos_emitidos": Contrato.objects.filter(status=Contrato.Status.EMITIDO).count(),
-            "receita_mes": str(receita_mes),
-        }
-
-        atividades = []
-
-        def adicionar_atividade(tipo, mensagem, timestamp):
-            if not timestamp:
-                return
-            atividades.append(
-                {"type": tipo, "message": mensagem, "timestamp": timestamp}
-            )
-
-        ultimo_aluno = Aluno.objects.order_by("-created_at").first()
-        if ultimo_aluno:
-            adicionar_atividade(
-                "aluno",
-                f"Nova matricula: {ultimo_aluno.nome_completo}",
-                ultimo_aluno.created_at,
-            )
-
-        ultimo_pagamento = (
-            PagamentoAluno.objects.select_related("aluno")
-            .filter(status=PagamentoAluno.Status.PAGO)
-            .order_by("-created_at")
-            .first()
+        nivel = nivel_acesso(request.user)
+        versao = versoes(*DOMINIOS_DASHBOARD)
+        stats = obter_ou_calcular(
+            "dashboard:stats",
+            DOMINIOS_DASHBOARD,
+            (nivel, today.isoformat()),
+            partial(_stats, nivel, today),
+            versao=versao,
         )
-        if can_access_financeiro and ultimo_pagamento:
-            adicionar_atividade(
-                "pagamento",
-                f"Pagamento recebido: {ultimo_pagamento.aluno.nome_completo}",
-                ultimo_pagamento.created_at,
-            )
-
-        ultimo_contrato = (
-            Contrato.objects.filter(status=Contrato.Status.EMITIDO)
-            .order_by("-created_at")
-            .first()
+        atividades = obter_ou_calcular(
+            "dashboard:atividades", DOMINIOS_DASHBOARD, (), _atividades, versao=versao
         )
-        if ultimo_contrato:
-            adicionar_atividade(
-                "contrato",
-                f"Contrato emitido: {ultimo_contrato.numero}",
-                ultimo_contrato.created_at,
-            )
-
-        ultima_turma = Turma.objects.order_by("-updated_at").first()
-        if ultima_turma:
-            adicionar_atividade(
-                "turma",
-                f"Turma {ultima_turma.nome} atualizada",
-                ultima_turma.updated_at,
-            )
-
-        atividades.sort(key=lambda item: item["timestamp"], reverse=True)
-        for atividade in atividades:
-            atividade["timestamp"] = atividade["timestamp"].isoformat()
-
-        payload = {"stats": stats, "recent_activity": atividades[:4]}
-        cache.set(cache_key, payload, timeout=getattr(settings, "DASHBOARD_CACHE_TTL", 30))
-        return Response(payload)
+
+        permitidas = ATIVIDADES_POR_NIVEL[nivel]
+        recentes = [atividade for atividade in atividades if atividade["type"] in permitidas]
+        return Response({"stats": stats, "recent_activity": recentes[:4]})
@@ -1,33 +1,58 @@
 import calendar
+from collections import defaultdict
 from datetime import timedelta
 from decimal import Decimal
+from functools import partial
 
-from django.db.models import Case, Count, DecimalField, Q, Sum, Value, When
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, Q, Sum, Value
 from django.db.models.functions import Coalesce, TruncMonth
+from django.http import StreamingHttpResponse
 from django.utils import timezone
-from rest_framework import permissions, serializers, status, viewsets
+from rest_framework import filters, permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from apps.alunos.models import Aluno
+from apps.financeiro.arquivo import ConsultaArquivo
+from apps.financeiro.auditoria import historico_em_lote, registrar_historico
+from apps.financeiro.exportacao import exportar_notas, notas_do_mes, parse_competencia
+from apps.financeiro.jobs import enfileirar_recalculo
 from apps.financeiro.models import (
     Despesa,
+    HistoricoArquivo,
     PagamentoAluno,
     PagamentoAlunoHistorico,
     PagamentoProfessor,
     PlanoEducacional,
+    RecalculoJob,
+    ResumoPagamentoMensal,
 )
+from apps.financeiro.recalculo import diff_pagamento, snapshot_pagamento
 from apps.turmas.models import Turma
 
+from ..cache import obter_ou_calcular
+from ..downloads import pdf_download_response
 from ..serializers import (
     DespesaSerializer,
     PagamentoAlunoHistoricoSerializer,
     PagamentoAlunoSerializer,
     PagamentoProfessorSerializer,
     PlanoEducacionalSerializer,
+    RecalculoJobSerializer,
 )
-from ..utils import can_access_financeiro, decimal_str, financeiro_expressions, shift_month
+from ..utils import (
+    anotar_encargos,
+    calculo_virtual_ativo,
+    can_access_financeiro,
+    decimal_str,
+    financeiro_expressions,
+    shift_month,
+)
+
+# Dominios lidos pelo dashboard financeiro e pelos relatorios (ver api.cache).
+DOMINIOS_FINANCEIRO = ("pagamentos", "alunos", "turmas")
 
 
 class PlanoEducacionalViewSet(viewsets.ModelViewSet):
@@ -53,67 +78,50 @@ class PagamentoAlunoViewSet(viewsets.ModelViewSet):
         aluno_id = self.request.query_params.get("aluno")
         if aluno_id:
             queryset = queryset.filter(aluno_id=aluno_id)
+        if calculo_virtual_ativo() and self.action in {"list", "retrieve"}:
+            queryset = anotar_encargos(queryset)
         return queryset
 
     def perform_create(self, serializer):
-        instance = serializer.save()
-        instance.aplicar_regras()
-        instance.save()
-        self._registrar_historico(
-            instance,
-            PagamentoAlunoHistorico.Acao.CRIADO,
-            status_novo=instance.status,
-            detalhes={"origem": "api"},
-        )
-        self._emitir_nf_se_pago(instance)
-
-    def perform_update(self, serializer):
-        before = self._snapshot(serializer.instance)
-        instance = serializer.save()
-        instance.aplicar_regras()
-        instance.save()
-        changes = self._diff(before, instance)
-        if changes:
-            acao = (
-                PagamentoAlunoHistorico.Acao.STATUS
-                if "status" in changes
-                else PagamentoAlunoHistorico.Acao.ATUALIZADO
-            )
+        with historico_em_lote():
+            instance = serializer.save()
+            instance.aplicar_regras()
+            instance.save()
             self._registrar_historico(
                 instance,
-                acao,
-                status_anterior=before.get("status"),
+                PagamentoAlunoHistorico.Acao.CRIADO,
                 status_novo=instance.status,
-                detalhes=changes,
+                detalhes={"origem": "api"},
             )
-        self._emitir_nf_se_pago(instance)
+            self._emitir_nf_se_pago(instance)
+
+    def perform_update(self, serializer):
+        with historico_em_lote():
+            before = self._snapshot(serializer.instance)
+            instance = serializer.save()
+            instance.aplicar_regras()
+            instance.save()
+            changes = self._diff(before, instance)
+            if changes:
+                acao = (
+                    PagamentoAlunoHistorico.Acao.STATUS
+                    if "status" in changes
+                    else PagamentoAlunoHistorico.Acao.ATUALIZADO
+                )
+                self._registrar_historico(
+                    instance,
+                    acao,
+                    status_anterior=before.get("status"),
+                    status_novo=instance.status,
+                    detalhes=changes,
+                )
+            self._emitir_nf_se_pago(instance)
 
     def _snapshot(self, instance):
-        fields = [
-            "status",
-            "forma_pagamento",
-            "data_pagamento",
-            "data_vencimento",
-            "valor",
-            "valor_pago",
-            "desconto",
-            "multa",
-            "juros",
-            "dias_atraso",
-            "plano_id",
-        ]
-        return {field: getattr(instance, field) for field in fields}
+        return snapshot_pagamento(instance)
 
     def _diff(self, before, instance):
-        changes = {}
-        for field, old_value in before.items():
-            new_value = getattr(instance, field)
-            if old_value != new_value:
-                changes[field] = {
-                    "de": str(old_value) if old_value is not None else None,
-                    "para": str(new_value) if new_value is not None else None,
-                }
-        return changes
+        return diff_pagamento(before, instance)
 
     def _registrar_historico(
         self,
@@ -123,71 +131,90 @@ class PagamentoAlunoViewSet(viewsets.ModelViewSet):
         status_novo=None,
         detalhes=None,
     ):
-        PagamentoAlunoHistorico.objects.create(
-            pagamento=instance,
-            acao=acao,
+        return registrar_historico(
+            instance,
+            acao,
             status_anterior=status_anterior,
             status_novo=status_novo,
-            valor_devido=instance.valor_total,
-            valor_pago=instance.valor_pago or Decimal("0.00"),
-            alterado_por=(
+            detalhes=detalhes,
+            user=(
                 self.request.user if self.request.user and self.request.user.is_authenticated else None
             ),
-            detalhes=detalhes,
         )
 
     def _emitir_nf_se_pago(self, instance):
         if instance.status != PagamentoAluno.Status.PAGO:
             return
-        had_nf = bool(instance.nf_pdf)
         update_fields = []
         if not instance.data_pagamento:
             instance.data_pagamento = timezone.localdate()
             update_fields.append("data_pagamento")
         if update_fields:
             instance.save(update_fields=update_fields + ["updated_at"])
-        try:
-            instance.emitir_nf(user=self.request.user)
-        except Exception as exc:
-            raise serializers.ValidationError({"detail": str(exc)}) from exc
-        if not had_nf and instance.nf_pdf:
-            self._registrar_historico(
-                instance,
-                PagamentoAlunoHistorico.Acao.NF,
-                status_novo=instance.status,
-                detalhes={"nf_numero": instance.nf_numero},
-            )
+        # O PDF e gerado pelo worker processar_notas_fiscais, que tambem registra
+        # o historico de NF.
+        instance.enfileirar_nf(user=self.request.user)
 
     @action(detail=False, methods=["post"])
     def recalcular(self, request):
-        queryset = self.filter_queryset(self.get_queryset()).exclude(
-            status=PagamentoAluno.Status.PAGO
+        params = request.query_params
+        parametros = {
+            "aluno": params.get("aluno") or None,
+            "search": params.get("search") or "",
+            "incremental": str(params.get("incremental", "")).lower() in {"1", "true", "yes"},
+            "vetorizado": str(params.get("vetorizado", "")).lower() in {"1", "true", "yes"},
+        }
+        user = request.user if request.user and request.user.is_authenticated else None
+        job, criado = enfileirar_recalculo(parametros, user=user)
+        return Response(
+            RecalculoJobSerializer(job).data,
+            status=status.HTTP_202_ACCEPTED if criado else status.HTTP_200_OK,
         )
-        updated = 0
-        historico = 0
-        for pagamento in queryset:
-            before = self._snapshot(pagamento)
-            pagamento.aplicar_regras()
-            changes = self._diff(before, pagamento)
-            if not changes:
-                continue
-            pagamento.save()
-            updated += 1
-            acao = (
-                PagamentoAlunoHistorico.Acao.STATUS
-                if "status" in changes
-                else PagamentoAlunoHistorico.Acao.ATUALIZADO
-            )
-            self._registrar_historico(
-                pagamento,
-                acao,
-                status_anterior=before.get("status"),
-                status_novo=pagamento.status,
-                detalhes=changes,
+
+    @action(detail=False, methods=["get"], url_path=r"recalcular/(?P<job_id>[0-9]+)")
+    def recalcular_status(self, request, job_id=None):
+        job = RecalculoJob.objects.filter(pk=job_id).first()
+        if not job:
+            return Response(
+                {"detail": "Job de recalculo nao encontrado."},
+                status=status.HTTP_404_NOT_FOUND,
             )
-            historico += 1
+        return Response(RecalculoJobSerializer(job).data)
 
-        return Response({"updated": updated, "historico": historico})
+    @action(detail=False, methods=["get"], url_path="notas-fiscais/exportar")
+    def exportar_notas_fiscais(self, request):
+        params = request.query_params
+        formato = params.get("formato", "zip")
+        try:
+            competencia = parse_competencia(params.get("competencia"))
+            conteudo = exportar_notas(
+                notas_do_mes(
+                    competencia,
+                    turma=params.get("turma") or None,
+                    forma_pagamento=params.get("forma_pagamento") or None,
+                ),
+                formato,
+            )
+        except (RuntimeError, ValueError) as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        resposta = StreamingHttpResponse(
+            conteudo,
+            content_type="application/pdf" if formato == "pdf" else "application/zip",
+        )
+        resposta["Content-Disposition"] = (
+            f'attachment; filename="notas-fiscais-{competencia:%Y-%m}.{formato}"'
+        )
+        return resposta
+
+    @action(detail=True, methods=["get"], url_path="nf")
+    def download_nf(self, request, pk=None):
+        pagamento = self.get_object()
+        return pdf_download_response(
+            request,
+            pagamento.nf_pdf,
+            pagamento.nf_hash,
+            f"{pagamento.nf_numero or f'pagamento-{pagamento.pk}'}.pdf",
+        )
 
 
 class PagamentoAlunoHistoricoViewSet(viewsets.ReadOnlyModelViewSet):
@@ -214,6 +241,97 @@ class PagamentoAlunoHistoricoViewSet(viewsets.ReadOnlyModelViewSet):
             queryset = queryset.filter(pagamento__aluno_id=aluno_id)
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        pagamento_id = request.query_params.get("pagamento")
+        aluno_id = request.query_params.get("aluno")
+        if not (pagamento_id or aluno_id) or not HistoricoArquivo.objects.exists():
+            return super().list(request, *args, **kwargs)
+
+        # Historicos anteriores ao horizonte de retencao estao nos arquivos
+        # mensais. O banco e paginado em SQL; um arquivo so e lido quando a
+        # pagina chega nos registros dele.
+        queryset = self.filter_queryset(self.get_queryset())
+        filtro = {
+            "pagamento_id": pagamento_id,
+            "aluno_id": aluno_id,
+            "buscas": self._buscas(request),
+        }
+        campo = (queryset.query.order_by or PagamentoAlunoHistorico._meta.ordering)[0]
+        descendente = campo.startswith("-")
+        if campo.lstrip("-") == "acao":
+            segmentos = []
+            for acao in sorted(PagamentoAlunoHistorico.Acao.values, reverse=descendente):
+                segmentos.append(_Serializados(queryset.filter(acao=acao), self.get_serializer))
+                segmentos.append(ConsultaArquivo(acao=acao, **filtro))
+        else:
+            vivos = _Serializados(queryset, self.get_serializer)
+            arquivados = ConsultaArquivo(descendente=descendente, **filtro)
+            segmentos = [vivos, arquivados] if descendente else [arquivados, vivos]
+
+        registros = _Concatenados(segmentos)
+        page = self.paginate_queryset(registros)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(registros[:])
+
+    def _buscas(self, request):
+        """Ids de alunos e usuarios de cada termo de busca (mesmos search_fields)."""
+        buscas = []
+        for termo in filters.SearchFilter().get_search_terms(request):
+            alunos = set(
+                Aluno.objects.filter(
+                    Q(nome_completo__icontains=termo) | Q(cpf__icontains=termo)
+                ).values_list("id", flat=True)
+            )
+            usuarios = set(
+                get_user_model()
+                .objects.filter(username__icontains=termo)
+                .values_list("id", flat=True)
+            )
+            buscas.append((alunos, usuarios))
+        return buscas
+
+
+class _Serializados:
+    """Queryset paginado em SQL que devolve as linhas ja serializadas."""
+
+    def __init__(self, queryset, get_serializer):
+        self.queryset = queryset
+        self.get_serializer = get_serializer
+        self._total = None
+
+    def count(self):
+        if self._total is None:
+            self._total = self.queryset.count()
+        return self._total
+
+    def __getitem__(self, fatia):
+        return list(self.get_serializer(self.queryset[fatia], many=True).data)
+
+
+class _Concatenados:
+    """Segmentos com ``count()`` e fatiamento vistos como uma lista so."""
+
+    def __init__(self, segmentos):
+        self.segmentos = segmentos
+
+    def count(self):
+        return sum(segmento.count() for segmento in self.segmentos)
+
+    def __getitem__(self, fatia):
+        inicio = fatia.start or 0
+        fim = self.count() if fatia.stop is None else fatia.stop
+        resultado = []
+        posicao = 0
+        for segmento in self.segmentos:
+            if posicao >= fim:
+                break
+            total = segmento.count()
+            if posicao + total > inicio:
+                resultado.extend(segmento[max(inicio - posicao, 0) : min(fim - posicao, total)])
+            posicao += total
+        return resultado
+
 
 class PagamentoProfessorViewSet(viewsets.ModelViewSet):
     queryset = PagamentoProfessor.objects.select_related("professor").all()
@@ -246,221 +364,268 @@ class FinanceiroDashboardView(APIView):
         except ValueError:
             months = 12
         months = min(max(months, 1), 36)
+        payload = obter_ou_calcular(
+            "financeiro:dashboard",
+            DOMINIOS_FINANCEIRO,
+            (today.isoformat(), months),
+            partial(self._payload, today, months),
+        )
+        return Response(payload)
+
+    def _payload(self, today, months):
         start = shift_month(today.replace(day=1), -(months - 1))
 
-        zero, valor_total_expr, valor_recebido_expr = financeiro_expressions()
-        base_qs = PagamentoAluno.objects.select_related(
-            "aluno",
-            "aluno__turma",
-            "plano",
-            "aluno__plano_financeiro",
-        )
-        period_qs = base_qs.filter(competencia__gte=start, competencia__lte=today)
-        paid_qs = period_qs.filter(status=PagamentoAluno.Status.PAGO)
-
-        receita_mes = (
-            paid_qs.filter(
-                competencia__year=today.year,
-                competencia__month=today.month,
-            ).aggregate(total=Sum(valor_recebido_expr))
-        ).get("total") or Decimal("0.00")
-
-        receita_periodo = (
-            paid_qs.aggregate(total=Sum(valor_recebido_expr))
-        ).get("total") or Decimal("0.00")
-
-        mes_qs = period_qs.filter(
-            competencia__year=today.year,
-            competencia__month=today.month,
-        )
-        total_mes = mes_qs.exclude(status=PagamentoAluno.Status.ISENTO).count()
-        inadimplentes_mes = mes_qs.filter(
-            status__in=[PagamentoAluno.Status.EM_ABERTO, PagamentoAluno.Status.ATRASADO]
-        ).count()
+        # Com o calculo virtual os encargos e o status dos pagamentos em aberto so
+        # existem na consulta, entao o resumo mensal (valores gravados) nao serve.
+        if calculo_virtual_ativo():
+            series = self._series_ao_vivo(today, start)
+        else:
+            series = self._series_resumo(today, start)
+
         taxa_inadimplencia = (
-            (inadimplentes_mes / total_mes) * 100 if total_mes else 0
+            (series["inadimplentes_mes"] / series["total_mes"]) * 100
+            if series["total_mes"]
+            else 0
         )
 
-        inadimplentes_alunos = (
-            PagamentoAluno.objects.filter(
-                status__in=[PagamentoAluno.Status.EM_ABERTO, PagamentoAluno.Status.ATRASADO],
-                data_vencimento__lt=today,
-            )
-            .values("aluno_id")
-            .distinct()
-            .count()
+        # Contagens de alunos distintos nao somam entre grupos: as duas saem de um
+        # unico aggregate com filtros.
+        inadimplente = Q(
+            status__in=[PagamentoAluno.Status.EM_ABERTO, PagamentoAluno.Status.ATRASADO],
+            data_vencimento__lt=today,
         )
+        pagante = Q(
+            status=PagamentoAluno.Status.PAGO,
+            competencia__gte=start,
+            competencia__lte=today,
+        )
+        alunos = PagamentoAluno.objects.filter(inadimplente | pagante).aggregate(
+            inadimplentes=Count("aluno_id", distinct=True, filter=inadimplente),
+            pagantes=Count("aluno_id", distinct=True, filter=pagante),
+        )
+        inadimplentes_alunos = alunos["inadimplentes"]
+        alunos_receita = alunos["pagantes"]
         total_alunos = Aluno.objects.count()
         adimplentes_alunos = max(total_alunos - inadimplentes_alunos, 0)
 
-        receita_por_turma = []
-        for item in (
-            paid_qs.values("aluno__turma__id", "aluno__turma__nome")
-            .annotate(total=Sum(valor_recebido_expr))
-            .order_by("-total")
-        ):
-            receita_por_turma.append(
-                {
-                    "turma_id": item["aluno__turma__id"],
-                    "turma": item["aluno__turma__nome"] or "Sem turma",
-                    "total": decimal_str(item["total"]),
-                }
+        receita_periodo = series["receita_periodo"]
+        ticket_medio = receita_periodo / alunos_receita if alunos_receita else Decimal("0.00")
+
+        return {
+            "periodo": {
+                "inicio": start.isoformat(),
+                "fim": today.isoformat(),
+                "meses": months,
+            },
+            "kpis": {
+                "receita_mes": decimal_str(series["receita_mes"]),
+                "receita_periodo": decimal_str(receita_periodo),
+                "taxa_inadimplencia": f"{taxa_inadimplencia:.2f}",
+                "alunos_adimplentes": adimplentes_alunos,
+                "alunos_inadimplentes": inadimplentes_alunos,
+                "ticket_medio": decimal_str(ticket_medio),
+            },
+            "charts": {
+                "receita_mensal": series["receita_mensal"],
+                "pagamentos_por_turma": series["pagamentos_por_turma"],
+                "status_pagamentos": series["status_pagamentos"],
+                "inadimplencia_heatmap": series["inadimplencia_heatmap"],
+                "previsto_vs_realizado": series["previsto_vs_realizado"],
+                "receita_por_turma": series["receita_por_turma"],
+                "receita_por_plano": series["receita_por_plano"],
+            },
+        }
+
+    def _series_resumo(self, today, start):
+        """Series do periodo lidas de ResumoPagamentoMensal."""
+        linhas = ResumoPagamentoMensal.objects.filter(
+            competencia__gte=start,
+            competencia__lte=today,
+            quantidade__gt=0,
+        ).values(
+            "competencia",
+            "vencimento",
+            "turma_id",
+            "plano_id",
+            "status",
+            "quantidade",
+            "valor_total",
+            "valor_recebido",
+        )
+        return self._montar_series(list(linhas), today)
+
+    def _series_ao_vivo(self, today, start):
+        """Series do periodo com o calculo virtual, em uma unica consulta agrupada.
+
+        Cada grupo (mes, mes de vencimento, turma, plano) traz contagem e somas
+        por status em colunas condicionais; as linhas sao desdobradas por status
+        no mesmo formato do resumo mensal.
+        """
+        _, valor_total_expr, valor_recebido_expr = financeiro_expressions(
+            referencia=today, virtual=True
+        )
+        queryset = anotar_encargos(
+            PagamentoAluno.objects.filter(competencia__gte=start, competencia__lte=today),
+            referencia=today,
+        )
+
+        situacoes = PagamentoAluno.Status.values
+        agregados = {}
+        for situacao in situacoes:
+            filtro = Q(status_atual=situacao)
+            agregados[f"quantidade_{situacao}"] = Count("id", filter=filtro)
+            agregados[f"total_{situacao}"] = Sum(valor_total_expr, filter=filtro)
+            agregados[f"recebido_{situacao}"] = Sum(valor_recebido_expr, filter=filtro)
+        grupos = (
+            queryset.order_by()
+            .annotate(
+                mes=TruncMonth("competencia"),
+                mes_vencimento=TruncMonth("data_vencimento"),
+                turma_ref=Coalesce(F("aluno__turma_id"), Value(0)),
+                plano_ref=Coalesce(F("plano_id"), F("aluno__plano_financeiro_id"), Value(0)),
             )
+            .values("mes", "mes_vencimento", "turma_ref", "plano_ref")
+            .annotate(**agregados)
+        )
 
-        receita_por_plano = []
-        for item in (
-            paid_qs.annotate(
-                plano_nome=Coalesce(
-                    "plano__nome",
-                    "aluno__plano_financeiro__nome",
-                    Value("Sem plano"),
+        linhas = []
+        for grupo in grupos:
+            for situacao in situacoes:
+                quantidade = grupo[f"quantidade_{situacao}"]
+                if not quantidade:
+                    continue
+                linhas.append(
+                    {
+                        "competencia": grupo["mes"],
+                        "vencimento": grupo["mes_vencimento"],
+                        "turma_id": grupo["turma_ref"],
+                        "plano_id": grupo["plano_ref"],
+                        "status": situacao,
+                        "quantidade": quantidade,
+                        "valor_total": grupo[f"total_{situacao}"] or Decimal("0.00"),
+                        "valor_recebido": grupo[f"recebido_{situacao}"] or Decimal("0.00"),
+                    }
                 )
+        return self._montar_series(linhas, today)
+
+    def _montar_series(self, linhas, today):
+        """KPIs mensais e graficos a partir das linhas agregadas por status."""
+        turmas = dict(
+            Turma.objects.filter(pk__in={linha["turma_id"] for linha in linhas}).values_list(
+                "id", "nome"
             )
-            .values("plano_nome")
-            .annotate(total=Sum(valor_recebido_expr))
-            .order_by("-total")
-        ):
-            receita_por_plano.append(
-                {
-                    "plano": item["plano_nome"],
-                    "total": decimal_str(item["total"]),
-                }
-            )
+        )
+        planos = dict(
+            PlanoEducacional.objects.filter(
+                pk__in={linha["plano_id"] for linha in linhas}
+            ).values_list("id", "nome")
+        )
+
+        mes_atual = today.replace(day=1)
+        em_aberto = {PagamentoAluno.Status.EM_ABERTO, PagamentoAluno.Status.ATRASADO}
+        receita_mes = Decimal("0.00")
+        receita_periodo = Decimal("0.00")
+        total_mes = 0
+        inadimplentes_mes = 0
+        receita_turma = defaultdict(lambda: Decimal("0.00"))
+        pagamentos_turma = defaultdict(int)
+        receita_plano = defaultdict(lambda: Decimal("0.00"))
+        por_status = defaultdict(int)
+        receita_mensal = defaultdict(lambda: Decimal("0.00"))
+        heatmap = defaultdict(lambda: [0, Decimal("0.00")])
+        previsto = defaultdict(lambda: [Decimal("0.00"), Decimal("0.00")])
+
+        for linha in linhas:
+            situacao = linha["status"]
+            quantidade = linha["quantidade"]
+            competencia = linha["competencia"]
+            turma_id = linha["turma_id"] or None
+            por_status[situacao] += quantidade
+            pagamentos_turma[turma_id] += quantidade
+            if situacao != PagamentoAluno.Status.ISENTO:
+                previsto[competencia][0] += linha["valor_total"]
+            if situacao in em_aberto:
+                heatmap[linha["vencimento"]][0] += quantidade
+                heatmap[linha["vencimento"]][1] += linha["valor_total"]
+            if competencia == mes_atual:
+                if situacao != PagamentoAluno.Status.ISENTO:
+                    total_mes += quantidade
+                if situacao in em_aberto:
+                    inadimplentes_mes += quantidade
+            if situacao != PagamentoAluno.Status.PAGO:
+                continue
+            recebido = linha["valor_recebido"]
+            receita_periodo += recebido
+            if competencia == mes_atual:
+                receita_mes += recebido
+            receita_turma[turma_id] += recebido
+            receita_plano[planos.get(linha["plano_id"]) or "Sem plano"] += recebido
+            receita_mensal[competencia] += recebido
+            previsto[competencia][1] += recebido
 
         status_labels = dict(PagamentoAluno.Status.choices)
-        status_pagamentos = []
-        for item in (
-            period_qs.values("status")
-            .annotate(total=Count("id"))
-            .order_by("-total")
-        ):
-            status_value = item["status"]
-            status_pagamentos.append(
+        return {
+            "receita_mes": receita_mes,
+            "receita_periodo": receita_periodo,
+            "total_mes": total_mes,
+            "inadimplentes_mes": inadimplentes_mes,
+            "receita_por_turma": [
                 {
-                    "status": status_value,
-                    "label": status_labels.get(status_value, status_value),
-                    "total": item["total"],
+                    "turma_id": turma_id,
+                    "turma": turmas.get(turma_id) or "Sem turma",
+                    "total": decimal_str(total),
                 }
-            )
-
-        evolucao_receita = []
-        for item in (
-            paid_qs.annotate(mes=TruncMonth("competencia"))
-            .values("mes")
-            .annotate(total=Sum(valor_recebido_expr))
-            .order_by("mes")
-        ):
-            mes = item["mes"]
-            evolucao_receita.append(
+                for turma_id, total in sorted(
+                    receita_turma.items(), key=lambda item: item[1], reverse=True
+                )
+            ],
+            "receita_por_plano": [
+                {"plano": plano, "total": decimal_str(total)}
+                for plano, total in sorted(
+                    receita_plano.items(), key=lambda item: item[1], reverse=True
+                )
+            ],
+            "status_pagamentos": [
                 {
-                    "mes": mes.strftime("%Y-%m") if mes else "",
-                    "total": decimal_str(item["total"]),
+                    "status": situacao,
+                    "label": status_labels.get(situacao, situacao),
+                    "total": total,
                 }
-            )
-
-        pagamentos_por_turma = []
-        for item in (
-            period_qs.values("aluno__turma__id", "aluno__turma__nome")
-            .annotate(total=Count("id"))
-            .order_by("-total")
-        ):
-            pagamentos_por_turma.append(
+                for situacao, total in sorted(
+                    por_status.items(), key=lambda item: item[1], reverse=True
+                )
+            ],
+            "receita_mensal": [
+                {"mes": mes.strftime("%Y-%m"), "total": decimal_str(total)}
+                for mes, total in sorted(receita_mensal.items())
+            ],
+            "pagamentos_por_turma": [
                 {
-                    "turma_id": item["aluno__turma__id"],
-                    "turma": item["aluno__turma__nome"] or "Sem turma",
-                    "total": item["total"],
+                    "turma_id": turma_id,
+                    "turma": turmas.get(turma_id) or "Sem turma",
+                    "total": total,
                 }
-            )
-
-        inadimplencia_heatmap = []
-        for item in (
-            period_qs.filter(
-                status__in=[PagamentoAluno.Status.EM_ABERTO, PagamentoAluno.Status.ATRASADO]
-            )
-            .exclude(data_vencimento__isnull=True)
-            .annotate(mes=TruncMonth("data_vencimento"))
-            .values("mes")
-            .annotate(
-                total=Count("id"),
-                valor=Sum(valor_total_expr),
-            )
-            .order_by("mes")
-        ):
-            mes = item["mes"]
-            inadimplencia_heatmap.append(
+                for turma_id, total in sorted(
+                    pagamentos_turma.items(), key=lambda item: item[1], reverse=True
+                )
+            ],
+            "inadimplencia_heatmap": [
                 {
-                    "mes": mes.strftime("%Y-%m") if mes else "",
-                    "inadimplentes": item["total"],
-                    "valor": decimal_str(item["valor"]),
+                    "mes": mes.strftime("%Y-%m"),
+                    "inadimplentes": total,
+                    "valor": decimal_str(valor),
                 }
-            )
-
-        previsto_realizado = []
-        for item in (
-            period_qs.annotate(mes=TruncMonth("competencia"))
-            .values("mes")
-            .annotate(
-                previsto=Sum(
-                    Case(
-                        When(status=PagamentoAluno.Status.ISENTO, then=zero),
-                        default=valor_total_expr,
-                        output_field=DecimalField(max_digits=12, decimal_places=2),
-                    )
-                ),
-                realizado=Sum(
-                    Case(
-                        When(status=PagamentoAluno.Status.PAGO, then=valor_recebido_expr),
-                        default=zero,
-                        output_field=DecimalField(max_digits=12, decimal_places=2),
-                    )
-                ),
-            )
-            .order_by("mes")
-        ):
-            mes = item["mes"]
-            previsto_realizado.append(
+                for mes, (total, valor) in sorted(heatmap.items())
+            ],
+            "previsto_vs_realizado": [
                 {
-                    "mes": mes.strftime("%Y-%m") if mes else "",
-                    "previsto": decimal_str(item["previsto"]),
-                    "realizado": decimal_str(item["realizado"]),
+                    "mes": mes.strftime("%Y-%m"),
+                    "previsto": decimal_str(valor_previsto),
+                    "realizado": decimal_str(realizado),
                 }
-            )
-
-        receita_media = (
-            paid_qs.aggregate(
-                total=Sum(valor_recebido_expr),
-                alunos=Count("aluno", distinct=True),
-            )
-        )
-        total_receita = receita_media.get("total") or Decimal("0.00")
-        alunos_receita = receita_media.get("alunos") or 0
-        ticket_medio = total_receita / alunos_receita if alunos_receita else Decimal("0.00")
-
-        payload = {
-            "periodo": {
-                "inicio": start.isoformat(),
-                "fim": today.isoformat(),
-                "meses": months,
-            },
-            "kpis": {
-                "receita_mes": decimal_str(receita_mes),
-                "receita_periodo": decimal_str(receita_periodo),
-                "taxa_inadimplencia": f"{taxa_inadimplencia:.2f}",
-                "alunos_adimplentes": adimplentes_alunos,
-                "alunos_inadimplentes": inadimplentes_alunos,
-                "ticket_medio": decimal_str(ticket_medio),
-            },
-            "charts": {
-                "receita_mensal": evolucao_receita,
-                "pagamentos_por_turma": pagamentos_por_turma,
-                "status_pagamentos": status_pagamentos,
-                "inadimplencia_heatmap": inadimplencia_heatmap,
-                "previsto_vs_realizado": previsto_realizado,
-                "receita_por_turma": receita_por_turma,
-                "receita_por_plano": receita_por_plano,
-            },
+                for mes, (valor_previsto, realizado) in sorted(previsto.items())
+            ],
         }
-        return Response(payload)
 
 
 class FinanceiroRelatoriosView(APIView):
@@ -474,13 +639,28 @@ class FinanceiroRelatoriosView(APIView):
             )
 
         today = timezone.localdate()
-        _, valor_total_expr, valor_recebido_expr = financeiro_expressions()
+        proj_months = request.query_params.get("projecao")
+        try:
+            proj_months = int(proj_months) if proj_months else 6
+        except ValueError:
+            proj_months = 6
+        proj_months = min(max(proj_months, 1), 24)
+        payload = obter_ou_calcular(
+            "financeiro:relatorios",
+            DOMINIOS_FINANCEIRO,
+            (today.isoformat(), proj_months),
+            partial(self._payload, today, proj_months),
+        )
+        return Response(payload)
 
+    def _payload(self, today, proj_months):
         limite = today - timedelta(days=30)
         inadimplentes_qs = PagamentoAluno.objects.select_related("aluno", "aluno__turma").filter(
             status__in=[PagamentoAluno.Status.EM_ABERTO, PagamentoAluno.Status.ATRASADO],
             data_vencimento__lt=limite,
         )
+        if calculo_virtual_ativo():
+            inadimplentes_qs = anotar_encargos(inadimplentes_qs, referencia=today)
         inadimplentes_map = {}
         for pagamento in inadimplentes_qs:
             if not pagamento.data_vencimento:
@@ -496,7 +676,10 @@ class FinanceiroRelatoriosView(APIView):
                     "valor_devido": Decimal("0.00"),
                     "ultimo_vencimento": pagamento.data_vencimento,
                 }
-            item["valor_devido"] += pagamento.valor_total
+            valor_total = getattr(pagamento, "valor_total_atual", None)
+            item["valor_devido"] += (
+                valor_total if valor_total is not None else pagamento.valor_total
+            )
             if dias_atraso > item["dias_atraso"]:
                 item["dias_atraso"] = dias_atraso
                 item["ultimo_vencimento"] = pagamento.data_vencimento
@@ -520,51 +703,52 @@ class FinanceiroRelatoriosView(APIView):
             )
         inadimplentes.sort(key=lambda x: x["dias_atraso"], reverse=True)
 
+        # Totais historicos vem do resumo mensal: receita de PAGO e contagem por
+        # status gravado nao dependem do calculo virtual.
+        resumo_qs = ResumoPagamentoMensal.objects.filter(quantidade__gt=0)
         turma_top = (
-            PagamentoAluno.objects.select_related("aluno", "aluno__turma")
-            .filter(status=PagamentoAluno.Status.PAGO)
-            .values("aluno__turma__id", "aluno__turma__nome")
-            .annotate(total=Sum(valor_recebido_expr))
+            resumo_qs.filter(status=PagamentoAluno.Status.PAGO)
+            .values("turma_id")
+            .annotate(total=Sum("valor_recebido"))
             .order_by("-total")
             .first()
         )
         turma_maior_receita = None
         if turma_top:
+            turma_id = turma_top["turma_id"] or None
             turma_maior_receita = {
-                "turma_id": turma_top["aluno__turma__id"],
-                "turma": turma_top["aluno__turma__nome"] or "Sem turma",
+                "turma_id": turma_id,
+                "turma": (
+                    Turma.objects.filter(pk=turma_id).values_list("nome", flat=True).first()
+                    or "Sem turma"
+                ),
                 "total": decimal_str(turma_top["total"]),
             }
 
-        plano_stats = []
-        for item in (
-            PagamentoAluno.objects.annotate(
-                plano_nome=Coalesce(
-                    "plano__nome",
-                    "aluno__plano_financeiro__nome",
-                    Value("Sem plano"),
-                )
-            )
-            .values("plano_nome")
-            .annotate(
-                total=Count("id"),
-                inadimplentes=Count(
-                    "id",
-                    filter=Q(
-                        status__in=[
-                            PagamentoAluno.Status.EM_ABERTO,
-                            PagamentoAluno.Status.ATRASADO,
-                        ]
-                    ),
+        planos = dict(PlanoEducacional.objects.values_list("id", "nome"))
+        por_plano = defaultdict(lambda: [0, 0])
+        for item in resumo_qs.values("plano_id").annotate(
+            total=Sum("quantidade"),
+            inadimplentes=Sum(
+                "quantidade",
+                filter=Q(
+                    status__in=[
+                        PagamentoAluno.Status.EM_ABERTO,
+                        PagamentoAluno.Status.ATRASADO,
+                    ]
                 ),
-            )
+            ),
         ):
-            total = item["total"] or 0
-            inadimplentes_count = item["inadimplentes"] or 0
+            contagem = por_plano[planos.get(item["plano_id"]) or "Sem plano"]
+            contagem[0] += item["total"] or 0
+            contagem[1] += item["inadimplentes"] or 0
+
+        plano_stats = []
+        for plano_nome, (total, inadimplentes_count) in por_plano.items():
             taxa = (inadimplentes_count / total) * 100 if total else 0
             plano_stats.append(
                 {
-                    "plano": item["plano_nome"],
+                    "plano": plano_nome,
                     "total": total,
                     "inadimplentes": inadimplentes_count,
                     "taxa_inadimplencia": taxa,
@@ -580,40 +764,28 @@ class FinanceiroRelatoriosView(APIView):
                 "taxa_inadimplencia": f"{plano_maior_inadimplencia['taxa_inadimplencia']:.2f}",
             }
 
-        proj_months = request.query_params.get("projecao")
-        try:
-            proj_months = int(proj_months) if proj_months else 6
-        except ValueError:
-            proj_months = 6
-        proj_months = min(max(proj_months, 1), 24)
         proj_start = shift_month(today.replace(day=1), 1)
         proj_end = shift_month(proj_start, proj_months - 1)
         proj_end = proj_end.replace(day=calendar.monthrange(proj_end.year, proj_end.month)[1])
 
         projecao = []
         for item in (
-            PagamentoAluno.objects.filter(
-                competencia__gte=proj_start,
-                competencia__lte=proj_end,
-            )
+            resumo_qs.filter(competencia__gte=proj_start, competencia__lte=proj_end)
             .exclude(status=PagamentoAluno.Status.ISENTO)
-            .annotate(mes=TruncMonth("competencia"))
-            .values("mes")
-            .annotate(total=Sum(valor_total_expr))
-            .order_by("mes")
+            .values("competencia")
+            .annotate(total=Sum("valor_total"))
+            .order_by("competencia")
         ):
-            mes = item["mes"]
             projecao.append(
                 {
-                    "mes": mes.strftime("%Y-%m") if mes else "",
+                    "mes": item["competencia"].strftime("%Y-%m"),
                     "total": decimal_str(item["total"]),
                 }
             )
 
-        payload = {
+        return {
             "inadimplentes_mais_30_dias": inadimplentes[:200],
             "turma_maior_receita": turma_maior_receita,
             "plano_maior_inadimplencia": plano_maior_inadimplencia,
             "projecao_receita": projecao,
         }
-        return Response(payload)
@@ -1,10 +1,12 @@
+import json
+
 from django.contrib import admin, messages
 from django.shortcuts import redirect
 from django.urls import path, reverse
 from django.utils.html import format_html
 
 from .models import Assinatura, Contrato, TemplateContrato
-from .services import gerar_pdf_contrato
+from .services import emitir_contratos_em_lote, gerar_pdf_contrato
 
 
 @admin.register(TemplateContrato)
@@ -35,14 +37,14 @@ class ContratoAdmin(admin.ModelAdmin):
         "qr_payload",
         "gerado_em",
         "gerado_por",
-        "snapshot",
+        "snapshot_auditoria",
         "created_at",
         "updated_at",
     )
     fieldsets = (
         ("Identificacao", {"fields": ("numero", "status", "data_emissao", "cidade_assinatura")}),
         ("Relacionamentos", {"fields": ("escola", "aluno", "responsavel", "turma", "plano", "template")}),
-        ("PDF", {"fields": ("pdf_visualizar", "pdf_hash", "qr_payload", "snapshot")}),
+        ("PDF", {"fields": ("pdf_visualizar", "pdf_hash", "qr_payload", "snapshot_auditoria")}),
         ("Auditoria", {"fields": ("gerado_por", "gerado_em", "created_at", "updated_at")}),
     )
     actions = ["gerar_pdf_em_lote"]
@@ -51,7 +53,7 @@ class ContratoAdmin(admin.ModelAdmin):
         readonly = list(super().get_readonly_fields(request, obj))
         if obj and obj.status != Contrato.Status.RASCUNHO:
             model_fields = [field.name for field in self.model._meta.fields]
-            return sorted(set(readonly + model_fields + ["pdf_visualizar"]))
+            return sorted(set(readonly + model_fields + ["pdf_visualizar", "snapshot_auditoria"]))
         return readonly
 
     @admin.display(description="PDF gerado")
@@ -60,6 +62,13 @@ class ContratoAdmin(admin.ModelAdmin):
             return "-"
         return format_html('<a href="{}" target="_blank">Baixar PDF</a>', obj.pdf_gerado.url)
 
+    @admin.display(description="Snapshot")
+    def snapshot_auditoria(self, obj):
+        snapshot = obj.snapshot_completo() if obj else None
+        if not snapshot:
+            return "-"
+        return format_html("<pre>{}</pre>", json.dumps(snapshot, ensure_ascii=False, indent=2))
+
     @admin.display(description="Payload QR")
     def qr_payload(self, obj):
         if not obj:
@@ -68,16 +77,22 @@ class ContratoAdmin(admin.ModelAdmin):
 
     @admin.action(description="Gerar PDF dos contratos selecionados")
     def gerar_pdf_em_lote(self, request, queryset):
-        total = 0
-        for contrato in queryset:
-            if contrato.status != Contrato.Status.RASCUNHO:
-                continue
-            gerar_pdf_contrato(contrato, request.user)
-            total += 1
-        if total:
-            self.message_user(request, f"{total} contrato(s) emitido(s) com sucesso.", messages.SUCCESS)
-        else:
+        rascunhos = list(
+            queryset.filter(status=Contrato.Status.RASCUNHO).select_related(
+                "escola", "aluno", "responsavel", "turma", "plano", "template"
+            )
+        )
+        if not rascunhos:
             self.message_user(request, "Nenhum contrato em rascunho para emitir.", messages.WARNING)
+            return
+        relatorio = emitir_contratos_em_lote(rascunhos, request.user)
+        emitidos = [item for item in relatorio if item["status"] == Contrato.Status.EMITIDO]
+        if emitidos:
+            self.message_user(request, f"{len(emitidos)} contrato(s) emitido(s) com sucesso.", messages.SUCCESS)
+        for item in relatorio:
+            if item["status"] != Contrato.Status.EMITIDO:
+                identificacao = item["numero"] or f"#{item['id']}"
+                self.message_user(request, f"Erro ao gerar PDF de {identificacao}: {item['erro']}", messages.ERROR)
 
     def get_urls(self):
         urls = super().get_urls()
@@ -0,0 +1,182 @@
+import hashlib
+import os
+from collections import Counter
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ArquivoPdf
+
+
+PREFIXO = "pdfs/"
+
+# Campos que apontam para ArquivoPdf.arquivo, usados para recontar referencias.
+REFERENCIAS = (
+    ("contratos.Contrato", "pdf_gerado"),
+    ("financeiro.PagamentoAluno", "nf_pdf"),
+)
+
+# Arquivos recem-gravados ainda podem estar sendo associados a um registro.
+CARENCIA_COLETA = timedelta(hours=1)
+
+
+def no_armazenamento(nome):
+    return bool(nome) and nome.startswith(PREFIXO)
+
+
+def arquivo_pdf_nome(pdf_hash):
+    return f"{PREFIXO}{pdf_hash[:2]}/{pdf_hash}.pdf"
+
+
+def armazenar_pdf(pdf_bytes):
+    """Grava o PDF (se ainda nao existir) e soma uma referencia.
+
+    Retorna o ArquivoPdf; o chamador aponta o FileField para ``arquivo.name``.
+    """
+    pdf_hash = hashlib.sha256(pdf_bytes).hexdigest()
+    for _ in range(3):
+        with transaction.atomic():
+            # A trava segura coletar_pdfs, que so apaga linhas com zero
+            # referencias que ele mesmo travou: depois dela a linha ou ganha a
+            # referencia ou ja nao existe mais.
+            arquivo = ArquivoPdf.objects.select_for_update().filter(hash=pdf_hash).first()
+            if arquivo is not None:
+                atualizados = ArquivoPdf.objects.filter(pk=arquivo.pk).update(
+                    referencias=F("referencias") + 1,
+                    updated_at=timezone.now(),
+                )
+                if atualizados == 1:
+                    arquivo.referencias += 1
+                    return arquivo
+                continue
+
+        arquivo = ArquivoPdf(hash=pdf_hash, tamanho=len(pdf_bytes), referencias=1)
+        nome = arquivo_pdf_nome(pdf_hash)
+        storage = arquivo.arquivo.storage
+        if storage.exists(nome):
+            arquivo.arquivo.name = nome
+        else:
+            arquivo.arquivo.save(f"{pdf_hash}.pdf", ContentFile(pdf_bytes), save=False)
+        try:
+            with transaction.atomic():
+                arquivo.save()
+            return arquivo
+        except IntegrityError:
+            # Outra gravacao criou a linha ao mesmo tempo; soma nela.
+            if arquivo.arquivo.name != nome:
+                storage.delete(arquivo.arquivo.name)
+    raise RuntimeError("Nao foi possivel registrar o PDF.")
+
+
+def liberar_pdf(nome):
+    """Remove uma referencia do arquivo; a exclusao fica para coletar_pdfs."""
+    if not no_armazenamento(nome):
+        return
+    ArquivoPdf.objects.filter(arquivo=nome, referencias__gt=0).update(
+        referencias=F("referencias") - 1,
+        updated_at=timezone.now(),
+    )
+
+
+def recontar_referencias():
+    """Recalcula ``referencias`` a partir dos registros. Retorna quantos mudaram."""
+    contagem = Counter()
+    for modelo, campo in REFERENCIAS:
+        nomes = (
+            apps.get_model(modelo)
+            .objects.filter(**{f"{campo}__startswith": PREFIXO})
+            .values_list(campo, flat=True)
+        )
+        contagem.update(nomes.iterator())
+    alterados = 0
+    for arquivo in ArquivoPdf.objects.only("pk", "arquivo", "referencias").iterator():
+        total = contagem.get(arquivo.arquivo.name, 0)
+        if total != arquivo.referencias:
+            ArquivoPdf.objects.filter(pk=arquivo.pk).update(referencias=total)
+            alterados += 1
+    return alterados
+
+
+def coletar_pdfs(dry_run=False):
+    """Apaga arquivos sem referencia e arquivos orfaos em ``pdfs/``.
+
+    Retorna ``{"recontados", "removidos", "orfaos", "bytes"}``.
+    """
+    resultado = {"recontados": recontar_referencias(), "removidos": 0, "orfaos": 0, "bytes": 0}
+    limite = timezone.now() - CARENCIA_COLETA
+    candidatos = ArquivoPdf.objects.filter(referencias=0, updated_at__lt=limite)
+    for arquivo in candidatos.iterator():
+        resultado["removidos"] += 1
+        resultado["bytes"] += arquivo.tamanho
+        if dry_run:
+            continue
+        with transaction.atomic():
+            travado = (
+                ArquivoPdf.objects.select_for_update(skip_locked=True)
+                .filter(pk=arquivo.pk, referencias=0)
+                .first()
+            )
+            if travado is None:
+                continue
+            travado.arquivo.delete(save=False)
+            travado.delete()
+
+    storage = ArquivoPdf._meta.get_field("arquivo").storage
+    conhecidos = set(ArquivoPdf.objects.values_list("arquivo", flat=True))
+    try:
+        pastas, _ = storage.listdir(PREFIXO.rstrip("/"))
+    except FileNotFoundError:
+        pastas = []
+    for pasta in pastas:
+        _, nomes = storage.listdir(f"{PREFIXO}{pasta}")
+        for nome in nomes:
+            caminho = f"{PREFIXO}{pasta}/{nome}"
+            if caminho in conhecidos or storage.get_modified_time(caminho) >= limite:
+                continue
+            # Revalida na hora: armazenar_pdf pode ter reaproveitado o arquivo
+            # depois que ``conhecidos`` foi lido.
+            if ArquivoPdf.objects.filter(arquivo=caminho).exists():
+                continue
+            resultado["orfaos"] += 1
+            resultado["bytes"] += storage.size(caminho)
+            if not dry_run:
+                storage.delete(caminho)
+    return resultado
+
+
+def migrar_legado(campo_arquivo, remover=False):
+    """Move um PDF gravado fora de ``pdfs/`` para o armazenamento por hash.
+
+    Para que URLs ja distribuidas continuem abrindo o PDF, o caminho antigo vira
+    um hard link para o arquivo deduplicado quando o storage e local, e fica
+    como esta (uma copia) em storage remoto. Com ``remover`` o arquivo antigo e
+    apagado. O chamador grava o registro com o novo nome. Retorna o ArquivoPdf.
+    """
+    antigo = campo_arquivo.name
+    storage = campo_arquivo.storage
+    with storage.open(antigo, "rb") as origem:
+        pdf_bytes = origem.read()
+    arquivo = armazenar_pdf(pdf_bytes)
+    campo_arquivo.name = arquivo.arquivo.name
+    try:
+        caminho_antigo = storage.path(antigo)
+        caminho_novo = storage.path(arquivo.arquivo.name)
+    except NotImplementedError:
+        if remover:
+            storage.delete(antigo)
+        return arquivo
+    if remover:
+        os.remove(caminho_antigo)
+        return arquivo
+    temporario = f"{caminho_antigo}.tmp"
+    try:
+        os.link(caminho_novo, temporario)
+    except OSError:
+        # Sistemas de arquivos diferentes: mantem a copia antiga intacta.
+        return arquivo
+    os.replace(temporario, caminho_antigo)
+    return arquivo
@@ -0,0 +1,185 @@
+import math
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.template import Context, Template, loader
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+
+from apps.alunos.models import Aluno
+from apps.cadastros.models import Escola, Responsavel
+from apps.financeiro.models import PagamentoAluno, PlanoEducacional
+from apps.financeiro.services import build_nota_fiscal_context
+from apps.turmas.models import Turma
+
+from .defaults import DEFAULT_TEMPLATE_CSS, DEFAULT_TEMPLATE_HTML
+from .models import Contrato
+from .pdf import iniciar_benchmark, medir_render
+from .services import build_contract_context
+
+DOCUMENTOS = ("contrato", "nf")
+
+
+def _objetos_sinteticos(indice):
+    escola = Escola(
+        razao_social="Centro Educacional Exemplo LTDA",
+        nome_fantasia="CEJAM",
+        cnpj="12345678000199",
+        endereco_completo="Rua das Flores, 100, Centro",
+        cidade="Manaus",
+        uf="AM",
+        telefone="92999990000",
+        email="contato@example.com",
+        responsavel="Diretora Exemplo",
+    )
+    responsavel = Responsavel(
+        nome_completo=f"Responsavel Sintetico {indice}",
+        cpf=f"{indice:011d}",
+        rg="1234567",
+        endereco="Av. Brasil, 200, Bairro Novo",
+        telefone="92988880000",
+        email="responsavel@example.com",
+    )
+    turma = Turma(
+        nome="3o Ano A",
+        serie_ano="3o ano",
+        turno="MANHA",
+        valor_mensalidade=Decimal("850.00"),
+        capacidade_maxima=30,
+    )
+    plano = PlanoEducacional(
+        nome="Plano Anual",
+        valor_mensalidade=Decimal("850.00"),
+        dia_vencimento=10,
+        duracao_meses=12,
+        taxa_matricula=Decimal("300.00"),
+        multa_percent=Decimal("2.00"),
+        juros_percent=Decimal("1.00"),
+    )
+    aluno = Aluno(
+        nome_completo=f"Aluno Sintetico {indice}",
+        cpf=f"{indice + 1:011d}",
+        data_nascimento=date(2012, 5, 17),
+        endereco="Av. Brasil, 200, Bairro Novo",
+        numero_matricula=f"MAT-{indice:05d}",
+        data_matricula=date(2026, 1, 15),
+        valor_mensalidade=Decimal("850.00"),
+        turma=turma,
+    )
+    return escola, responsavel, turma, plano, aluno
+
+
+def html_contrato(indice=1):
+    escola, responsavel, turma, plano, aluno = _objetos_sinteticos(indice)
+    contrato = Contrato(
+        numero=f"CEJAM-2026-{indice:06d}",
+        escola=escola,
+        aluno=aluno,
+        responsavel=responsavel,
+        turma=turma,
+        plano=plano,
+        data_emissao=date(2026, 1, 15),
+        cidade_assinatura="Manaus",
+    )
+    context = build_contract_context(contrato)
+    corpo = Template(DEFAULT_TEMPLATE_HTML).render(Context(context))
+    css = Template(DEFAULT_TEMPLATE_CSS).render(Context(context))
+    return loader.render_to_string(
+        "contratos/pdf_base.html",
+        {"content": mark_safe(corpo), "css": css, "contrato": contrato},
+    )
+
+
+def html_nf(indice=1):
+    _, _, _, plano, aluno = _objetos_sinteticos(indice)
+    registro = timezone.make_aware(datetime(2026, 3, 12, 10, 30))
+    pagamento = PagamentoAluno(
+        aluno=aluno,
+        plano=plano,
+        competencia=date(2026, 3, 1),
+        data_vencimento=date(2026, 3, 10),
+        data_pagamento=date(2026, 3, 12),
+        valor=Decimal("850.00"),
+        desconto=Decimal("42.50"),
+        multa=Decimal("16.15"),
+        juros=Decimal("0.54"),
+        valor_pago=Decimal("824.19"),
+        status=PagamentoAluno.Status.PAGO,
+        forma_pagamento="PIX",
+        nf_numero=f"NF-2026-{indice:06d}",
+        nf_emitida_em=registro,
+        pagamento_registrado_em=registro,
+    )
+    context = build_nota_fiscal_context(pagamento)
+    return loader.render_to_string("financeiro/nota_fiscal.html", context)
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    if not ordenados:
+        return None
+    # Nearest-rank.
+    posicao = max(math.ceil(p / 100 * len(ordenados)) - 1, 0)
+    return ordenados[min(posicao, len(ordenados) - 1)]
+
+
+def pico(valores):
+    valores = [valor for valor in valores if valor is not None]
+    return max(valores) if valores else None
+
+
+def medir(engine, documento, workers, iteracoes):
+    """Renderiza ``iteracoes`` documentos com ``workers`` processos aquecidos."""
+    gerador = html_contrato if documento == "contrato" else html_nf
+    htmls = [gerador(indice + 1) for indice in range(iteracoes)]
+    base_url = str(settings.BASE_DIR)
+    resultado = {"engine": engine, "documento": documento, "workers": workers, "jobs": iteracoes}
+    contexto = multiprocessing.get_context("spawn")
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=contexto,
+            initializer=iniciar_benchmark,
+            initargs=(engine,),
+        ) as executor:
+            # Um job por worker antes de medir, para nao contar a subida dos processos.
+            list(executor.map(medir_render, htmls[:workers], [base_url] * workers))
+            inicio = time.perf_counter()
+            medicoes = list(executor.map(medir_render, htmls, [base_url] * len(htmls)))
+            total = time.perf_counter() - inicio
+    except Exception as exc:
+        resultado["erro"] = str(exc)
+        return resultado
+
+    latencias = [segundos * 1000 for segundos, *_ in medicoes]
+    tamanhos = [tamanho for _, tamanho, *_ in medicoes]
+    resultado.update(
+        {
+            "segundos": round(total, 4),
+            "throughput_por_s": round(iteracoes / total, 3) if total else None,
+            "latencia_ms": {
+                "media": round(sum(latencias) / len(latencias), 2),
+                "p50": round(percentil(latencias, 50), 2),
+                "p95": round(percentil(latencias, 95), 2),
+                "p99": round(percentil(latencias, 99), 2),
+                "max": round(max(latencias), 2),
+            },
+            # Maior processo envolvido no render: o worker (weasyprint) ou o
+            # filho que ele dispara (wkhtmltopdf). None sem o modulo resource (Windows).
+            "rss_pico_kb": pico(
+                valor for *_, rss, rss_filhos in medicoes for valor in (rss, rss_filhos)
+            ),
+            "rss_pico_worker_kb": pico(rss for _, _, rss, _ in medicoes),
+            "rss_pico_filhos_kb": pico(rss_filhos for *_, rss_filhos in medicoes),
+            "tamanho_bytes": {
+                "min": min(tamanhos),
+                "media": round(sum(tamanhos) / len(tamanhos)),
+                "max": max(tamanhos),
+            },
+        }
+    )
+    return resultado
@@ -0,0 +1,90 @@
+import json
+import os
+import platform
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.contratos.benchmark import DOCUMENTOS, medir
+
+
+def _lista(valor):
+    return [item.strip() for item in valor.split(",") if item.strip()]
+
+
+class Command(BaseCommand):
+    help = "Mede a geracao de PDF dos templates de contrato e NF por engine e concorrencia."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--engines",
+            default="weasyprint,wkhtmltopdf",
+            help="Engines separadas por virgula (weasyprint, wkhtmltopdf, auto).",
+        )
+        parser.add_argument(
+            "--documentos",
+            default=",".join(DOCUMENTOS),
+            help="Documentos separados por virgula (contrato, nf).",
+        )
+        parser.add_argument(
+            "--max-workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Mede com 1, 2, 4... ate este numero de processos.",
+        )
+        parser.add_argument(
+            "--iteracoes",
+            type=int,
+            default=20,
+            help="PDFs renderizados em cada combinacao.",
+        )
+        parser.add_argument(
+            "--saida",
+            help="Arquivo JSON de resultado (padrao: imprime na saida).",
+        )
+
+    def handle(self, *args, **options):
+        documentos = _lista(options["documentos"])
+        invalidos = set(documentos) - set(DOCUMENTOS)
+        if invalidos:
+            raise CommandError(f"Documento invalido: {', '.join(sorted(invalidos))}.")
+        max_workers = max(options["max_workers"], 1)
+        workers = []
+        quantidade = 1
+        while quantidade < max_workers:
+            workers.append(quantidade)
+            quantidade *= 2
+        workers.append(max_workers)
+        iteracoes = max(options["iteracoes"], 1)
+
+        resultados = []
+        for engine in _lista(options["engines"]):
+            for documento in documentos:
+                for quantidade in workers:
+                    resultado = medir(engine, documento, quantidade, iteracoes)
+                    resultados.append(resultado)
+                    if "erro" in resultado:
+                        self.stderr.write(f"{engine}/{documento}/{quantidade}: {resultado['erro']}")
+                        break
+                    self.stderr.write(
+                        f"{engine}/{documento}/{quantidade}: "
+                        f"{resultado['throughput_por_s']} PDF/s, "
+                        f"p95 {resultado['latencia_ms']['p95']} ms"
+                    )
+
+        relatorio = {
+            "gerado_em": timezone.now().isoformat(),
+            "python": sys.version.split()[0],
+            "plataforma": platform.platform(),
+            "cpus": os.cpu_count(),
+            "iteracoes": iteracoes,
+            "resultados": resultados,
+        }
+        conteudo = json.dumps(relatorio, ensure_ascii=False, indent=2)
+        if options["saida"]:
+            with open(options["saida"], "w", encoding="utf-8") as destino:
+                destino.write(conteudo)
+            self.stdout.write(self.style.SUCCESS(f"Resultado gravado em {options['saida']}."))
+        else:
+            self.stdout.write(conteudo)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from apps.contratos.armazenamento import coletar_pdfs
+
+
+class Command(BaseCommand):
+    help = "Reconta as referencias dos PDFs deduplicados e apaga os que nao sao mais usados."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Apenas mostra o que seria apagado (as referencias sao recontadas).",
+        )
+
+    def handle(self, *args, **options):
+        resultado = coletar_pdfs(dry_run=options["dry_run"])
+        acao = "Seriam apagados" if options["dry_run"] else "Apagados"
+        self.stdout.write(f"Referencias corrigidas: {resultado['recontados']}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{acao}: {resultado['removidos']} PDF(s) sem referencia e "
+                f"{resultado['orfaos']} arquivo(s) orfao(s), {resultado['bytes']} bytes."
+            )
+        )
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.contratos.models import Contrato
+from apps.contratos.snapshots import PARTES, REFERENCIA, compactar_snapshot
+
+LOTE = 500
+
+
+class Command(BaseCommand):
+    help = "Move escola, turma, plano e template dos snapshots antigos para SnapshotParte."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Apenas conta os contratos com snapshot completo.",
+        )
+
+    def handle(self, *args, **options):
+        contratos = Contrato.objects.exclude(snapshot__isnull=True).only("pk", "snapshot").order_by("pk")
+        lote = []
+        total = 0
+        for contrato in contratos.iterator(chunk_size=LOTE):
+            snapshot = contrato.snapshot or {}
+            if not any(
+                isinstance(snapshot.get(tipo), dict) and REFERENCIA not in snapshot[tipo]
+                for tipo in PARTES
+            ):
+                continue
+            total += 1
+            if options["dry_run"]:
+                continue
+            lote.append(contrato)
+            if len(lote) >= LOTE:
+                self._gravar(lote)
+                lote = []
+        if lote:
+            self._gravar(lote)
+        acao = "Seriam compactados" if options["dry_run"] else "Compactados"
+        self.stdout.write(self.style.SUCCESS(f"{acao}: {total} snapshot(s)."))
+
+    def _gravar(self, contratos):
+        with transaction.atomic():
+            for contrato in contratos:
+                contrato.snapshot = compactar_snapshot(contrato.snapshot)
+            Contrato.objects.bulk_update(contratos, ["snapshot"])
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.contratos.armazenamento import PREFIXO, migrar_legado
+from apps.contratos.models import Contrato
+from apps.financeiro.models import PagamentoAluno
+
+
+class Command(BaseCommand):
+    help = "Move PDFs de contratos e notas fiscais gravados antes da deduplicacao para pdfs/."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Apenas conta os PDFs que seriam migrados.",
+        )
+        parser.add_argument(
+            "--remover-legado",
+            action="store_true",
+            help="Apaga o caminho antigo em vez de mante-lo como hard link.",
+        )
+
+    def _legados(self, modelo, campo):
+        return (
+            modelo.objects.exclude(**{f"{campo}__isnull": True})
+            .exclude(**{campo: ""})
+            .exclude(**{f"{campo}__startswith": PREFIXO})
+            .order_by("pk")
+        )
+
+    def handle(self, *args, **options):
+        alvos = (
+            (Contrato, "pdf_gerado", "pdf_hash"),
+            (PagamentoAluno, "nf_pdf", "nf_hash"),
+        )
+        for modelo, campo, campo_hash in alvos:
+            legados = self._legados(modelo, campo)
+            if options["dry_run"]:
+                self.stdout.write(f"{modelo._meta.verbose_name_plural}: {legados.count()}")
+                continue
+            migrados = 0
+            falhas = 0
+            for registro in legados.iterator():
+                arquivo_campo = getattr(registro, campo)
+                try:
+                    with transaction.atomic():
+                        arquivo = migrar_legado(arquivo_campo, remover=options["remover_legado"])
+                        modelo.objects.filter(pk=registro.pk).update(
+                            **{campo: arquivo_campo.name, campo_hash: arquivo.hash}
+                        )
+                except (OSError, ValueError) as exc:
+                    falhas += 1
+                    self.stderr.write(f"{registro}: {exc}")
+                    continue
+                migrados += 1
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{modelo._meta.verbose_name_plural}: {migrados} migrado(s), {falhas} falha(s)."
+                )
+            )
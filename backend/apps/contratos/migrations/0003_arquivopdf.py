@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+import apps.contratos.models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("contratos", "0002_default_template"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArquivoPdf",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("hash", models.CharField(max_length=64, unique=True)),
+                ("arquivo", models.FileField(upload_to=apps.contratos.models.arquivo_pdf_path)),
+                ("tamanho", models.PositiveIntegerField(default=0)),
+                ("referencias", models.PositiveIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "ordering": ["-created_at"],
+            },
+        ),
+    ]
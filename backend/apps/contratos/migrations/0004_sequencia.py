@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("contratos", "0003_arquivopdf"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Sequencia",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("prefixo", models.CharField(max_length=20, unique=True)),
+                ("ultimo", models.PositiveIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "ordering": ["prefixo"],
+            },
+        ),
+    ]
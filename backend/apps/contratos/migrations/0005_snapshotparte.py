@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("contratos", "0004_sequencia"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SnapshotParte",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("hash", models.CharField(max_length=64, unique=True)),
+                ("tipo", models.CharField(max_length=20)),
+                ("dados", models.JSONField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "ordering": ["tipo", "-created_at"],
+            },
+        ),
+    ]
@@ -9,6 +9,64 @@ def contrato_pdf_path(instance, filename):
     return f"contratos/{numero}/{filename}"
 
 
+def arquivo_pdf_path(instance, filename):
+    return f"pdfs/{instance.hash[:2]}/{filename}"
+
+
+class ArquivoPdf(models.Model):
+    """PDF armazenado uma unica vez pelo SHA-256 do conteudo.
+
+    Contrato.pdf_gerado e PagamentoAluno.nf_pdf apontam para ``arquivo``;
+    ``referencias`` conta quantos registros usam o arquivo.
+    """
+
+    hash = models.CharField(max_length=64, unique=True)
+    arquivo = models.FileField(upload_to=arquivo_pdf_path)
+    tamanho = models.PositiveIntegerField(default=0)
+    referencias = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return self.hash
+
+
+class Sequencia(models.Model):
+    """Ultimo numero emitido por prefixo (ex.: ``CEJAM-2026-``, ``NF-2026-``)."""
+
+    prefixo = models.CharField(max_length=20, unique=True)
+    ultimo = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["prefixo"]
+
+    def __str__(self):
+        return f"{self.prefixo}{self.ultimo:06d}"
+
+
+class SnapshotParte(models.Model):
+    """Trecho de Contrato.snapshot (escola, turma, plano...) gravado uma vez por hash.
+
+    As partes sao imutaveis e nunca apagadas: o snapshot do contrato guarda so o
+    hash e continua reconstruivel para auditoria.
+    """
+
+    hash = models.CharField(max_length=64, unique=True)
+    tipo = models.CharField(max_length=20)
+    dados = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["tipo", "-created_at"]
+
+    def __str__(self):
+        return f"{self.tipo} {self.hash[:12]}"
+
+
 class TemplateContrato(models.Model):
     nome = models.CharField(max_length=120)
     versao = models.CharField(max_length=20)
@@ -85,27 +143,24 @@ class Contrato(models.Model):
     def __str__(self):
         return self.numero or "Contrato (rascunho)"
 
+    def snapshot_completo(self):
+        from .snapshots import expandir_snapshot
+
+        return expandir_snapshot(self.snapshot)
+
     def qr_payload(self):
         if not self.numero or not self.pdf_hash:
             return ""
         return f"{self.numero}|{self.pdf_hash}"
 
+    @staticmethod
+    def prefixo_numero(data_emissao=None):
+        return f"CEJAM-{(data_emissao or timezone.localdate()).year}-"
+
     def _gerar_numero(self):
-        ano = (self.data_emissao or timezone.localdate()).year
-        prefix = f"CEJAM-{ano}-"
-        ultimo = (
-            Contrato.objects.select_for_update()
-            .filter(numero__startswith=prefix)
-            .order_by("-numero")
-            .first()
-        )
-        ultimo_seq = 0
-        if ultimo and ultimo.numero:
-            try:
-                ultimo_seq = int(ultimo.numero.split("-")[-1])
-            except (ValueError, IndexError):
-                ultimo_seq = 0
-        return f"{prefix}{ultimo_seq + 1:06d}"
+        from .sequencias import proximo_numero
+
+        return proximo_numero(self.prefixo_numero(self.data_emissao), Contrato.objects, "numero")
 
     def save(self, *args, **kwargs):
         if not self.numero:
@@ -0,0 +1,230 @@
+"""Geracao de PDF a partir de HTML e pool de processos renderizadores.
+
+Este modulo nao depende do Django: ele e importado pelos processos do pool
+(multiprocessing "spawn"), que so recebem HTML e devolvem bytes.
+"""
+
+import atexit
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+
+from .defaults import DEFAULT_TEMPLATE_CSS
+
+
+AQUECIMENTO_HTML = (
+    "<html><head><style>{css}</style></head>"
+    "<body><h1>CEJAM</h1><p>Aquecimento do renderizador.</p>"
+    "<table><tr><th>Item</th><td>Valor</td></tr></table></body></html>"
+)
+
+
+def _resolve_wkhtmltopdf_path():
+    explicit = os.environ.get("WKHTMLTOPDF_PATH")
+    if explicit and os.path.isfile(explicit):
+        return explicit
+    candidates = [
+        r"C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe",
+        r"C:\Program Files (x86)\wkhtmltopdf\bin\wkhtmltopdf.exe",
+    ]
+    for path in candidates:
+        if os.path.isfile(path):
+            return path
+    return shutil.which("wkhtmltopdf")
+
+
+def _render_pdf_with_weasyprint(html, base_url=None):
+    try:
+        from weasyprint import HTML
+    except ImportError as exc:
+        raise RuntimeError(
+            "weasyprint nao instalado. Instale com: pip install weasyprint"
+        ) from exc
+    return HTML(string=html, base_url=base_url).write_pdf()
+
+
+def _render_pdf_with_wkhtmltopdf(html):
+    try:
+        import pdfkit
+    except ImportError as exc:
+        raise RuntimeError("pdfkit nao instalado. Instale com: pip install pdfkit") from exc
+    wkhtmltopdf = _resolve_wkhtmltopdf_path()
+    if not wkhtmltopdf:
+        raise RuntimeError(
+            "wkhtmltopdf nao encontrado. Instale o aplicativo ou defina WKHTMLTOPDF_PATH."
+        )
+    config = pdfkit.configuration(wkhtmltopdf=wkhtmltopdf)
+    options = {
+        "page-size": "A4",
+        "encoding": "UTF-8",
+        "enable-local-file-access": "",
+        "quiet": "",
+    }
+    return pdfkit.from_string(html, False, options=options, configuration=config)
+
+
+def render_pdf_local(html, base_url=None):
+    engine = os.getenv("PDF_ENGINE", "weasyprint").strip().lower()
+    if engine == "weasyprint":
+        return _render_pdf_with_weasyprint(html, base_url=base_url)
+    if engine in {"wkhtmltopdf", "pdfkit"}:
+        return _render_pdf_with_wkhtmltopdf(html)
+    if engine == "auto":
+        try:
+            return _render_pdf_with_weasyprint(html, base_url=base_url)
+        except Exception:
+            return _render_pdf_with_wkhtmltopdf(html)
+    raise RuntimeError("PDF_ENGINE invalido. Use weasyprint, wkhtmltopdf ou auto.")
+
+
+def _aquecer_worker():
+    # Importa o engine e renderiza um documento com o CSS padrao para deixar
+    # fontes, fontconfig e o parser de CSS carregados antes do primeiro job.
+    try:
+        render_pdf_local(AQUECIMENTO_HTML.format(css=DEFAULT_TEMPLATE_CSS))
+    except Exception:
+        pass
+
+
+def iniciar_benchmark(engine):
+    os.environ["PDF_ENGINE"] = engine
+    _aquecer_worker()
+
+
+def medir_render(html, base_url=None):
+    """Renderiza e devolve ``(segundos, bytes do PDF, pico de RSS em KB, pico dos filhos)``.
+
+    O wkhtmltopdf roda em um processo filho: a memoria dele so aparece em
+    RUSAGE_CHILDREN. Sem o modulo ``resource`` (Windows) os picos sao None.
+    """
+    inicio = time.perf_counter()
+    pdf_bytes = render_pdf_local(html, base_url=base_url)
+    segundos = time.perf_counter() - inicio
+    try:
+        import resource
+    except ImportError:
+        return segundos, len(pdf_bytes), None, None
+    return (
+        segundos,
+        len(pdf_bytes),
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+
+
+class PdfRendererPool:
+    """Processos de longa duracao que recebem HTML e devolvem o PDF.
+
+    O pool e criado sob demanda no processo que o usa (cada worker do gunicorn
+    tem o seu). Quando um job estoura o tempo limite o pool e trocado por um
+    novo; o antigo so e terminado depois que os jobs das outras threads que
+    ainda rodam nele acabarem.
+    """
+
+    def __init__(self, tamanho=2, timeout=60):
+        self.tamanho = max(int(tamanho), 1)
+        self.timeout = timeout
+        self._pool = None
+        self._pid = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _obter_pool(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                contexto = multiprocessing.get_context("spawn")
+                self._pool = contexto.Pool(self.tamanho, initializer=_aquecer_worker)
+                self._pid = os.getpid()
+                self._jobs = {}
+            return self._pool
+
+    def _enviar(self, html, base_url):
+        for _ in range(2):
+            pool = self._obter_pool()
+            try:
+                resultado = pool.apply_async(render_pdf_local, (html, base_url))
+            except ValueError:
+                # O pool foi descartado por outra thread entre obter e enviar.
+                continue
+            with self._lock:
+                self._jobs.setdefault(pool, set()).add(resultado)
+            return pool, resultado
+        raise RuntimeError("Pool de PDF indisponivel.")
+
+    def _concluir(self, pool, resultado):
+        with self._lock:
+            self._jobs.get(pool, set()).discard(resultado)
+
+    def _descartar(self, pool):
+        """Tira o pool de uso sem interromper os jobs que ainda rodam nele."""
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+            self._pid = None
+            jobs = self._jobs.pop(pool, set())
+        pool.close()
+
+        def aposentar():
+            # Cada job ainda tem no maximo ``timeout`` segundos; o que travou
+            # o pool e morto no terminate.
+            limite = time.monotonic() + self.timeout
+            for job in jobs:
+                job.wait(max(limite - time.monotonic(), 0))
+            pool.terminate()
+            pool.join()
+
+        threading.Thread(target=aposentar, name="pdf-pool-aposentar", daemon=True).start()
+
+    def render(self, html, base_url=None, timeout=None):
+        pool, resultado = self._enviar(html, base_url)
+        try:
+            return resultado.get(timeout=timeout or self.timeout)
+        except multiprocessing.TimeoutError as exc:
+            self._descartar(pool)
+            raise RuntimeError("Tempo limite excedido ao gerar o PDF.") from exc
+        finally:
+            self._concluir(pool, resultado)
+
+    def render_lote(self, htmls, base_url=None, timeout=None):
+        """Renderiza varios HTMLs em paralelo.
+
+        Retorna uma lista na mesma ordem com os bytes do PDF ou a excecao do job.
+        """
+        pendentes = [self._enviar(html, base_url) for html in htmls]
+        resultados = []
+        for pool, pendente in pendentes:
+            try:
+                resultados.append(pendente.get(timeout=timeout or self.timeout))
+            except multiprocessing.TimeoutError:
+                self._descartar(pool)
+                resultados.append(RuntimeError("Tempo limite excedido ao gerar o PDF."))
+            except Exception as exc:
+                resultados.append(exc)
+            finally:
+                self._concluir(pool, pendente)
+        return resultados
+
+    def encerrar(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.terminate()
+                self._pool.join()
+            self._pool = None
+            self._pid = None
+            self._jobs = {}
+
+
+_pool_global = None
+_pool_lock = threading.Lock()
+
+
+def obter_pool(tamanho, timeout):
+    global _pool_global
+    with _pool_lock:
+        if _pool_global is None:
+            _pool_global = PdfRendererPool(tamanho=tamanho, timeout=timeout)
+            atexit.register(_pool_global.encerrar)
+        return _pool_global
@@ -0,0 +1,52 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import Sequencia
+
+
+def formatar_numero(prefixo, valor):
+    return f"{prefixo}{valor:06d}"
+
+
+def maior_sequencia(queryset, campo, prefixo):
+    """Maior sufixo numerico ja gravado em ``campo`` com o prefixo (busca antiga)."""
+    ultimo = (
+        queryset.filter(**{f"{campo}__startswith": prefixo})
+        .order_by(f"-{campo}")
+        .values_list(campo, flat=True)
+        .first()
+    )
+    try:
+        return int(ultimo.split("-")[-1]) if ultimo else 0
+    except (ValueError, IndexError):
+        return 0
+
+
+def reservar_numeros(prefixo, quantidade=1, queryset=None, campo=None):
+    """Reserva ``quantidade`` numeros seguidos do prefixo. Retorna um ``range``.
+
+    O incremento e um UPDATE atomico na linha do prefixo, que fica travada ate o
+    fim da transacao do chamador: numeros de uma transacao desfeita voltam para a
+    sequencia, sem buracos. Na primeira reserva de um prefixo o contador parte do
+    maior numero ja gravado em ``queryset``/``campo``.
+    """
+    quantidade = max(int(quantidade), 1)
+    with transaction.atomic():
+        atualizados = Sequencia.objects.filter(prefixo=prefixo).update(
+            ultimo=F("ultimo") + quantidade
+        )
+        if not atualizados:
+            inicial = maior_sequencia(queryset, campo, prefixo) if queryset is not None else 0
+            try:
+                with transaction.atomic():
+                    Sequencia.objects.create(prefixo=prefixo, ultimo=inicial + quantidade)
+            except IntegrityError:
+                # Outro processo criou o contador ao mesmo tempo.
+                Sequencia.objects.filter(prefixo=prefixo).update(ultimo=F("ultimo") + quantidade)
+        ultimo = Sequencia.objects.filter(prefixo=prefixo).values_list("ultimo", flat=True).get()
+    return range(ultimo - quantidade + 1, ultimo + 1)
+
+
+def proximo_numero(prefixo, queryset=None, campo=None):
+    valor = reservar_numeros(prefixo, 1, queryset=queryset, campo=campo)[0]
+    return formatar_numero(prefixo, valor)
@@ -1,16 +1,20 @@
-import hashlib
-import os
-import shutil
+import threading
+from collections import OrderedDict, defaultdict
 from types import SimpleNamespace
 
 from django.conf import settings
-from django.core.files.base import ContentFile
+from django.db import transaction
 from django.template import Context, Template, loader
 from django.utils import timezone
+from django.utils.html import escape
 from django.utils.safestring import mark_safe
 
+from .armazenamento import armazenar_pdf, liberar_pdf
 from .defaults import DEFAULT_TEMPLATE_CSS
 from .models import Contrato
+from .pdf import obter_pool, render_pdf_local
+from .sequencias import formatar_numero, reservar_numeros
+from .snapshots import compactar_snapshot
 
 
 MESES_PT = [
@@ -29,62 +33,65 @@ MESES_PT = [
 ]
 
 
-def _resolve_wkhtmltopdf_path():
-    explicit = os.environ.get("WKHTMLTOPDF_PATH")
-    if explicit and os.path.isfile(explicit):
-        return explicit
-    candidates = [
-        r"C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe",
-        r"C:\Program Files (x86)\wkhtmltopdf\bin\wkhtmltopdf.exe",
-    ]
-    for path in candidates:
-        if os.path.isfile(path):
-            return path
-    return shutil.which("wkhtmltopdf")
-
-
-def _render_pdf_with_weasyprint(html, base_url=None):
-    try:
-        from weasyprint import HTML
-    except ImportError as exc:
-        raise RuntimeError(
-            "weasyprint nao instalado. Instale com: pip install weasyprint"
-        ) from exc
-    return HTML(string=html, base_url=base_url).write_pdf()
-
-
-def _render_pdf_with_wkhtmltopdf(html):
-    try:
-        import pdfkit
-    except ImportError as exc:
-        raise RuntimeError("pdfkit nao instalado. Instale com: pip install pdfkit") from exc
-    wkhtmltopdf = _resolve_wkhtmltopdf_path()
-    if not wkhtmltopdf:
-        raise RuntimeError(
-            "wkhtmltopdf nao encontrado. Instale o aplicativo ou defina WKHTMLTOPDF_PATH."
-        )
-    config = pdfkit.configuration(wkhtmltopdf=wkhtmltopdf)
-    options = {
-        "page-size": "A4",
-        "encoding": "UTF-8",
-        "enable-local-file-access": "",
-        "quiet": "",
-    }
-    return pdfkit.from_string(html, False, options=options, configuration=config)
+def _render_pdf(html, base_url=None):
+    tamanho = getattr(settings, "PDF_POOL_SIZE", 0)
+    if tamanho > 0:
+        pool = obter_pool(tamanho, getattr(settings, "PDF_POOL_TIMEOUT", 60))
+        return pool.render(html, base_url=base_url)
+    return render_pdf_local(html, base_url=base_url)
+
+
+class TemplateCache:
+    """Templates compilados por (chave, versao), com descarte LRU."""
+
+    def __init__(self, tamanho=64):
+        self.tamanho = tamanho
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obter(self, chave, versao, fonte):
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None and item[0] == versao:
+                self._itens.move_to_end(chave)
+                return item[1]
+        template = Template(fonte)
+        with self._lock:
+            self._itens[chave] = (versao, template)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.tamanho:
+                self._itens.popitem(last=False)
+        return template
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+
+
+_templates = TemplateCache(getattr(settings, "CONTRATOS_TEMPLATE_CACHE_SIZE", 64))
+_MARCADOR_NUMERO = "\x00numero\x00"
+_css_padrao = None
+
+
+def _compilar_template(template_contrato, campo):
+    # A versao e o updated_at: salvar o TemplateContrato invalida a entrada.
+    return _templates.obter(
+        (template_contrato.pk, campo),
+        template_contrato.updated_at,
+        getattr(template_contrato, campo),
+    )
 
 
-def _render_pdf(html, base_url=None):
-    engine = os.getenv("PDF_ENGINE", "weasyprint").strip().lower()
-    if engine == "weasyprint":
-        return _render_pdf_with_weasyprint(html, base_url=base_url)
-    if engine in {"wkhtmltopdf", "pdfkit"}:
-        return _render_pdf_with_wkhtmltopdf(html)
-    if engine == "auto":
-        try:
-            return _render_pdf_with_weasyprint(html, base_url=base_url)
-        except Exception:
-            return _render_pdf_with_wkhtmltopdf(html)
-    raise RuntimeError("PDF_ENGINE invalido. Use weasyprint, wkhtmltopdf ou auto.")
+def _render_css(template_contrato, context):
+    if template_contrato.css:
+        return _compilar_template(template_contrato, "css").render(context)
+    # O CSS padrao so depende de contrato.numero: renderiza uma vez com um marcador
+    # e substitui pelo numero ja escapado, como o autoescape faria.
+    global _css_padrao
+    if _css_padrao is None:
+        marcador = SimpleNamespace(numero=_MARCADOR_NUMERO)
+        _css_padrao = Template(DEFAULT_TEMPLATE_CSS).render(Context({"contrato": marcador}))
+    return _css_padrao.replace(_MARCADOR_NUMERO, escape(context.get("contrato").numero))
 
 
 def _format_currency(value):
@@ -202,7 +209,8 @@ def build_snapshot(contrato, responsavel):
     }
 
 
-def gerar_pdf_contrato(contrato, user=None):
+def preparar_contrato(contrato):
+    """Numera o contrato e monta o HTML final. Retorna ``(html, responsavel)``."""
     if contrato.status != Contrato.Status.RASCUNHO:
         raise ValueError("Contrato ja emitido ou cancelado.")
 
@@ -212,33 +220,129 @@ def gerar_pdf_contrato(contrato, user=None):
     context = build_contract_context(contrato)
     responsavel = context["responsavel"]
 
-    corpo = Template(contrato.template.corpo_html).render(Context(context))
-    css_text = contrato.template.css or DEFAULT_TEMPLATE_CSS
-    css_text = Template(css_text).render(Context(context))
+    corpo = _compilar_template(contrato.template, "corpo_html").render(Context(context))
+    css_text = _render_css(contrato.template, Context(context))
 
     html = loader.render_to_string(
         "contratos/pdf_base.html",
         {"content": mark_safe(corpo), "css": css_text, "contrato": contrato},
     )
+    return html, responsavel
+
+
+def gravar_pdf_contrato(contrato, pdf_bytes, responsavel, user=None):
+    """Grava o PDF no armazenamento e anexa ao contrato em uma transacao curta.
 
+    Se outra emissao concluiu o contrato enquanto este PDF era gerado, a
+    referencia ao arquivo e devolvida e o erro e propagado.
+    """
+    arquivo = armazenar_pdf(pdf_bytes)
+    with transaction.atomic():
+        atual = (
+            Contrato.objects.select_for_update()
+            .only("status", "pdf_gerado")
+            .get(pk=contrato.pk)
+        )
+        concluido = atual.status != Contrato.Status.RASCUNHO
+        if not concluido:
+            anterior = atual.pdf_gerado.name
+            contrato.pdf_gerado.name = arquivo.arquivo.name
+            contrato.pdf_hash = arquivo.hash
+            contrato.snapshot = compactar_snapshot(build_snapshot(contrato, responsavel))
+            contrato.gerado_em = timezone.now()
+            contrato.gerado_por = user if user and user.is_authenticated else None
+            contrato.status = Contrato.Status.EMITIDO
+            contrato.save(
+                update_fields=[
+                    "pdf_gerado",
+                    "pdf_hash",
+                    "snapshot",
+                    "gerado_em",
+                    "gerado_por",
+                    "status",
+                    "updated_at",
+                ]
+            )
+            if anterior and anterior != contrato.pdf_gerado.name:
+                liberar_pdf(anterior)
+    if concluido:
+        liberar_pdf(arquivo.arquivo.name)
+        raise ValueError("Contrato ja emitido ou cancelado.")
+    return contrato
+
+
+def gerar_pdf_contrato(contrato, user=None):
+    # Numeracao, render e gravacao em etapas separadas: nenhuma transacao fica
+    # aberta enquanto o PDF e gerado.
+    html, responsavel = preparar_contrato(contrato)
     pdf_bytes = _render_pdf(html, base_url=str(settings.BASE_DIR))
-    pdf_hash = hashlib.sha256(pdf_bytes).hexdigest()
-
-    filename = f"{contrato.numero}.pdf"
-    contrato.pdf_gerado.save(filename, ContentFile(pdf_bytes), save=False)
-    contrato.pdf_hash = pdf_hash
-    contrato.snapshot = build_snapshot(contrato, responsavel)
-    contrato.gerado_em = timezone.now()
-    contrato.gerado_por = user if user and user.is_authenticated else None
-    contrato.status = Contrato.Status.EMITIDO
-    contrato.save(
-        update_fields=[
-            "pdf_gerado",
-            "pdf_hash",
-            "snapshot",
-            "gerado_em",
-            "gerado_por",
-            "status",
-            "updated_at",
-        ]
-    )
+    return gravar_pdf_contrato(contrato, pdf_bytes, responsavel, user)
+
+
+def numerar_rascunhos(contratos):
+    """Numera os rascunhos sem numero com um bloco reservado por prefixo."""
+    por_prefixo = defaultdict(list)
+    for contrato in contratos:
+        if contrato.status == Contrato.Status.RASCUNHO and not contrato.numero:
+            contrato.data_emissao = contrato.data_emissao or timezone.localdate()
+            por_prefixo[Contrato.prefixo_numero(contrato.data_emissao)].append(contrato)
+    for prefixo, grupo in por_prefixo.items():
+        with transaction.atomic():
+            numeros = reservar_numeros(prefixo, len(grupo), Contrato.objects, "numero")
+            for contrato, valor in zip(grupo, numeros):
+                contrato.numero = formatar_numero(prefixo, valor)
+                contrato.save(update_fields=["numero", "data_emissao"])
+
+
+def _render_lote(htmls, base_url):
+    tamanho = getattr(settings, "PDF_POOL_SIZE", 0)
+    if tamanho > 0:
+        pool = obter_pool(tamanho, getattr(settings, "PDF_POOL_TIMEOUT", 60))
+        return pool.render_lote(htmls, base_url=base_url)
+    pdfs = []
+    for html in htmls:
+        try:
+            pdfs.append(render_pdf_local(html, base_url=base_url))
+        except Exception as exc:
+            pdfs.append(exc)
+    return pdfs
+
+
+def emitir_contratos_em_lote(contratos, user=None):
+    """Emite varios contratos isolando as falhas de cada um.
+
+    1. reserva os numeros de uma vez e monta o HTML no processo atual;
+    2. renderiza os PDFs em paralelo no pool compartilhado (PDF_POOL_SIZE), ou em
+       sequencia no proprio processo com PDF_POOL_SIZE=0;
+    3. grava arquivo e status de cada contrato em uma transacao propria.
+
+    Retorna uma lista com ``{"id", "numero", "status", "erro"}`` por contrato,
+    onde status e ``"EMITIDO"`` ou ``"ERRO"``.
+    """
+    relatorio = []
+    preparados = []
+    numerar_rascunhos(contratos)
+    for contrato in contratos:
+        item = {"id": contrato.pk, "numero": contrato.numero, "status": "ERRO", "erro": ""}
+        relatorio.append(item)
+        try:
+            html, responsavel = preparar_contrato(contrato)
+        except Exception as exc:
+            item["erro"] = str(exc)
+            continue
+        preparados.append((item, contrato, html, responsavel))
+    if not preparados:
+        return relatorio
+
+    pdfs = _render_lote([html for _, _, html, _ in preparados], str(settings.BASE_DIR))
+    for (item, contrato, _, responsavel), pdf_bytes in zip(preparados, pdfs):
+        if isinstance(pdf_bytes, Exception):
+            item["erro"] = str(pdf_bytes)
+            continue
+        try:
+            gravar_pdf_contrato(contrato, pdf_bytes, responsavel, user)
+        except Exception as exc:
+            item["erro"] = str(exc)
+            continue
+        item["status"] = Contrato.Status.EMITIDO
+    return relatorio
@@ -0,0 +1,84 @@
+import hashlib
+import json
+
+from django.db import transaction
+
+from .models import SnapshotParte
+
+
+# Trechos do snapshot que se repetem entre contratos e vao para SnapshotParte.
+PARTES = ("escola", "turma", "plano", "template")
+
+REFERENCIA = "$parte"
+
+MAX_CONHECIDAS = 4096
+
+# Hashes ja confirmados no banco neste processo (partes nunca sao apagadas).
+_conhecidas = set()
+
+
+def hash_parte(dados):
+    bruto = json.dumps(dados, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(bruto.encode("utf-8")).hexdigest()
+
+
+def _lembrar(hashes):
+    if len(_conhecidas) + len(hashes) > MAX_CONHECIDAS:
+        _conhecidas.clear()
+    _conhecidas.update(hashes)
+
+
+def compactar_snapshot(snapshot):
+    """Troca as partes compartilhadas por ``{"$parte": hash}`` e grava as novas."""
+    if not snapshot:
+        return snapshot
+    compacto = dict(snapshot)
+    novas = {}
+    for tipo in PARTES:
+        dados = snapshot.get(tipo)
+        if not isinstance(dados, dict) or REFERENCIA in dados:
+            continue
+        parte_hash = hash_parte(dados)
+        compacto[tipo] = {REFERENCIA: parte_hash}
+        if parte_hash not in _conhecidas:
+            novas[parte_hash] = SnapshotParte(hash=parte_hash, tipo=tipo, dados=dados)
+    if novas:
+        existentes = set(
+            SnapshotParte.objects.filter(hash__in=novas).values_list("hash", flat=True)
+        )
+        SnapshotParte.objects.bulk_create(
+            [parte for parte_hash, parte in novas.items() if parte_hash not in existentes],
+            ignore_conflicts=True,
+        )
+        # So marca como conhecida depois do commit: um rollback desfaz o INSERT.
+        hashes = set(novas)
+        transaction.on_commit(lambda: _lembrar(hashes))
+    return compacto
+
+
+def expandir_snapshot(snapshot, cache=None):
+    """Reconstroi o snapshot completo a partir das referencias.
+
+    ``cache`` (dict hash -> dados) pode ser compartilhado entre varios contratos
+    para buscar cada parte uma unica vez. Snapshots antigos, sem referencias,
+    sao devolvidos como estao.
+    """
+    if not snapshot:
+        return snapshot
+    referencias = {
+        tipo: valor[REFERENCIA]
+        for tipo, valor in snapshot.items()
+        if isinstance(valor, dict) and REFERENCIA in valor
+    }
+    if not referencias:
+        return snapshot
+    cache = {} if cache is None else cache
+    faltando = set(referencias.values()) - cache.keys()
+    if faltando:
+        cache.update(
+            SnapshotParte.objects.filter(hash__in=faltando).values_list("hash", "dados")
+        )
+    completo = dict(snapshot)
+    for tipo, parte_hash in referencias.items():
+        completo[tipo] = cache.get(parte_hash)
+    return completo
@@ -0,0 +1,428 @@
+import io
+import os
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.cadastros.models import Escola, Responsavel
+from apps.financeiro.models import PlanoEducacional
+from apps.financeiro.tests import MidiaTemporariaMixin, criar_aluno, criar_turma
+
+from . import services, snapshots
+from .armazenamento import (
+    CARENCIA_COLETA,
+    armazenar_pdf,
+    coletar_pdfs,
+    liberar_pdf,
+    migrar_legado,
+    recontar_referencias,
+)
+from .models import ArquivoPdf, Contrato, Sequencia, SnapshotParte, TemplateContrato
+from .sequencias import reservar_numeros
+
+
+class ReservarNumerosConcorrenteTests(TransactionTestCase):
+    """Reservas em paralelo nao repetem numeros nem deixam buracos."""
+
+    THREADS = 8
+    RESERVAS = 20
+
+    def _reservar_em_paralelo(self, prefixo):
+        reservados = []
+        erros = []
+        trava = threading.Lock()
+        inicio = threading.Barrier(self.THREADS)
+
+        def trabalhar(indice):
+            try:
+                inicio.wait()
+                for rodada in range(self.RESERVAS):
+                    quantidade = (indice + rodada) % 3 + 1
+                    try:
+                        with transaction.atomic():
+                            numeros = reservar_numeros(prefixo, quantidade)
+                            # Parte das transacoes e desfeita: os numeros voltam
+                            # para a sequencia.
+                            if rodada % 5 == indice % 5:
+                                raise RuntimeError("desfazer")
+                    except RuntimeError:
+                        continue
+                    with trava:
+                        reservados.extend(numeros)
+            except Exception as exc:
+                erros.append(exc)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=trabalhar, args=(indice,)) for indice in range(self.THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(erros, [])
+        return reservados
+
+    def test_reservas_paralelas_sem_buracos_nem_repeticoes(self):
+        reservados = self._reservar_em_paralelo("TESTE-")
+
+        self.assertEqual(len(reservados), len(set(reservados)))
+        self.assertEqual(sorted(reservados), list(range(1, len(reservados) + 1)))
+        self.assertEqual(Sequencia.objects.get(prefixo="TESTE-").ultimo, len(reservados))
+
+    def test_contador_existente_continua_a_partir_do_ultimo(self):
+        Sequencia.objects.create(prefixo="NF-TESTE-", ultimo=41)
+
+        reservados = self._reservar_em_paralelo("NF-TESTE-")
+
+        self.assertEqual(sorted(reservados), list(range(42, 42 + len(reservados))))
+
+
+def criar_contratos(quantidade):
+    escola = Escola.objects.create(
+        razao_social="Centro Educacional Teste LTDA",
+        nome_fantasia="CEJAM",
+        cnpj="12345678000199",
+        endereco_completo="Rua Teste, 100",
+        cidade="Manaus",
+        uf="AM",
+        telefone="92999990000",
+        email="escola@example.com",
+        responsavel="Diretora Teste",
+    )
+    responsavel = Responsavel.objects.create(
+        nome_completo="Responsavel Teste",
+        cpf="00000000001",
+        endereco="Rua Teste, 200",
+        telefone="92988880000",
+        email="responsavel@example.com",
+    )
+    plano = PlanoEducacional.objects.create(
+        nome="Plano",
+        valor_mensalidade=Decimal("100.00"),
+        dia_vencimento=10,
+        duracao_meses=12,
+    )
+    template = TemplateContrato.objects.create(
+        nome="Padrao",
+        versao="1",
+        corpo_html="<p>Contrato {{ contrato.numero }} de {{ aluno.nome_completo }}</p>",
+    )
+    turma = criar_turma()
+    return [
+        Contrato.objects.create(
+            escola=escola,
+            aluno=criar_aluno(turma, plano, indice),
+            responsavel=responsavel,
+            turma=turma,
+            plano=plano,
+            template=template,
+            cidade_assinatura="Manaus",
+        )
+        for indice in range(quantidade)
+    ]
+
+
+@override_settings(PDF_POOL_SIZE=0, ALLOWED_HOSTS=["testserver"])
+class EmitirContratosEmLoteTests(MidiaTemporariaMixin, TestCase):
+    """Cada contrato do lote sai no relatorio como EMITIDO ou ERRO, sem derrubar os demais."""
+
+    def setUp(self):
+        self.contratos = criar_contratos(4)
+        renderizar = mock.patch.object(services, "render_pdf_local", side_effect=self._renderizar)
+        self.render = renderizar.start()
+        self.addCleanup(renderizar.stop)
+
+    @staticmethod
+    def _renderizar(html, base_url=None):
+        if "Aluno 2" in html:
+            raise RuntimeError("Falha no renderizador.")
+        return f"%PDF {html}".encode()
+
+    def test_relatorio_por_contrato(self):
+        emitido = self.contratos[3]
+        emitido.status = Contrato.Status.EMITIDO
+        emitido.save(update_fields=["status"])
+
+        relatorio = services.emitir_contratos_em_lote(self.contratos)
+
+        self.assertEqual(
+            [(item["id"], item["numero"], item["status"], item["erro"]) for item in relatorio],
+            [
+                (self.contratos[0].pk, self.contratos[0].numero, "EMITIDO", ""),
+                (self.contratos[1].pk, self.contratos[1].numero, "EMITIDO", ""),
+                (self.contratos[2].pk, self.contratos[2].numero, "ERRO", "Falha no renderizador."),
+                (emitido.pk, emitido.numero, "ERRO", "Contrato ja emitido ou cancelado."),
+            ],
+        )
+        self.assertEqual(self.render.call_count, 3)
+        falhou = Contrato.objects.get(pk=self.contratos[2].pk)
+        self.assertEqual(falhou.status, Contrato.Status.RASCUNHO)
+        self.assertFalse(falhou.pdf_gerado)
+        for contrato in self.contratos[:2]:
+            contrato.refresh_from_db()
+            self.assertEqual(contrato.status, Contrato.Status.EMITIDO)
+            self.assertIn(contrato.numero, contrato.pdf_gerado.read().decode())
+            self.assertEqual(contrato.snapshot_completo()["contrato"]["numero"], contrato.numero)
+
+    def test_falha_ao_gravar_nao_interrompe_o_lote(self):
+        gravar = services.gravar_pdf_contrato
+
+        def gravar_com_falha(contrato, *args, **kwargs):
+            if contrato.pk == self.contratos[0].pk:
+                raise OSError("Disco cheio.")
+            return gravar(contrato, *args, **kwargs)
+
+        with mock.patch.object(services, "gravar_pdf_contrato", side_effect=gravar_com_falha):
+            relatorio = services.emitir_contratos_em_lote(self.contratos[:2])
+
+        self.assertEqual([item["status"] for item in relatorio], ["ERRO", "EMITIDO"])
+        self.assertEqual(relatorio[0]["erro"], "Disco cheio.")
+
+    def test_rascunho_sem_numero_recebe_numero_reservado_em_bloco(self):
+        sem_numero = self.contratos[0]
+        Contrato.objects.filter(pk=sem_numero.pk).update(numero="")
+        sem_numero.numero = ""
+        prefixo = Contrato.prefixo_numero(timezone.localdate())
+        ultimo = Sequencia.objects.get(prefixo=prefixo).ultimo
+
+        with mock.patch.object(services, "reservar_numeros", wraps=reservar_numeros) as reservar:
+            relatorio = services.emitir_contratos_em_lote(self.contratos[:2])
+
+        reservar.assert_called_once_with(prefixo, 1, Contrato.objects, "numero")
+        self.assertEqual(relatorio[0]["numero"], f"{prefixo}{ultimo + 1:06d}")
+        self.assertEqual(Contrato.objects.get(pk=sem_numero.pk).numero, relatorio[0]["numero"])
+
+    def test_endpoint_inclui_ids_nao_encontrados(self):
+        cliente = APIClient()
+        cliente.force_authenticate(
+            get_user_model().objects.create_superuser(
+                username="admin", email="admin@example.com", password="senha"
+            )
+        )
+
+        resposta = cliente.post(
+            reverse("contratos-gerar-pdf-lote"),
+            {"ids": [self.contratos[0].pk, self.contratos[2].pk, 999999]},
+            format="json",
+            secure=True,
+        )
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.data["emitidos"], 1)
+        self.assertEqual(resposta.data["erros"], 2)
+        self.assertEqual(
+            [(item["id"], item["status"]) for item in resposta.data["itens"]],
+            [(self.contratos[0].pk, "EMITIDO"), (self.contratos[2].pk, "ERRO"), (999999, "ERRO")],
+        )
+        self.assertEqual(resposta.data["itens"][2]["erro"], "Contrato nao encontrado.")
+
+
+class StorageSemCaminho(FileSystemStorage):
+    """Storage sem caminho local (como o S3): ``path`` nao e implementado."""
+
+    def path(self, name):
+        raise NotImplementedError("Este storage nao tem caminho local.")
+
+    def _caminho(self, name):
+        return super().path(name)
+
+    def _open(self, name, mode="rb"):
+        return File(open(self._caminho(name), mode))
+
+    def exists(self, name):
+        return os.path.lexists(self._caminho(name))
+
+    def delete(self, name):
+        os.remove(self._caminho(name))
+
+
+class ArmazenamentoPdfTests(MidiaTemporariaMixin, TestCase):
+    """Contagem de referencias dos PDFs deduplicados e o que a coleta apaga."""
+
+    def _envelhecer(self, *arquivos):
+        antigo = timezone.now() - CARENCIA_COLETA - timedelta(minutes=1)
+        ArquivoPdf.objects.filter(pk__in=[arquivo.pk for arquivo in arquivos]).update(
+            updated_at=antigo
+        )
+
+    def test_mesmo_conteudo_grava_um_arquivo_e_soma_referencias(self):
+        primeiro = armazenar_pdf(b"%PDF contrato")
+        pasta = f"pdfs/{primeiro.hash[:2]}"
+        arquivos = default_storage.listdir(pasta)[1]
+        segundo = armazenar_pdf(b"%PDF contrato")
+        self.assertEqual(default_storage.listdir(pasta)[1], arquivos)
+        outro = armazenar_pdf(b"%PDF outro")
+
+        self.assertEqual(primeiro.pk, segundo.pk)
+        self.assertEqual(segundo.referencias, 2)
+        self.assertEqual(ArquivoPdf.objects.get(pk=primeiro.pk).referencias, 2)
+        self.assertNotEqual(outro.arquivo.name, primeiro.arquivo.name)
+        with default_storage.open(primeiro.arquivo.name) as conteudo:
+            self.assertEqual(conteudo.read(), b"%PDF contrato")
+
+    def test_liberar_nao_fica_negativo_e_ignora_caminhos_antigos(self):
+        arquivo = armazenar_pdf(b"%PDF contrato")
+
+        liberar_pdf(arquivo.arquivo.name)
+        liberar_pdf(arquivo.arquivo.name)
+        liberar_pdf("contratos/CEJAM-2026-000001/contrato.pdf")
+
+        self.assertEqual(ArquivoPdf.objects.get(pk=arquivo.pk).referencias, 0)
+
+    def test_recontar_usa_contratos_e_notas_fiscais(self):
+        contrato = criar_contratos(1)[0]
+        arquivo = armazenar_pdf(b"%PDF contrato")
+        Contrato.objects.filter(pk=contrato.pk).update(pdf_gerado=arquivo.arquivo.name)
+        ArquivoPdf.objects.filter(pk=arquivo.pk).update(referencias=7)
+        sem_uso = armazenar_pdf(b"%PDF sem uso")
+
+        self.assertEqual(recontar_referencias(), 2)
+        self.assertEqual(ArquivoPdf.objects.get(pk=arquivo.pk).referencias, 1)
+        self.assertEqual(ArquivoPdf.objects.get(pk=sem_uso.pk).referencias, 0)
+        self.assertEqual(recontar_referencias(), 0)
+
+    def test_coleta_apaga_so_arquivos_sem_referencia_fora_da_carencia(self):
+        contrato = criar_contratos(1)[0]
+        usado = armazenar_pdf(b"%PDF usado")
+        Contrato.objects.filter(pk=contrato.pk).update(pdf_gerado=usado.arquivo.name)
+        liberado = armazenar_pdf(b"%PDF liberado")
+        liberar_pdf(liberado.arquivo.name)
+        recente = armazenar_pdf(b"%PDF recente")
+        liberar_pdf(recente.arquivo.name)
+        self._envelhecer(usado, liberado)
+
+        resultado = coletar_pdfs()
+
+        self.assertEqual(resultado["removidos"], 1)
+        self.assertEqual(resultado["bytes"], liberado.tamanho)
+        self.assertEqual(
+            set(ArquivoPdf.objects.values_list("pk", flat=True)), {usado.pk, recente.pk}
+        )
+        self.assertFalse(default_storage.exists(liberado.arquivo.name))
+        self.assertTrue(default_storage.exists(usado.arquivo.name))
+        self.assertTrue(default_storage.exists(recente.arquivo.name))
+
+    def test_coleta_apaga_orfaos_antigos_e_respeita_dry_run(self):
+        antigo = default_storage.save("pdfs/ab/orfao-antigo.pdf", ContentFile(b"%PDF orfao"))
+        novo = default_storage.save("pdfs/ab/orfao-novo.pdf", ContentFile(b"%PDF novo"))
+        instante = time.time() - CARENCIA_COLETA.total_seconds() - 60
+        os.utime(default_storage.path(antigo), (instante, instante))
+
+        simulado = coletar_pdfs(dry_run=True)
+        self.assertEqual((simulado["orfaos"], simulado["bytes"]), (1, len(b"%PDF orfao")))
+        self.assertTrue(default_storage.exists(antigo))
+
+        coletar_pdfs()
+        self.assertFalse(default_storage.exists(antigo))
+        self.assertTrue(default_storage.exists(novo))
+
+    def test_migrar_legado_mantem_o_caminho_antigo(self):
+        contrato = criar_contratos(1)[0]
+        contrato.pdf_gerado.save("contrato.pdf", ContentFile(b"%PDF legado"), save=False)
+        antigo = contrato.pdf_gerado.name
+
+        arquivo = migrar_legado(contrato.pdf_gerado)
+
+        self.assertEqual(contrato.pdf_gerado.name, arquivo.arquivo.name)
+        self.assertTrue(
+            os.path.samefile(
+                default_storage.path(antigo), default_storage.path(arquivo.arquivo.name)
+            )
+        )
+
+    def test_migrar_legado_em_storage_remoto_nao_apaga_o_antigo(self):
+        contrato = criar_contratos(1)[0]
+        antigo = default_storage.save("contratos/legado/contrato.pdf", ContentFile(b"%PDF legado"))
+        remoto = StorageSemCaminho(location=default_storage.location)
+        contrato.pdf_gerado.name = antigo
+        contrato.pdf_gerado.storage = remoto
+
+        arquivo = migrar_legado(contrato.pdf_gerado)
+
+        self.assertEqual(contrato.pdf_gerado.name, arquivo.arquivo.name)
+        self.assertTrue(remoto.exists(antigo))
+
+        contrato.pdf_gerado.name = antigo
+        migrar_legado(contrato.pdf_gerado, remover=True)
+        self.assertFalse(remoto.exists(antigo))
+        self.assertEqual(ArquivoPdf.objects.get(pk=arquivo.pk).referencias, 2)
+
+
+class SnapshotCompactoTests(TestCase):
+    """Partes compartilhadas do snapshot viram referencias sem perder dados."""
+
+    def setUp(self):
+        snapshots._conhecidas.clear()
+        self.contratos = criar_contratos(3)
+        # Snapshots no formato antigo, completos, relidos do JSONField.
+        for contrato in self.contratos:
+            Contrato.objects.filter(pk=contrato.pk).update(
+                snapshot=services.build_snapshot(contrato, contrato.responsavel)
+            )
+        self.completos = dict(Contrato.objects.values_list("pk", "snapshot"))
+
+    def compactar(self):
+        saida = io.StringIO()
+        call_command("compactar_snapshots", stdout=saida)
+        return saida.getvalue()
+
+    def test_ida_e_volta(self):
+        cache = {}
+        for completo in self.completos.values():
+            compacto = snapshots.compactar_snapshot(completo)
+            for tipo in snapshots.PARTES:
+                self.assertEqual(list(compacto[tipo]), [snapshots.REFERENCIA])
+            self.assertEqual(compacto["aluno"], completo["aluno"])
+            self.assertEqual(snapshots.expandir_snapshot(compacto), completo)
+            self.assertEqual(snapshots.expandir_snapshot(compacto, cache=cache), completo)
+        # Ja compactado ou sem snapshot: devolvido como esta.
+        self.assertEqual(snapshots.compactar_snapshot(compacto), compacto)
+        self.assertIsNone(snapshots.compactar_snapshot(None))
+        self.assertEqual(snapshots.expandir_snapshot({"aluno": {"id": 1}}), {"aluno": {"id": 1}})
+
+    def test_partes_deduplicadas(self):
+        for completo in self.completos.values():
+            snapshots.compactar_snapshot(completo)
+
+        # Escola, turma, plano e template sao os mesmos nos tres contratos.
+        self.assertEqual(SnapshotParte.objects.count(), len(snapshots.PARTES))
+        self.assertEqual(
+            sorted(SnapshotParte.objects.values_list("tipo", flat=True)),
+            sorted(snapshots.PARTES),
+        )
+
+        alterado = dict(next(iter(self.completos.values())))
+        alterado["plano"] = {**alterado["plano"], "nome": "Plano novo"}
+        snapshots.compactar_snapshot(alterado)
+        self.assertEqual(SnapshotParte.objects.count(), len(snapshots.PARTES) + 1)
+
+    def test_comando_idempotente(self):
+        Contrato.objects.filter(pk=self.contratos[0].pk).update(snapshot=None)
+        del self.completos[self.contratos[0].pk]
+
+        self.assertIn("Compactados: 2 snapshot(s).", self.compactar())
+        depois = dict(Contrato.objects.exclude(snapshot=None).values_list("pk", "snapshot"))
+        partes = SnapshotParte.objects.count()
+
+        self.assertIn("Compactados: 0 snapshot(s).", self.compactar())
+        self.assertEqual(
+            dict(Contrato.objects.exclude(snapshot=None).values_list("pk", "snapshot")), depois
+        )
+        self.assertEqual(SnapshotParte.objects.count(), partes)
+        self.assertEqual(partes, len(snapshots.PARTES))
+        for pk, completo in self.completos.items():
+            self.assertEqual(Contrato.objects.get(pk=pk).snapshot_completo(), completo)
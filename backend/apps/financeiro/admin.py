@@ -5,10 +5,12 @@ from django.db.models import Sum
 
 from .models import (
     Despesa,
+    HistoricoArquivo,
     PagamentoAluno,
     PagamentoAlunoHistorico,
     PagamentoProfessor,
     PlanoEducacional,
+    RecalculoJob,
 )
 
 
@@ -78,7 +80,15 @@ class PagamentoAlunoAdmin(admin.ModelAdmin):
         "pagamento_registrado_em",
         "nf_numero",
         "nf_pdf",
+        "nf_hash",
         "nf_emitida_em",
+        "nf_status",
+        "nf_tentativas",
+        "nf_proxima_tentativa",
+        "nf_erro",
+        "nf_solicitada_por",
+        "recalculado_em",
+        "referencia_calculo",
         "created_at",
         "updated_at",
     )
@@ -104,8 +114,26 @@ class PagamentoAlunoAdmin(admin.ModelAdmin):
             {"fields": ("data_vencimento", "data_pagamento", "forma_pagamento", "status")},
         ),
         ("Observacoes", {"fields": ("observacoes",)}),
-        ("Nota fiscal", {"fields": ("nf_numero", "nf_pdf", "nf_emitida_em")}),
-        ("Auditoria", {"fields": ("created_at", "updated_at")}),
+        (
+            "Nota fiscal",
+            {
+                "fields": (
+                    "nf_numero",
+                    "nf_pdf",
+                    "nf_hash",
+                    "nf_emitida_em",
+                    "nf_status",
+                    "nf_tentativas",
+                    "nf_proxima_tentativa",
+                    "nf_erro",
+                    "nf_solicitada_por",
+                )
+            },
+        ),
+        (
+            "Auditoria",
+            {"fields": ("recalculado_em", "referencia_calculo", "created_at", "updated_at")},
+        ),
     )
 
     def changelist_view(self, request, extra_context=None):
@@ -132,6 +160,42 @@ class PagamentoAlunoHistoricoAdmin(admin.ModelAdmin):
     readonly_fields = ("created_at",)
 
 
+@admin.register(HistoricoArquivo)
+class HistoricoArquivoAdmin(admin.ModelAdmin):
+    list_display = ("mes", "total", "arquivo", "updated_at")
+    readonly_fields = ("mes", "arquivo", "total", "created_at", "updated_at")
+
+
+@admin.register(RecalculoJob)
+class RecalculoJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "status",
+        "processados",
+        "total",
+        "atualizados",
+        "historicos",
+        "created_at",
+        "finalizado_em",
+    )
+    list_filter = ("status",)
+    readonly_fields = (
+        "parametros",
+        "chave",
+        "total",
+        "processados",
+        "atualizados",
+        "historicos",
+        "ultimo_pk",
+        "erros",
+        "solicitado_por",
+        "iniciado_em",
+        "finalizado_em",
+        "created_at",
+        "updated_at",
+    )
+
+
 @admin.register(PagamentoProfessor)
 class PagamentoProfessorAdmin(admin.ModelAdmin):
     change_list_template = "admin/financeiro/pagamentoprofessor/change_list.html"
@@ -1,6 +1,37 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, pre_delete
 
 
 class FinanceiroConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "apps.financeiro"
+
+    def ready(self):
+        from .models import PagamentoAluno, PlanoEducacional
+        from .resumo import (
+            antes_de_excluir,
+            antes_de_excluir_plano,
+            depois_de_excluir,
+            depois_de_excluir_plano,
+        )
+
+        pre_delete.connect(
+            antes_de_excluir,
+            sender=PagamentoAluno,
+            dispatch_uid="financeiro.resumo.antes_de_excluir",
+        )
+        post_delete.connect(
+            depois_de_excluir,
+            sender=PagamentoAluno,
+            dispatch_uid="financeiro.resumo.depois_de_excluir",
+        )
+        pre_delete.connect(
+            antes_de_excluir_plano,
+            sender=PlanoEducacional,
+            dispatch_uid="financeiro.resumo.antes_de_excluir_plano",
+        )
+        post_delete.connect(
+            depois_de_excluir_plano,
+            sender=PlanoEducacional,
+            dispatch_uid="financeiro.resumo.depois_de_excluir_plano",
+        )
@@ -0,0 +1,244 @@
+import gzip
+import io
+import json
+from collections import Counter
+from datetime import datetime
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import HistoricoArquivo, HistoricoArquivoIndice, PagamentoAlunoHistorico
+
+
+LOTE_ARQUIVAMENTO = 2000
+
+
+def limite_arquivamento(meses=None, referencia=None):
+    """Primeiro dia do mes mais antigo que continua na tabela quente."""
+    if meses is None:
+        meses = getattr(settings, "FINANCEIRO_HISTORICO_RETENCAO_MESES", 12)
+    referencia = (referencia or timezone.localdate()).replace(day=1)
+    indice = referencia.year * 12 + (referencia.month - 1) - max(meses, 0)
+    return referencia.replace(year=indice // 12, month=indice % 12 + 1)
+
+
+def _inicio_do_mes(mes):
+    inicio = datetime(mes.year, mes.month, 1)
+    return timezone.make_aware(inicio) if settings.USE_TZ else inicio
+
+
+def _serializar(historico):
+    return {
+        "id": historico.id,
+        "pagamento": historico.pagamento_id,
+        "aluno": historico.pagamento.aluno_id,
+        "acao": historico.acao,
+        "status_anterior": historico.status_anterior,
+        "status_novo": historico.status_novo,
+        "valor_devido": str(historico.valor_devido),
+        "valor_pago": str(historico.valor_pago),
+        "alterado_por": historico.alterado_por_id,
+        "detalhes": historico.detalhes,
+        "created_at": timezone.localtime(historico.created_at).isoformat(),
+    }
+
+
+def _comprimir(registros):
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb") as arquivo:
+        for registro in registros:
+            linha = json.dumps(registro, ensure_ascii=False, default=str)
+            arquivo.write(linha.encode("utf-8") + b"\n")
+    return buffer.getvalue()
+
+
+def _descomprimir(conteudo):
+    with gzip.GzipFile(fileobj=io.BytesIO(conteudo)) as arquivo:
+        return [json.loads(linha) for linha in arquivo]
+
+
+def _ler(arquivo):
+    """Registros de um arquivo mensal, na ordem em que foram gravados."""
+    with arquivo.arquivo.open("rb") as bruto:
+        return _descomprimir(bruto.read())
+
+
+def _indexar(arquivo, registros):
+    contagem = Counter(
+        (registro["aluno"], registro["pagamento"], registro["acao"], registro["alterado_por"])
+        for registro in registros
+    )
+    HistoricoArquivoIndice.objects.filter(arquivo=arquivo).delete()
+    HistoricoArquivoIndice.objects.bulk_create(
+        [
+            HistoricoArquivoIndice(
+                arquivo=arquivo,
+                aluno_id=aluno_id,
+                pagamento_id=pagamento_id,
+                acao=acao,
+                alterado_por_id=alterado_por_id,
+                total=total,
+            )
+            for (aluno_id, pagamento_id, acao, alterado_por_id), total in contagem.items()
+        ],
+        batch_size=LOTE_ARQUIVAMENTO,
+    )
+
+
+def _arquivar_mes(mes, queryset):
+    existente = HistoricoArquivo.objects.filter(mes=mes).first()
+    anterior = b""
+    if existente:
+        with existente.arquivo.open("rb") as atual:
+            anterior = atual.read()
+    arquivados = _descomprimir(anterior) if anterior else []
+    ja_arquivados = {registro["id"] for registro in arquivados}
+
+    registros = []
+    pks = []
+    for historico in queryset.select_related("pagamento").order_by("created_at", "id").iterator(
+        chunk_size=LOTE_ARQUIVAMENTO
+    ):
+        pks.append(historico.pk)
+        # Uma execucao anterior pode ter gravado o arquivo e falhado antes de
+        # apagar as linhas: elas so precisam sair da tabela.
+        if historico.pk not in ja_arquivados:
+            registros.append(_serializar(historico))
+    if not pks:
+        return 0
+
+    arquivo_antigo = existente.arquivo.name if existente else None
+    if existente is None:
+        existente = HistoricoArquivo(mes=mes)
+    if registros:
+        # Cada execucao acrescenta um membro gzip ao arquivo do mes; leitores de
+        # gzip tratam membros concatenados como um unico fluxo.
+        conteudo = anterior + _comprimir(registros)
+        existente.arquivo.save(f"{mes:%Y-%m}.jsonl.gz", ContentFile(conteudo), save=False)
+    todos = arquivados + registros
+    existente.total = len(todos)
+    try:
+        with transaction.atomic():
+            existente.save()
+            _indexar(existente, todos)
+            for inicio in range(0, len(pks), LOTE_ARQUIVAMENTO):
+                PagamentoAlunoHistorico.objects.filter(
+                    pk__in=pks[inicio : inicio + LOTE_ARQUIVAMENTO]
+                ).delete()
+    except Exception:
+        if registros and existente.arquivo.name != arquivo_antigo:
+            existente.arquivo.storage.delete(existente.arquivo.name)
+        raise
+    if arquivo_antigo and arquivo_antigo != existente.arquivo.name:
+        existente.arquivo.storage.delete(arquivo_antigo)
+    return len(pks)
+
+
+def arquivar_historico(meses=None, dry_run=False):
+    """Move para o arquivo mensal os historicos anteriores ao limite.
+
+    Retorna ``{mes: quantidade}`` dos meses arquivados.
+    """
+    limite = limite_arquivamento(meses)
+    antigos = PagamentoAlunoHistorico.objects.filter(created_at__lt=_inicio_do_mes(limite))
+    meses_antigos = (
+        antigos.annotate(mes=TruncMonth("created_at"))
+        .values_list("mes", flat=True)
+        .distinct()
+        .order_by("mes")
+    )
+    resultado = {}
+    for mes in meses_antigos:
+        mes = mes.date() if hasattr(mes, "date") else mes
+        inicio = _inicio_do_mes(mes)
+        proximo = mes.replace(year=mes.year + mes.month // 12, month=mes.month % 12 + 1)
+        queryset = antigos.filter(created_at__gte=inicio, created_at__lt=_inicio_do_mes(proximo))
+        if dry_run:
+            resultado[mes] = queryset.count()
+        else:
+            resultado[mes] = _arquivar_mes(mes, queryset)
+    return resultado
+
+
+class ConsultaArquivo:
+    """Historicos arquivados de um filtro, do mais novo para o mais antigo.
+
+    Conta pelo HistoricoArquivoIndice e so descompacta os meses da fatia pedida.
+    Tem ``count()`` e fatiamento como um queryset, para a paginacao do DRF.
+    ``buscas`` tem um par ``(alunos, usuarios)`` de ids por termo de busca: o
+    registro precisa bater com todos os termos, pelo aluno ou por quem alterou.
+    """
+
+    def __init__(self, pagamento_id=None, aluno_id=None, acao=None, buscas=(), descendente=True):
+        self.pagamento_id = pagamento_id
+        self.aluno_id = aluno_id
+        self.acao = acao
+        self.buscas = buscas
+        self.descendente = descendente
+        self._meses = None
+
+    def _filtro(self):
+        filtro = Q()
+        if self.pagamento_id:
+            filtro &= Q(pagamento_id=self.pagamento_id)
+        if self.aluno_id:
+            filtro &= Q(aluno_id=self.aluno_id)
+        if self.acao:
+            filtro &= Q(acao=self.acao)
+        for alunos, usuarios in self.buscas:
+            filtro &= Q(aluno_id__in=alunos) | Q(alterado_por_id__in=usuarios)
+        return filtro
+
+    def _aceita(self, registro):
+        if self.pagamento_id and str(registro["pagamento"]) != str(self.pagamento_id):
+            return False
+        if self.aluno_id and str(registro["aluno"]) != str(self.aluno_id):
+            return False
+        if self.acao and registro["acao"] != self.acao:
+            return False
+        return all(
+            registro["aluno"] in alunos or registro["alterado_por"] in usuarios
+            for alunos, usuarios in self.buscas
+        )
+
+    def meses(self):
+        """``[(arquivo_id, total)]`` dos meses com registros, na ordem da consulta."""
+        if self._meses is None:
+            self._meses = list(
+                HistoricoArquivoIndice.objects.filter(self._filtro())
+                .values("arquivo_id")
+                .annotate(quantidade=Sum("total"))
+                .order_by("-arquivo__mes" if self.descendente else "arquivo__mes")
+                .values_list("arquivo_id", "quantidade")
+            )
+        return self._meses
+
+    def count(self):
+        return sum(quantidade for _, quantidade in self.meses())
+
+    def __getitem__(self, fatia):
+        inicio = fatia.start or 0
+        fim = self.count() if fatia.stop is None else fatia.stop
+        resultado = []
+        posicao = 0
+        for arquivo_id, quantidade in self.meses():
+            if posicao >= fim:
+                break
+            if posicao + quantidade > inicio:
+                registros = [
+                    registro
+                    for registro in _ler(HistoricoArquivo.objects.get(pk=arquivo_id))
+                    if self._aceita(registro)
+                ]
+                # O arquivo esta em ordem de created_at.
+                if self.descendente:
+                    registros.reverse()
+                for registro in registros[max(inicio - posicao, 0) : fim - posicao]:
+                    registro["arquivado"] = True
+                    resultado.append(registro)
+            posicao += quantidade
+        return resultado
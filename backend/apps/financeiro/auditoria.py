@@ -0,0 +1,76 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from decimal import Decimal
+
+from django.db import transaction
+
+from .models import PagamentoAlunoHistorico
+
+
+BULK_BATCH_SIZE = 500
+
+_buffer_atual = ContextVar("historico_buffer", default=None)
+
+
+class HistoricoBuffer:
+    """Acumula PagamentoAlunoHistorico e grava tudo com um unico bulk_create."""
+
+    def __init__(self):
+        self.entradas = []
+
+    def adicionar(self, historico):
+        self.entradas.append(historico)
+        return historico
+
+    def flush(self):
+        entradas, self.entradas = self.entradas, []
+        if entradas:
+            PagamentoAlunoHistorico.objects.bulk_create(entradas, batch_size=BULK_BATCH_SIZE)
+        return len(entradas)
+
+
+@contextmanager
+def historico_em_lote():
+    """Agrupa os historicos registrados no bloco em um unico INSERT.
+
+    O flush e agendado com transaction.on_commit ao sair do bloco: dentro de um
+    atomic ele so acontece se a transacao for commitada (rollback descarta as
+    entradas); em autocommit roda na saida. Blocos aninhados reaproveitam o
+    buffer do bloco mais externo.
+    """
+    atual = _buffer_atual.get()
+    if atual is not None:
+        yield atual
+        return
+    buffer = HistoricoBuffer()
+    token = _buffer_atual.set(buffer)
+    try:
+        yield buffer
+    finally:
+        _buffer_atual.reset(token)
+        transaction.on_commit(buffer.flush)
+
+
+def registrar_historico(
+    pagamento,
+    acao,
+    status_anterior=None,
+    status_novo=None,
+    detalhes=None,
+    user=None,
+):
+    historico = PagamentoAlunoHistorico(
+        pagamento=pagamento,
+        acao=acao,
+        status_anterior=status_anterior,
+        status_novo=status_novo,
+        valor_devido=pagamento.valor_total,
+        valor_pago=pagamento.valor_pago or Decimal("0.00"),
+        alterado_por=user,
+        detalhes=detalhes,
+    )
+    buffer = _buffer_atual.get()
+    if buffer is None:
+        historico.save()
+        return historico
+    return buffer.adicionar(historico)
@@ -0,0 +1,238 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.utils import timezone
+
+from .models import PagamentoAluno, PlanoEducacional
+
+
+CENTAVO = Decimal("0.01")
+
+# Percentuais do plano tem 2 casas decimais: guardados como centesimos de ponto
+# percentual, 100% == 10000.
+ESCALA_PERCENT = 10000
+
+# Numeradores acima deste limite podem estourar int64; essas linhas caem no
+# calculo escalar de aplicar_regras.
+LIMITE_INT64 = 2**62
+
+BOLSA_NENHUMA = 0
+BOLSA_PARCIAL = 1
+BOLSA_INTEGRAL = 2
+
+STATUS_CODIGOS = {
+    PagamentoAluno.Status.PAGO: 0,
+    PagamentoAluno.Status.EM_ABERTO: 1,
+    PagamentoAluno.Status.ATRASADO: 2,
+    PagamentoAluno.Status.ISENTO: 3,
+}
+STATUS_VALORES = {codigo: status for status, codigo in STATUS_CODIGOS.items()}
+
+CAMPOS_MONETARIOS = ("desconto", "multa", "juros", "valor_pago")
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError as exc:
+        raise RuntimeError("numpy nao instalado. Instale com: pip install numpy") from exc
+    return numpy
+
+
+def _inteiro(value, escala):
+    return int((Decimal(value or 0) * escala).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def _codigo_bolsa(plano):
+    if plano.bolsa_tipo == PlanoEducacional.BolsaTipo.INTEGRAL:
+        return BOLSA_INTEGRAL
+    if plano.bolsa_tipo in {PlanoEducacional.BolsaTipo.PARCIAL, PlanoEducacional.BolsaTipo.CONVENIO}:
+        return BOLSA_PARCIAL
+    return BOLSA_NENHUMA
+
+
+def quantizar(value):
+    return Decimal(value).quantize(CENTAVO, rounding=ROUND_HALF_UP)
+
+
+def arredondar_monetarios(pagamento):
+    """Arredonda os campos calculados por aplicar_regras como o banco grava.
+
+    Sem isso o calculo escalar compara valores com mais casas do que a coluna
+    (0.003885) com os gravados e registra alteracoes e historico que nao existem.
+    """
+    for campo in CAMPOS_MONETARIOS:
+        valor = getattr(pagamento, campo)
+        if valor is not None:
+            setattr(pagamento, campo, quantizar(valor))
+
+
+def _arredondar(np, numerador, divisor):
+    # Arredondamento meio-para-cima (igual ao numeric do PostgreSQL) em inteiros.
+    metade = divisor // 2
+    positivo = (numerador + metade) // divisor
+    negativo = -((-numerador + metade) // divisor)
+    return np.where(numerador >= 0, positivo, negativo)
+
+
+def extrair_colunas(pagamentos, referencia=None):
+    """Monta as colunas (centavos, ordinais de dia, codigos) de um lote."""
+    np = _numpy()
+    hoje = timezone.localdate().toordinal()
+    colunas = {
+        "valor": [],
+        "vencimento": [],
+        "referencia": [],
+        "status": [],
+        "tem_plano": [],
+        "desconto_percent": [],
+        "bolsa_tipo": [],
+        "bolsa_percent": [],
+        "multa_percent": [],
+        "juros_percent": [],
+        "juros_diario_percent": [],
+    }
+    for pagamento in pagamentos:
+        plano = pagamento.plano or getattr(pagamento.aluno, "plano_financeiro", None)
+        ref = referencia or pagamento.data_pagamento
+        colunas["valor"].append(_inteiro(pagamento.valor, 100))
+        colunas["vencimento"].append(
+            pagamento.data_vencimento.toordinal() if pagamento.data_vencimento else -1
+        )
+        colunas["referencia"].append(ref.toordinal() if ref else hoje)
+        colunas["status"].append(STATUS_CODIGOS.get(pagamento.status, -1))
+        colunas["tem_plano"].append(plano is not None)
+        colunas["desconto_percent"].append(_inteiro(plano and plano.desconto_percent, 100))
+        colunas["bolsa_tipo"].append(_codigo_bolsa(plano) if plano else BOLSA_NENHUMA)
+        colunas["bolsa_percent"].append(_inteiro(plano and plano.bolsa_percent, 100))
+        colunas["multa_percent"].append(_inteiro(plano and plano.multa_percent, 100))
+        colunas["juros_percent"].append(_inteiro(plano and plano.juros_percent, 100))
+        colunas["juros_diario_percent"].append(
+            _inteiro(plano and plano.juros_diario_percent, 100)
+        )
+    return {
+        nome: np.asarray(valores, dtype=np.bool_ if nome == "tem_plano" else np.int64)
+        for nome, valores in colunas.items()
+    }
+
+
+def calcular_colunas(colunas):
+    """Aplica as regras de aplicar_regras a um lote inteiro de colunas.
+
+    Todos os valores monetarios entram e saem em centavos. Os intermediarios sao
+    mantidos exatos (sem arredondar desconto antes de multa/juros, como no
+    calculo escalar) e so o resultado final e arredondado para centavos.
+    Linhas marcadas em ``escalar`` ultrapassam a faixa segura de int64 e devem
+    ser recalculadas com aplicar_regras.
+    """
+    np = _numpy()
+    valor = colunas["valor"]
+    status = colunas["status"].copy()
+    tem_plano = colunas["tem_plano"]
+    isento = status == STATUS_CODIGOS[PagamentoAluno.Status.ISENTO]
+    pago = status == STATUS_CODIGOS[PagamentoAluno.Status.PAGO]
+
+    # Valores em 1/10000 de centavo.
+    valor_4 = valor * ESCALA_PERCENT
+    bolsa_4 = np.where(
+        colunas["bolsa_tipo"] == BOLSA_INTEGRAL,
+        valor_4,
+        np.where(
+            colunas["bolsa_tipo"] == BOLSA_PARCIAL,
+            valor * colunas["bolsa_percent"],
+            0,
+        ),
+    )
+    liquido_4 = valor_4 - valor * colunas["desconto_percent"] - bolsa_4
+    liquido_4 = np.maximum(liquido_4, 0)
+    desconto_4 = np.where(tem_plano, np.maximum(valor_4 - liquido_4, 0), 0)
+    desconto_4 = np.where(isento, valor_4, desconto_4)
+
+    dias_atraso = np.where(
+        colunas["vencimento"] >= 0,
+        np.maximum(colunas["referencia"] - colunas["vencimento"], 0),
+        0,
+    )
+    dias_atraso = np.where(isento, 0, dias_atraso)
+
+    # Multa e juros em 1/10^8 de centavo.
+    base_4 = np.maximum(valor_4 - desconto_4, 0)
+    cobra = tem_plano & (dias_atraso > 0) & ~isento
+    taxa_juros = colunas["juros_percent"] + colunas["juros_diario_percent"] * dias_atraso
+
+    maior_taxa = np.maximum(np.maximum(colunas["multa_percent"], taxa_juros), ESCALA_PERCENT)
+    estimativa = np.abs(valor_4).astype(np.float64) * maior_taxa.astype(np.float64) * 4
+    escalar = estimativa >= LIMITE_INT64
+
+    multa_8 = np.where(cobra & ~escalar, base_4 * colunas["multa_percent"], 0)
+    juros_8 = np.where(cobra & ~escalar, base_4 * taxa_juros, 0)
+    total_8 = np.where(
+        escalar,
+        0,
+        (valor_4 - desconto_4) * ESCALA_PERCENT + multa_8 + juros_8,
+    )
+    total_8 = np.maximum(total_8, 0)
+
+    divisor_8 = ESCALA_PERCENT * ESCALA_PERCENT
+    aberto = ~pago & ~isento
+    status = np.where(
+        aberto & (dias_atraso > 0),
+        STATUS_CODIGOS[PagamentoAluno.Status.ATRASADO],
+        np.where(aberto, STATUS_CODIGOS[PagamentoAluno.Status.EM_ABERTO], status),
+    )
+    return {
+        "desconto": _arredondar(np, desconto_4, ESCALA_PERCENT),
+        "multa": _arredondar(np, multa_8, divisor_8),
+        "juros": _arredondar(np, juros_8, divisor_8),
+        "valor_total": _arredondar(np, total_8, divisor_8),
+        "dias_atraso": dias_atraso,
+        "status": status,
+        "escalar": escalar,
+    }
+
+
+def _centavos_para_decimal(value):
+    return (Decimal(int(value)) / 100).quantize(CENTAVO)
+
+
+def avaliar_lote(pagamentos, referencia=None):
+    """Equivalente vetorizado de ``aplicar_regras`` para uma lista de pagamentos.
+
+    Altera as instancias em memoria exatamente como aplicar_regras, mas com os
+    valores monetarios ja arredondados para centavos (meio-para-cima), que e o
+    que o banco grava.
+    """
+    pagamentos = list(pagamentos)
+    if not pagamentos:
+        return pagamentos
+    colunas = extrair_colunas(pagamentos, referencia=referencia)
+    resultado = calcular_colunas(colunas)
+    hoje = timezone.localdate()
+    agora = timezone.now()
+    for indice, pagamento in enumerate(pagamentos):
+        if resultado["escalar"][indice]:
+            pagamento.aplicar_regras(referencia)
+            arredondar_monetarios(pagamento)
+            continue
+
+        plano = pagamento.plano or getattr(pagamento.aluno, "plano_financeiro", None)
+        if plano and not pagamento.plano:
+            pagamento.plano = plano
+        pagamento.referencia_calculo = referencia or pagamento.data_pagamento or hoje
+        pagamento.recalculado_em = agora
+        pagamento.desconto = _centavos_para_decimal(resultado["desconto"][indice])
+        pagamento.multa = _centavos_para_decimal(resultado["multa"][indice])
+        pagamento.juros = _centavos_para_decimal(resultado["juros"][indice])
+        pagamento.dias_atraso = int(resultado["dias_atraso"][indice])
+
+        if pagamento.status == PagamentoAluno.Status.ISENTO:
+            pagamento.valor_pago = Decimal("0.00")
+            continue
+        codigo = int(resultado["status"][indice])
+        if codigo in STATUS_VALORES:
+            pagamento.status = STATUS_VALORES[codigo]
+        if pagamento.status == PagamentoAluno.Status.PAGO:
+            if not pagamento.data_pagamento:
+                pagamento.data_pagamento = hoje
+            if pagamento.valor_pago is None:
+                pagamento.valor_pago = _centavos_para_decimal(resultado["valor_total"][indice])
+    return pagamentos
@@ -0,0 +1,114 @@
+import tempfile
+import zipfile
+from datetime import date
+
+from django.conf import settings
+
+from .models import PagamentoAluno
+
+
+CHUNK_SIZE = 64 * 1024
+
+FORMATOS = ("zip", "pdf")
+
+
+def parse_competencia(valor):
+    """Converte ``AAAA-MM`` no primeiro dia do mes."""
+    try:
+        ano, mes = (int(parte) for parte in str(valor).split("-")[:2])
+        return date(ano, mes, 1)
+    except (TypeError, ValueError) as exc:
+        raise ValueError("Competencia invalida. Use AAAA-MM.") from exc
+
+
+def notas_do_mes(competencia, turma=None, forma_pagamento=None):
+    """NFs emitidas de uma competencia (``date`` de qualquer dia do mes)."""
+    queryset = (
+        PagamentoAluno.objects.filter(
+            competencia__year=competencia.year,
+            competencia__month=competencia.month,
+        )
+        .exclude(nf_pdf__isnull=True)
+        .exclude(nf_pdf="")
+    )
+    if turma:
+        queryset = queryset.filter(aluno__turma_id=turma)
+    if forma_pagamento:
+        queryset = queryset.filter(forma_pagamento=forma_pagamento)
+    return queryset.only("pk", "nf_numero", "nf_pdf").order_by("nf_numero", "pk")
+
+
+class _Saida:
+    """Destino nao posicionavel do zipfile; os bytes sao retirados a cada bloco."""
+
+    def __init__(self):
+        self.blocos = []
+        self.posicao = 0
+
+    def write(self, dados):
+        self.blocos.append(bytes(dados))
+        self.posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self.posicao
+
+    def flush(self):
+        pass
+
+    def retirar(self):
+        blocos, self.blocos = self.blocos, []
+        return b"".join(blocos)
+
+
+def zip_notas(queryset):
+    """Gera o ZIP das NFs em blocos, lendo um PDF por vez do storage."""
+    saida = _Saida()
+    with zipfile.ZipFile(saida, mode="w", compression=zipfile.ZIP_STORED) as pacote:
+        for pagamento in queryset.iterator(chunk_size=200):
+            nome = f"{pagamento.nf_numero or f'pagamento-{pagamento.pk}'}.pdf"
+            with pagamento.nf_pdf.open("rb") as origem, pacote.open(
+                nome, mode="w", force_zip64=True
+            ) as destino:
+                for bloco in iter(lambda: origem.read(CHUNK_SIZE), b""):
+                    destino.write(bloco)
+                    yield saida.retirar()
+            yield saida.retirar()
+    yield saida.retirar()
+
+
+def pdf_notas(queryset):
+    """Gera um unico PDF com as NFs, na ordem de ``nf_numero``.
+
+    Ao contrario do ZIP, o PdfWriter guarda todas as paginas ate o fim; por isso
+    exportar_notas limita o numero de notas (FINANCEIRO_NF_EXPORTACAO_PDF_MAX).
+    """
+    try:
+        from pypdf import PdfWriter
+    except ImportError as exc:
+        raise RuntimeError("pypdf nao instalado. Instale com: pip install pypdf") from exc
+
+    def _gerar():
+        writer = PdfWriter()
+        for pagamento in queryset.iterator(chunk_size=200):
+            with pagamento.nf_pdf.open("rb") as origem:
+                writer.append(origem)
+        # O documento final vai para disco e sai em blocos, sem copia em memoria.
+        with tempfile.TemporaryFile() as destino:
+            writer.write(destino)
+            writer.close()
+            destino.seek(0)
+            yield from iter(lambda: destino.read(CHUNK_SIZE), b"")
+
+    return _gerar()
+
+
+def exportar_notas(queryset, formato="zip"):
+    if formato not in FORMATOS:
+        raise ValueError("Formato invalido. Use zip ou pdf.")
+    if formato == "pdf":
+        limite = getattr(settings, "FINANCEIRO_NF_EXPORTACAO_PDF_MAX", 300)
+        if queryset.count() > limite:
+            raise ValueError(f"PDF unico limitado a {limite} notas fiscais. Use formato=zip.")
+        return pdf_notas(queryset)
+    return zip_notas(queryset)
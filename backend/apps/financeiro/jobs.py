@@ -0,0 +1,152 @@
+import hashlib
+import json
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import PagamentoAluno, RecalculoJob
+from .recalculo import CHUNK_SIZE, filtrar_incremental, iterar_lotes, recalcular_lote
+
+
+# Job em PROCESSANDO sem progresso por mais tempo que isso e considerado
+# abandonado (processo reiniciado) e pode ser retomado a partir de ultimo_pk.
+JOB_EXPIRACAO = timedelta(minutes=10)
+
+ATIVOS = [RecalculoJob.Status.PENDENTE, RecalculoJob.Status.PROCESSANDO]
+
+
+def _chave(parametros):
+    bruto = json.dumps(parametros, sort_keys=True, default=str)
+    return hashlib.sha256(bruto.encode("utf-8")).hexdigest()
+
+
+def queryset_recalculo(parametros):
+    queryset = PagamentoAluno.objects.exclude(status=PagamentoAluno.Status.PAGO)
+    aluno_id = parametros.get("aluno")
+    if aluno_id:
+        queryset = queryset.filter(aluno_id=aluno_id)
+    # Mesmos campos de PagamentoAlunoViewSet.search_fields.
+    for termo in (parametros.get("search") or "").replace(",", " ").split():
+        queryset = queryset.filter(
+            Q(aluno__nome_completo__icontains=termo) | Q(aluno__cpf__icontains=termo)
+        )
+    if parametros.get("incremental"):
+        queryset = filtrar_incremental(queryset)
+    return queryset
+
+
+def enfileirar_recalculo(parametros, user=None):
+    """Cria o job ou devolve o que ja esta ativo para os mesmos parametros.
+
+    Retorna ``(job, criado)``.
+    """
+    chave = _chave(parametros)
+    try:
+        with transaction.atomic():
+            job = RecalculoJob.objects.create(
+                parametros=parametros,
+                chave=chave,
+                solicitado_por=user,
+            )
+    except IntegrityError:
+        existente = RecalculoJob.objects.filter(chave=chave, status__in=ATIVOS).first()
+        if existente:
+            if _em_thread() and existente.updated_at < timezone.now() - JOB_EXPIRACAO:
+                # A thread que processava o job morreu junto com o worker (restart
+                # do gunicorn) e ninguem chama processar_recalculos nesse modo:
+                # _reservar retoma o job a partir de ultimo_pk.
+                transaction.on_commit(lambda: iniciar_em_thread(existente.pk))
+            return existente, False
+        raise
+    if _em_thread():
+        transaction.on_commit(lambda: iniciar_em_thread(job.pk))
+    return job, True
+
+
+def _em_thread():
+    return getattr(settings, "FINANCEIRO_RECALCULO_EM_THREAD", True)
+
+
+def _reservar(job_id=None):
+    agora = timezone.now()
+    disponiveis = RecalculoJob.objects.filter(
+        Q(status=RecalculoJob.Status.PENDENTE)
+        | Q(status=RecalculoJob.Status.PROCESSANDO, updated_at__lt=agora - JOB_EXPIRACAO)
+    )
+    if job_id is not None:
+        disponiveis = disponiveis.filter(pk=job_id)
+    with transaction.atomic():
+        job = disponiveis.select_for_update(skip_locked=True).order_by("created_at").first()
+        if not job:
+            return None
+        job.status = RecalculoJob.Status.PROCESSANDO
+        job.iniciado_em = job.iniciado_em or agora
+        job.save(update_fields=["status", "iniciado_em", "updated_at"])
+    return job
+
+
+def executar_recalculo(job, chunk_size=CHUNK_SIZE):
+    parametros = job.parametros or {}
+    queryset = queryset_recalculo(parametros)
+    try:
+        if job.ultimo_pk is None:
+            job.total = queryset.count()
+            job.save(update_fields=["total", "updated_at"])
+        for lote in iterar_lotes(queryset, chunk_size=chunk_size, ultimo_pk=job.ultimo_pk):
+            try:
+                atualizados, historicos = recalcular_lote(
+                    lote,
+                    user=job.solicitado_por,
+                    vetorizado=bool(parametros.get("vetorizado")),
+                )
+            except Exception as exc:
+                atualizados, historicos = 0, 0
+                job.erros = (job.erros or []) + [
+                    {"ultimo_pk": lote[-1].pk, "erro": str(exc)}
+                ]
+            job.processados += len(lote)
+            job.atualizados += atualizados
+            job.historicos += historicos
+            job.ultimo_pk = lote[-1].pk
+            job.save(
+                update_fields=[
+                    "processados",
+                    "atualizados",
+                    "historicos",
+                    "ultimo_pk",
+                    "erros",
+                    "updated_at",
+                ]
+            )
+    except Exception as exc:
+        job.status = RecalculoJob.Status.ERRO
+        job.erros = (job.erros or []) + [{"ultimo_pk": job.ultimo_pk, "erro": str(exc)}]
+    else:
+        job.status = RecalculoJob.Status.CONCLUIDO
+    job.finalizado_em = timezone.now()
+    job.save(update_fields=["status", "erros", "finalizado_em", "updated_at"])
+    return job
+
+
+def processar_job(job_id=None, chunk_size=CHUNK_SIZE):
+    job = _reservar(job_id)
+    if job:
+        executar_recalculo(job, chunk_size=chunk_size)
+    return job
+
+
+def iniciar_em_thread(job_id):
+    def _rodar():
+        close_old_connections()
+        try:
+            processar_job(job_id)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=_rodar, name=f"recalculo-{job_id}", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.financeiro.arquivo import arquivar_historico, limite_arquivamento
+
+
+class Command(BaseCommand):
+    help = "Move o historico de pagamentos antigo para arquivos mensais compactados."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--meses",
+            type=int,
+            default=getattr(settings, "FINANCEIRO_HISTORICO_RETENCAO_MESES", 12),
+            help="Meses completos mantidos na tabela (alem do mes atual).",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Apenas mostra quantos registros seriam arquivados por mes.",
+        )
+
+    def handle(self, *args, **options):
+        meses = max(options["meses"], 0)
+        resultado = arquivar_historico(meses=meses, dry_run=options["dry_run"])
+        limite = limite_arquivamento(meses)
+        for mes, total in resultado.items():
+            self.stdout.write(f"{mes:%m/%Y}: {total}")
+        acao = "Seriam arquivados" if options["dry_run"] else "Arquivados"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{acao}: {sum(resultado.values())} historicos anteriores a {limite:%m/%Y}."
+            )
+        )
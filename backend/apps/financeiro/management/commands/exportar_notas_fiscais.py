@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.financeiro.exportacao import FORMATOS, exportar_notas, notas_do_mes, parse_competencia
+
+
+class Command(BaseCommand):
+    help = "Exporta as notas fiscais de uma competencia em um unico PDF ou ZIP."
+
+    def add_arguments(self, parser):
+        parser.add_argument("competencia", help="Competencia no formato AAAA-MM.")
+        parser.add_argument("--turma", type=int, help="Apenas alunos desta turma (id).")
+        parser.add_argument("--forma-pagamento", help="Apenas esta forma de pagamento.")
+        parser.add_argument("--formato", choices=FORMATOS, default="zip")
+        parser.add_argument(
+            "--saida",
+            help="Arquivo de destino (padrao: notas-fiscais-AAAA-MM.<formato>).",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            competencia = parse_competencia(options["competencia"])
+        except ValueError as exc:
+            raise CommandError(str(exc)) from exc
+        queryset = notas_do_mes(
+            competencia,
+            turma=options["turma"],
+            forma_pagamento=options["forma_pagamento"],
+        )
+        total = queryset.count()
+        if not total:
+            raise CommandError("Nenhuma nota fiscal emitida para os filtros informados.")
+        formato = options["formato"]
+        saida = options["saida"] or f"notas-fiscais-{competencia:%Y-%m}.{formato}"
+        try:
+            conteudo = exportar_notas(queryset, formato)
+            with open(saida, "wb") as destino:
+                for bloco in conteudo:
+                    destino.write(bloco)
+        except (RuntimeError, ValueError) as exc:
+            raise CommandError(str(exc)) from exc
+        self.stdout.write(self.style.SUCCESS(f"{total} nota(s) fiscal(is) exportada(s) em {saida}."))
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.financeiro.notas import processar_fila
+
+
+class Command(BaseCommand):
+    help = "Gera os PDFs das notas fiscais enfileiradas pela API."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Processa a fila disponivel e encerra.",
+        )
+        parser.add_argument(
+            "--intervalo",
+            type=float,
+            default=5.0,
+            help="Segundos de espera entre consultas quando a fila esta vazia.",
+        )
+        parser.add_argument(
+            "--lote",
+            type=int,
+            default=10,
+            help="Quantidade de notas reservadas por vez.",
+        )
+
+    def handle(self, *args, **options):
+        lote = max(options["lote"], 1)
+        while True:
+            emitidas, falhas = processar_fila(lote)
+            if emitidas or falhas:
+                self.stdout.write(
+                    self.style.SUCCESS(f"NFs emitidas: {emitidas}. Falhas: {falhas}.")
+                )
+                continue
+            if options["once"]:
+                return
+            time.sleep(max(options["intervalo"], 0.1))
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.financeiro.jobs import processar_job
+from apps.financeiro.recalculo import CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = "Processa os jobs de recalculo financeiro enfileirados pela API."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Processa os jobs pendentes e encerra.",
+        )
+        parser.add_argument(
+            "--intervalo",
+            type=float,
+            default=5.0,
+            help="Segundos de espera entre consultas quando nao ha jobs.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=CHUNK_SIZE,
+            help="Quantidade de pagamentos processados por lote.",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = max(options["chunk_size"], 1)
+        while True:
+            job = processar_job(chunk_size=chunk_size)
+            if job:
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"Job {job.id} {job.status}: processados {job.processados}, "
+                        f"atualizados {job.atualizados}, historicos {job.historicos}."
+                    )
+                )
+                continue
+            if options["once"]:
+                return
+            time.sleep(max(options["intervalo"], 0.1))
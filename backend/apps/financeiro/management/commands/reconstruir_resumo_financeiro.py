@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.financeiro.resumo import reconstruir_resumo
+
+
+class Command(BaseCommand):
+    help = "Recalcula do zero o resumo mensal de pagamentos usado nos dashboards."
+
+    def handle(self, *args, **options):
+        linhas = reconstruir_resumo()
+        self.stdout.write(self.style.SUCCESS(f"Resumo reconstruido: {linhas} linha(s)."))
@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("financeiro", "0004_financeiro_upgrade"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pagamentoaluno",
+            name="recalculado_em",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="pagamentoaluno",
+            name="referencia_calculo",
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,72 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("financeiro", "0005_pagamentoaluno_watermark"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RecalculoJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("PENDENTE", "Pendente"),
+                            ("PROCESSANDO", "Processando"),
+                            ("CONCLUIDO", "Concluido"),
+                            ("ERRO", "Erro"),
+                        ],
+                        default="PENDENTE",
+                        max_length=12,
+                    ),
+                ),
+                ("parametros", models.JSONField(blank=True, default=dict)),
+                ("chave", models.CharField(max_length=64)),
+                ("total", models.PositiveIntegerField(default=0)),
+                ("processados", models.PositiveIntegerField(default=0)),
+                ("atualizados", models.PositiveIntegerField(default=0)),
+                ("historicos", models.PositiveIntegerField(default=0)),
+                ("ultimo_pk", models.BigIntegerField(blank=True, null=True)),
+                ("erros", models.JSONField(blank=True, default=list)),
+                ("iniciado_em", models.DateTimeField(blank=True, null=True)),
+                ("finalizado_em", models.DateTimeField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "solicitado_por",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="recalculos_financeiro",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-created_at"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        condition=models.Q(("status__in", ["PENDENTE", "PROCESSANDO"])),
+                        fields=("chave",),
+                        name="financeiro_recalculojob_ativo_unico",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+import apps.financeiro.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("financeiro", "0006_recalculojob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HistoricoArquivo",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("mes", models.DateField(unique=True)),
+                (
+                    "arquivo",
+                    models.FileField(upload_to=apps.financeiro.models.historico_arquivo_path),
+                ),
+                ("total", models.PositiveIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "ordering": ["-mes"],
+            },
+        ),
+    ]
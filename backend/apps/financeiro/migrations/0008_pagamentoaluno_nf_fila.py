@@ -0,0 +1,70 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def marcar_nf_emitidas(apps, schema_editor):
+    PagamentoAluno = apps.get_model("financeiro", "PagamentoAluno")
+    PagamentoAluno.objects.exclude(nf_pdf__isnull=True).exclude(nf_pdf="").update(
+        nf_status="EMITIDA"
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("alunos", "0003_merge_20260106_2204"),
+        ("financeiro", "0007_historicoarquivo"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pagamentoaluno",
+            name="nf_erro",
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name="pagamentoaluno",
+            name="nf_proxima_tentativa",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="pagamentoaluno",
+            name="nf_solicitada_por",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="notas_fiscais_solicitadas",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddField(
+            model_name="pagamentoaluno",
+            name="nf_status",
+            field=models.CharField(
+                choices=[
+                    ("NAO_SOLICITADA", "Nao solicitada"),
+                    ("PENDENTE", "Pendente"),
+                    ("PROCESSANDO", "Processando"),
+                    ("EMITIDA", "Emitida"),
+                    ("ERRO", "Erro"),
+                ],
+                default="NAO_SOLICITADA",
+                max_length=14,
+            ),
+        ),
+        migrations.AddField(
+            model_name="pagamentoaluno",
+            name="nf_tentativas",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="pagamentoaluno",
+            index=models.Index(
+                fields=["nf_status", "nf_proxima_tentativa"],
+                name="financeiro_pag_nf_fila_idx",
+            ),
+        ),
+        migrations.RunPython(marcar_nf_emitidas, migrations.RunPython.noop),
+    ]
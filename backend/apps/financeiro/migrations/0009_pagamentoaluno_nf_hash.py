@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("financeiro", "0008_pagamentoaluno_nf_fila"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pagamentoaluno",
+            name="nf_hash",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
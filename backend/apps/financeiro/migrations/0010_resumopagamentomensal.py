@@ -0,0 +1,127 @@
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models.functions import Coalesce, Round, TruncMonth
+
+
+def preencher_resumo(apps, schema_editor):
+    # Mesmo agrupamento de resumo.contribuicoes, com os modelos historicos e sem
+    # tocar no cache (que pode ainda nao existir, com CACHE_BACKEND=db).
+    PagamentoAluno = apps.get_model("financeiro", "PagamentoAluno")
+    ResumoPagamentoMensal = apps.get_model("financeiro", "ResumoPagamentoMensal")
+    decimal_field = models.DecimalField(max_digits=14, decimal_places=2)
+    zero = models.Value(Decimal("0.00"), output_field=decimal_field)
+    valor_total = models.ExpressionWrapper(
+        Coalesce(models.F("valor"), zero)
+        - Coalesce(models.F("desconto"), zero)
+        + Coalesce(models.F("multa"), zero)
+        + Coalesce(models.F("juros"), zero),
+        output_field=decimal_field,
+    )
+    valor_recebido = Coalesce(models.F("valor_pago"), valor_total, output_field=decimal_field)
+    linhas = (
+        PagamentoAluno.objects.order_by()
+        .annotate(
+            resumo_competencia=TruncMonth("competencia"),
+            resumo_vencimento=TruncMonth("data_vencimento"),
+            resumo_turma=Coalesce(models.F("aluno__turma_id"), models.Value(0)),
+            resumo_plano=Coalesce(
+                models.F("plano_id"), models.F("aluno__plano_financeiro_id"), models.Value(0)
+            ),
+        )
+        .values(
+            "resumo_competencia",
+            "resumo_vencimento",
+            "resumo_turma",
+            "resumo_plano",
+            "status",
+        )
+        .annotate(
+            quantidade=models.Count("id"),
+            valor_total=models.Sum(Round(valor_total, 2)),
+            valor_recebido=models.Sum(Round(valor_recebido, 2)),
+        )
+    )
+    ResumoPagamentoMensal.objects.bulk_create(
+        [
+            ResumoPagamentoMensal(
+                competencia=linha["resumo_competencia"],
+                vencimento=linha["resumo_vencimento"],
+                turma_id=linha["resumo_turma"],
+                plano_id=linha["resumo_plano"],
+                status=linha["status"],
+                quantidade=linha["quantidade"],
+                valor_total=Decimal(linha["valor_total"] or 0).quantize(Decimal("0.01")),
+                valor_recebido=Decimal(linha["valor_recebido"] or 0).quantize(Decimal("0.01")),
+            )
+            for linha in linhas
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("financeiro", "0009_pagamentoaluno_nf_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ResumoPagamentoMensal",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("competencia", models.DateField()),
+                ("vencimento", models.DateField()),
+                ("turma_id", models.BigIntegerField(default=0)),
+                ("plano_id", models.BigIntegerField(default=0)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("PAGO", "Pago"),
+                            ("EM_ABERTO", "Em aberto"),
+                            ("ATRASADO", "Atrasado"),
+                            ("ISENTO", "Isento"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("quantidade", models.IntegerField(default=0)),
+                (
+                    "valor_total",
+                    models.DecimalField(
+                        decimal_places=2, default=Decimal("0.00"), max_digits=14
+                    ),
+                ),
+                (
+                    "valor_recebido",
+                    models.DecimalField(
+                        decimal_places=2, default=Decimal("0.00"), max_digits=14
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-competencia", "turma_id", "plano_id", "status"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=(
+                            "competencia",
+                            "vencimento",
+                            "turma_id",
+                            "plano_id",
+                            "status",
+                        ),
+                        name="financeiro_resumo_mensal_unico",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(preencher_resumo, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,78 @@
+import gzip
+import json
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def indexar_arquivos(apps, schema_editor):
+    HistoricoArquivo = apps.get_model("financeiro", "HistoricoArquivo")
+    HistoricoArquivoIndice = apps.get_model("financeiro", "HistoricoArquivoIndice")
+    for arquivo in HistoricoArquivo.objects.all():
+        if not arquivo.arquivo.storage.exists(arquivo.arquivo.name):
+            continue
+        with arquivo.arquivo.open("rb") as bruto, gzip.GzipFile(fileobj=bruto) as conteudo:
+            registros = [json.loads(linha) for linha in conteudo]
+        contagem = Counter(
+            (registro["aluno"], registro["pagamento"], registro["acao"], registro["alterado_por"])
+            for registro in registros
+        )
+        HistoricoArquivoIndice.objects.bulk_create(
+            [
+                HistoricoArquivoIndice(
+                    arquivo=arquivo,
+                    aluno_id=aluno_id,
+                    pagamento_id=pagamento_id,
+                    acao=acao,
+                    alterado_por_id=alterado_por_id,
+                    total=total,
+                )
+                for (aluno_id, pagamento_id, acao, alterado_por_id), total in contagem.items()
+            ]
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("financeiro", "0010_resumopagamentomensal"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HistoricoArquivoIndice",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("aluno_id", models.BigIntegerField()),
+                ("pagamento_id", models.BigIntegerField()),
+                ("acao", models.CharField(max_length=12)),
+                ("alterado_por_id", models.BigIntegerField(blank=True, null=True)),
+                ("total", models.PositiveIntegerField(default=0)),
+                (
+                    "arquivo",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="indices",
+                        to="financeiro.historicoarquivo",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["pagamento_id"], name="financeiro_arqidx_pagamento"
+                    ),
+                    models.Index(fields=["aluno_id"], name="financeiro_arqidx_aluno"),
+                ],
+            },
+        ),
+        migrations.RunPython(indexar_arquivos, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,5 @@
 from decimal import Decimal
 
-from django.core.files.base import ContentFile
 from django.db import models, transaction
 from django.utils import timezone
 
@@ -10,6 +9,10 @@ def nota_fiscal_pdf_path(instance, filename):
     return f"notas-fiscais/{numero}/{filename}"
 
 
+def historico_arquivo_path(instance, filename):
+    return f"arquivo/historico-pagamentos/{instance.mes:%Y}/{filename}"
+
+
 class PlanoEducacional(models.Model):
     class ModeloPagamento(models.TextChoices):
         MENSAL = "MENSAL", "Mensal"
@@ -114,6 +117,13 @@ class PagamentoAluno(models.Model):
         ATRASADO = "ATRASADO", "Atrasado"
         ISENTO = "ISENTO", "Isento"
 
+    class NfStatus(models.TextChoices):
+        NAO_SOLICITADA = "NAO_SOLICITADA", "Nao solicitada"
+        PENDENTE = "PENDENTE", "Pendente"
+        PROCESSANDO = "PROCESSANDO", "Processando"
+        EMITIDA = "EMITIDA", "Emitida"
+        ERRO = "ERRO", "Erro"
+
     aluno = models.ForeignKey(
         "alunos.Aluno",
         on_delete=models.PROTECT,
@@ -150,16 +160,56 @@ class PagamentoAluno(models.Model):
     pagamento_registrado_em = models.DateTimeField(null=True, blank=True)
     nf_numero = models.CharField(max_length=30, unique=True, blank=True, null=True)
     nf_pdf = models.FileField(upload_to=nota_fiscal_pdf_path, blank=True, null=True)
+    nf_hash = models.CharField(max_length=64, blank=True)
     nf_emitida_em = models.DateTimeField(null=True, blank=True)
+    nf_status = models.CharField(
+        max_length=14,
+        choices=NfStatus.choices,
+        default=NfStatus.NAO_SOLICITADA,
+    )
+    nf_tentativas = models.PositiveSmallIntegerField(default=0)
+    nf_proxima_tentativa = models.DateTimeField(null=True, blank=True)
+    nf_erro = models.TextField(blank=True)
+    nf_solicitada_por = models.ForeignKey(
+        "auth.User",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="notas_fiscais_solicitadas",
+    )
+    recalculado_em = models.DateTimeField(null=True, blank=True)
+    referencia_calculo = models.DateField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ["-competencia", "aluno__nome_completo"]
+        indexes = [
+            models.Index(
+                fields=["nf_status", "nf_proxima_tentativa"],
+                name="financeiro_pag_nf_fila_idx",
+            )
+        ]
 
     def __str__(self):
         return f"{self.aluno} - {self.competencia:%m/%Y}"
 
+    def save(self, *args, **kwargs):
+        from .resumo import CAMPOS_RESUMO, aplicar_diferenca, contribuicoes, travar
+
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and not CAMPOS_RESUMO.intersection(update_fields):
+            super().save(*args, **kwargs)
+            return
+        # O resumo mensal muda na mesma transacao da gravacao do pagamento.
+        with transaction.atomic():
+            antes = {}
+            if self.pk:
+                travar(PagamentoAluno.objects.filter(pk=self.pk))
+                antes = contribuicoes(PagamentoAluno.objects.filter(pk=self.pk))
+            super().save(*args, **kwargs)
+            aplicar_diferenca(antes, contribuicoes(PagamentoAluno.objects.filter(pk=self.pk)))
+
     @property
     def valor_total(self):
         base = (self.valor or Decimal("0.00")) - (self.desconto or Decimal("0.00"))
@@ -168,6 +218,8 @@ class PagamentoAluno(models.Model):
 
     def aplicar_regras(self, referencia=None):
         referencia = referencia or self.data_pagamento or timezone.localdate()
+        self.referencia_calculo = referencia
+        self.recalculado_em = timezone.now()
         plano = self.plano or getattr(self.aluno, "plano_financeiro", None)
         if plano and not self.plano:
             self.plano = plano
@@ -214,54 +266,87 @@ class PagamentoAluno(models.Model):
             if self.valor_pago is None:
                 self.valor_pago = self.valor_total
 
+    def prefixo_nf(self):
+        return f"NF-{(self.data_pagamento or timezone.localdate()).year}-"
+
     def _gerar_nf_numero(self):
-        ano = (self.data_pagamento or timezone.localdate()).year
-        prefix = f"NF-{ano}-"
-        ultimo = (
-            PagamentoAluno.objects.select_for_update()
-            .filter(nf_numero__startswith=prefix)
-            .order_by("-nf_numero")
-            .first()
+        from apps.contratos.sequencias import proximo_numero
+
+        return proximo_numero(self.prefixo_nf(), PagamentoAluno.objects, "nf_numero")
+
+    def enfileirar_nf(self, user=None):
+        """Marca a NF para o worker processar_notas_fiscais gerar o PDF."""
+        if self.status != self.Status.PAGO:
+            return False
+        if self.nf_pdf or self.nf_status in {self.NfStatus.PENDENTE, self.NfStatus.PROCESSANDO}:
+            return False
+        if not self.pagamento_registrado_em:
+            self.pagamento_registrado_em = timezone.now()
+        self.nf_status = self.NfStatus.PENDENTE
+        self.nf_tentativas = 0
+        self.nf_proxima_tentativa = timezone.now()
+        self.nf_erro = ""
+        self.nf_solicitada_por = user if user and user.is_authenticated else None
+        self.save(
+            update_fields=[
+                "pagamento_registrado_em",
+                "nf_status",
+                "nf_tentativas",
+                "nf_proxima_tentativa",
+                "nf_erro",
+                "nf_solicitada_por",
+                "updated_at",
+            ]
         )
-        ultimo_seq = 0
-        if ultimo and ultimo.nf_numero:
-            try:
-                ultimo_seq = int(ultimo.nf_numero.split("-")[-1])
-            except (ValueError, IndexError):
-                ultimo_seq = 0
-        return f"{prefix}{ultimo_seq + 1:06d}"
+        return True
 
     def emitir_nf(self, user=None):
+        """Gera a NF em tres fases para nao segurar locks durante o render.
+
+        1. transacao curta: registra o pagamento e reserva o numero da NF;
+        2. render e gravacao do PDF sem transacao aberta;
+        3. transacao curta: anexa o arquivo se outra emissao nao chegou antes.
+
+        Um numero reservado cujo PDF nao foi gerado continua no pagamento e e
+        reaproveitado na proxima tentativa (ver notas.recuperar_reservadas).
+        """
         if self.status != self.Status.PAGO:
             return
         if not self.id:
             self.save()
 
+        from apps.contratos.armazenamento import armazenar_pdf, liberar_pdf
+
         from .services import gerar_pdf_nota_fiscal
 
         with transaction.atomic():
-            if not self.pagamento_registrado_em:
-                self.pagamento_registrado_em = timezone.now()
-            if self.nf_pdf:
+            atual = PagamentoAluno.objects.select_for_update().only(
+                "pagamento_registrado_em", "nf_numero", "nf_pdf"
+            ).get(pk=self.pk)
+            self.pagamento_registrado_em = (
+                atual.pagamento_registrado_em or self.pagamento_registrado_em or timezone.now()
+            )
+            if atual.nf_pdf:
+                self.nf_pdf = atual.nf_pdf
                 self.save(update_fields=["pagamento_registrado_em", "updated_at"])
                 return
-            if not self.nf_numero:
-                self.nf_numero = self._gerar_nf_numero()
-
-            pdf_bytes = gerar_pdf_nota_fiscal(self)
-            filename = f"{self.nf_numero}.pdf"
-            self.nf_pdf.save(filename, ContentFile(pdf_bytes), save=False)
-            self.nf_emitida_em = timezone.now()
-
-            self.save(
-                update_fields=[
-                    "nf_numero",
-                    "nf_pdf",
-                    "nf_emitida_em",
-                    "pagamento_registrado_em",
-                    "updated_at",
-                ]
-            )
+            self.nf_numero = atual.nf_numero or self.nf_numero or self._gerar_nf_numero()
+            self.save(update_fields=["nf_numero", "pagamento_registrado_em", "updated_at"])
+
+        self.nf_emitida_em = timezone.now()
+        pdf_bytes = gerar_pdf_nota_fiscal(self)
+        arquivo = armazenar_pdf(pdf_bytes)
+
+        with transaction.atomic():
+            atual = PagamentoAluno.objects.select_for_update().only("nf_pdf").get(pk=self.pk)
+            if atual.nf_pdf:
+                # Outra emissao anexou a NF enquanto este PDF era gerado.
+                liberar_pdf(arquivo.arquivo.name)
+                self.nf_pdf = atual.nf_pdf
+                return
+            self.nf_pdf.name = arquivo.arquivo.name
+            self.nf_hash = arquivo.hash
+            self.save(update_fields=["nf_pdf", "nf_hash", "nf_emitida_em", "updated_at"])
 
 
 class PagamentoAlunoHistorico(models.Model):
@@ -298,6 +383,86 @@ class PagamentoAlunoHistorico(models.Model):
         return f"{self.pagamento_id} - {self.acao}"
 
 
+class HistoricoArquivo(models.Model):
+    mes = models.DateField(unique=True)
+    arquivo = models.FileField(upload_to=historico_arquivo_path)
+    total = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-mes"]
+
+    def __str__(self):
+        return f"Historico arquivado {self.mes:%m/%Y}"
+
+
+class HistoricoArquivoIndice(models.Model):
+    """Quantos historicos de cada pagamento/aluno estao no arquivo de um mes.
+
+    Permite contar e paginar o historico arquivado sem descompactar os arquivos.
+    """
+
+    arquivo = models.ForeignKey(
+        HistoricoArquivo,
+        on_delete=models.CASCADE,
+        related_name="indices",
+    )
+    aluno_id = models.BigIntegerField()
+    pagamento_id = models.BigIntegerField()
+    acao = models.CharField(max_length=12)
+    alterado_por_id = models.BigIntegerField(null=True, blank=True)
+    total = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["pagamento_id"], name="financeiro_arqidx_pagamento"),
+            models.Index(fields=["aluno_id"], name="financeiro_arqidx_aluno"),
+        ]
+
+
+class RecalculoJob(models.Model):
+    class Status(models.TextChoices):
+        PENDENTE = "PENDENTE", "Pendente"
+        PROCESSANDO = "PROCESSANDO", "Processando"
+        CONCLUIDO = "CONCLUIDO", "Concluido"
+        ERRO = "ERRO", "Erro"
+
+    status = models.CharField(max_length=12, choices=Status.choices, default=Status.PENDENTE)
+    parametros = models.JSONField(default=dict, blank=True)
+    chave = models.CharField(max_length=64)
+    total = models.PositiveIntegerField(default=0)
+    processados = models.PositiveIntegerField(default=0)
+    atualizados = models.PositiveIntegerField(default=0)
+    historicos = models.PositiveIntegerField(default=0)
+    ultimo_pk = models.BigIntegerField(null=True, blank=True)
+    erros = models.JSONField(default=list, blank=True)
+    solicitado_por = models.ForeignKey(
+        "auth.User",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="recalculos_financeiro",
+    )
+    iniciado_em = models.DateTimeField(null=True, blank=True)
+    finalizado_em = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["chave"],
+                condition=models.Q(status__in=["PENDENTE", "PROCESSANDO"]),
+                name="financeiro_recalculojob_ativo_unico",
+            )
+        ]
+
+    def __str__(self):
+        return f"Recalculo {self.id} - {self.status}"
+
+
 class PagamentoProfessor(models.Model):
     class Status(models.TextChoices):
         PAGO = "PAGO", "Pago"
@@ -359,3 +524,32 @@ class Despesa(models.Model):
 
     def __str__(self):
         return self.descricao
+
+
+class ResumoPagamentoMensal(models.Model):
+    """Totais de PagamentoAluno por mes de competencia, mes de vencimento, turma,
+    plano e status, mantidos junto com cada gravacao (ver financeiro.resumo).
+
+    turma_id e plano_id guardam 0 quando o pagamento nao tem turma ou plano.
+    """
+
+    competencia = models.DateField()
+    vencimento = models.DateField()
+    turma_id = models.BigIntegerField(default=0)
+    plano_id = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=PagamentoAluno.Status.choices)
+    quantidade = models.IntegerField(default=0)
+    valor_total = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+    valor_recebido = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+
+    class Meta:
+        ordering = ["-competencia", "turma_id", "plano_id", "status"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["competencia", "vencimento", "turma_id", "plano_id", "status"],
+                name="financeiro_resumo_mensal_unico",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.competencia:%m/%Y} - {self.status} ({self.quantidade})"
@@ -0,0 +1,147 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.contratos.sequencias import formatar_numero, reservar_numeros
+
+from .auditoria import registrar_historico
+from .models import PagamentoAluno, PagamentoAlunoHistorico
+
+
+# NF em PROCESSANDO sem atualizacao por mais tempo que isso volta para a fila
+# (worker encerrado no meio da geracao).
+NF_EXPIRACAO = timedelta(minutes=10)
+
+
+def _max_tentativas():
+    return getattr(settings, "FINANCEIRO_NF_MAX_TENTATIVAS", 5)
+
+
+def _espera(tentativas):
+    base = getattr(settings, "FINANCEIRO_NF_BACKOFF_SEGUNDOS", 60)
+    return timedelta(seconds=min(base * (2 ** max(tentativas - 1, 0)), 3600))
+
+
+def reservar_notas(limite=10):
+    agora = timezone.now()
+    fila = PagamentoAluno.objects.filter(
+        Q(
+            nf_status=PagamentoAluno.NfStatus.PENDENTE,
+            nf_proxima_tentativa__lte=agora,
+        )
+        | Q(
+            nf_status=PagamentoAluno.NfStatus.PROCESSANDO,
+            updated_at__lt=agora - NF_EXPIRACAO,
+        )
+    )
+    with transaction.atomic():
+        pks = list(
+            fila.select_for_update(skip_locked=True)
+            .order_by("nf_proxima_tentativa", "pk")
+            .values_list("pk", flat=True)[:limite]
+        )
+        PagamentoAluno.objects.filter(pk__in=pks).update(
+            nf_status=PagamentoAluno.NfStatus.PROCESSANDO,
+            updated_at=agora,
+        )
+    return list(
+        PagamentoAluno.objects.select_related("aluno", "aluno__turma", "plano", "nf_solicitada_por")
+        .filter(pk__in=pks)
+        .order_by("pk")
+    )
+
+
+def numerar_notas(pagamentos):
+    """Reserva de uma vez os numeros de NF do lote, um bloco por ano."""
+    por_prefixo = defaultdict(list)
+    for pagamento in pagamentos:
+        if not pagamento.nf_numero:
+            por_prefixo[pagamento.prefixo_nf()].append(pagamento)
+    for prefixo, grupo in por_prefixo.items():
+        with transaction.atomic():
+            numeros = reservar_numeros(prefixo, len(grupo), PagamentoAluno.objects, "nf_numero")
+            for pagamento, valor in zip(grupo, numeros):
+                pagamento.nf_numero = formatar_numero(prefixo, valor)
+                PagamentoAluno.objects.filter(pk=pagamento.pk).update(nf_numero=pagamento.nf_numero)
+
+
+def processar_nota(pagamento):
+    """Gera a NF de um pagamento reservado. Retorna True se emitida."""
+    tinha_nf = bool(pagamento.nf_pdf)
+    try:
+        pagamento.emitir_nf(user=pagamento.nf_solicitada_por)
+        if not pagamento.nf_pdf:
+            raise RuntimeError("Pagamento nao esta PAGO; NF nao gerada.")
+    except Exception as exc:
+        pagamento.nf_tentativas += 1
+        pagamento.nf_erro = str(exc)
+        if pagamento.nf_tentativas >= _max_tentativas():
+            pagamento.nf_status = PagamentoAluno.NfStatus.ERRO
+            pagamento.nf_proxima_tentativa = None
+        else:
+            pagamento.nf_status = PagamentoAluno.NfStatus.PENDENTE
+            pagamento.nf_proxima_tentativa = timezone.now() + _espera(pagamento.nf_tentativas)
+        pagamento.save(
+            update_fields=[
+                "nf_tentativas",
+                "nf_erro",
+                "nf_status",
+                "nf_proxima_tentativa",
+                "updated_at",
+            ]
+        )
+        return False
+
+    pagamento.nf_status = PagamentoAluno.NfStatus.EMITIDA
+    pagamento.nf_proxima_tentativa = None
+    pagamento.nf_erro = ""
+    pagamento.save(update_fields=["nf_status", "nf_proxima_tentativa", "nf_erro", "updated_at"])
+    if not tinha_nf:
+        registrar_historico(
+            pagamento,
+            PagamentoAlunoHistorico.Acao.NF,
+            status_novo=pagamento.status,
+            detalhes={"nf_numero": pagamento.nf_numero},
+            user=pagamento.nf_solicitada_por,
+        )
+    return True
+
+
+def recuperar_reservadas():
+    """Volta para a fila NFs com numero reservado e sem PDF fora da fila.
+
+    Acontece quando emitir_nf foi chamado direto e o render falhou depois da
+    reserva do numero. Retorna quantas foram reenfileiradas.
+    """
+    return (
+        PagamentoAluno.objects.filter(
+            status=PagamentoAluno.Status.PAGO,
+            nf_status=PagamentoAluno.NfStatus.NAO_SOLICITADA,
+            nf_numero__isnull=False,
+        )
+        .filter(Q(nf_pdf__isnull=True) | Q(nf_pdf=""))
+        .update(
+            nf_status=PagamentoAluno.NfStatus.PENDENTE,
+            nf_proxima_tentativa=timezone.now(),
+            updated_at=timezone.now(),
+        )
+    )
+
+
+def processar_fila(limite=10):
+    """Processa um lote da fila. Retorna ``(emitidas, falhas)``."""
+    emitidas = 0
+    falhas = 0
+    recuperar_reservadas()
+    pagamentos = reservar_notas(limite)
+    numerar_notas(pagamentos)
+    for pagamento in pagamentos:
+        if processar_nota(pagamento):
+            emitidas += 1
+        else:
+            falhas += 1
+    return emitidas, falhas
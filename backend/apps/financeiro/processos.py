@@ -0,0 +1,8 @@
+# Sem imports de models aqui: este modulo e carregado por processos filhos
+# (multiprocessing "spawn") antes do registro de apps estar pronto.
+
+
+def iniciar_worker():
+    import django
+
+    django.setup()
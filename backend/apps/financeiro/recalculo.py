@@ -0,0 +1,264 @@
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import connections, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from apps.api.cache import invalidar
+
+from .auditoria import historico_em_lote, registrar_historico
+from .avaliacao import arredondar_monetarios, avaliar_lote
+from .models import PagamentoAluno, PagamentoAlunoHistorico
+from .processos import iniciar_worker
+from .resumo import acompanhar_resumo
+
+
+SNAPSHOT_FIELDS = [
+    "status",
+    "forma_pagamento",
+    "data_pagamento",
+    "data_vencimento",
+    "valor",
+    "valor_pago",
+    "desconto",
+    "multa",
+    "juros",
+    "dias_atraso",
+    "plano_id",
+]
+
+RECALCULO_FIELDS = [
+    "plano",
+    "status",
+    "data_pagamento",
+    "valor_pago",
+    "desconto",
+    "multa",
+    "juros",
+    "dias_atraso",
+    "recalculado_em",
+    "referencia_calculo",
+    "updated_at",
+]
+
+CHUNK_SIZE = 500
+
+
+def snapshot_pagamento(instance):
+    return {field: getattr(instance, field) for field in SNAPSHOT_FIELDS}
+
+
+def diff_pagamento(before, instance):
+    changes = {}
+    for field, old_value in before.items():
+        new_value = getattr(instance, field)
+        if old_value != new_value:
+            changes[field] = {
+                "de": str(old_value) if old_value is not None else None,
+                "para": str(new_value) if new_value is not None else None,
+            }
+    return changes
+
+
+def filtrar_incremental(queryset, referencia=None):
+    referencia = referencia or timezone.localdate()
+    nunca_calculado = Q(recalculado_em__isnull=True) | Q(referencia_calculo__isnull=True)
+    editado = Q(updated_at__gt=F("recalculado_em"))
+    plano_editado = Q(plano__updated_at__gt=F("recalculado_em")) | Q(
+        plano__isnull=True,
+        aluno__plano_financeiro__updated_at__gt=F("recalculado_em"),
+    )
+    cruzou_vencimento = Q(
+        data_vencimento__gte=F("referencia_calculo"),
+        data_vencimento__lt=referencia,
+    ) | Q(referencia_calculo__gt=referencia)
+    # dias_atraso (e o juros diario, quando o plano tem) muda a cada dia para todo
+    # pagamento vencido, com ou sem plano.
+    vencido = Q(data_vencimento__lt=referencia, referencia_calculo__lt=referencia) & ~Q(
+        status=PagamentoAluno.Status.ISENTO
+    )
+    return queryset.filter(
+        nunca_calculado | editado | plano_editado | cruzou_vencimento | vencido
+    )
+
+
+def iterar_lotes(queryset, chunk_size=CHUNK_SIZE, ultimo_pk=None):
+    queryset = queryset.select_related("plano", "aluno__plano_financeiro").order_by("pk")
+    while True:
+        lote_qs = queryset if ultimo_pk is None else queryset.filter(pk__gt=ultimo_pk)
+        lote = list(lote_qs[:chunk_size])
+        if not lote:
+            return
+        yield lote
+        ultimo_pk = lote[-1].pk
+
+
+def recalcular_lote(lote, referencia=None, user=None, vetorizado=False):
+    alterados = []
+    inalterados = defaultdict(list)
+    historicos = []
+    agora = timezone.now()
+    snapshots = [snapshot_pagamento(pagamento) for pagamento in lote]
+    if vetorizado:
+        avaliar_lote(lote, referencia=referencia)
+    else:
+        for pagamento in lote:
+            pagamento.aplicar_regras(referencia)
+            arredondar_monetarios(pagamento)
+    for pagamento, before in zip(lote, snapshots):
+        pagamento.recalculado_em = agora
+        changes = diff_pagamento(before, pagamento)
+        if not changes:
+            inalterados[pagamento.referencia_calculo].append(pagamento.pk)
+            continue
+        pagamento.updated_at = agora
+        alterados.append(pagamento)
+        historicos.append((pagamento, before, changes))
+
+    with transaction.atomic(), historico_em_lote():
+        for referencia_calculo, pks in inalterados.items():
+            PagamentoAluno.objects.filter(pk__in=pks).update(
+                recalculado_em=agora,
+                referencia_calculo=referencia_calculo,
+            )
+        if alterados:
+            with acompanhar_resumo(
+                PagamentoAluno.objects.filter(pk__in=[pagamento.pk for pagamento in alterados])
+            ):
+                PagamentoAluno.objects.bulk_update(alterados, RECALCULO_FIELDS)
+            # bulk_update nao dispara post_save.
+            invalidar("pagamentos")
+        for pagamento, before, changes in historicos:
+            registrar_historico(
+                pagamento,
+                (
+                    PagamentoAlunoHistorico.Acao.STATUS
+                    if "status" in changes
+                    else PagamentoAlunoHistorico.Acao.ATUALIZADO
+                ),
+                status_anterior=before.get("status"),
+                status_novo=pagamento.status,
+                detalhes=changes,
+                user=user,
+            )
+    return len(alterados), len(historicos)
+
+
+def recalcular_pagamentos(
+    queryset,
+    referencia=None,
+    user=None,
+    chunk_size=CHUNK_SIZE,
+    incremental=False,
+    vetorizado=False,
+):
+    if incremental:
+        queryset = filtrar_incremental(queryset, referencia=referencia)
+    updated = 0
+    historico = 0
+    for lote in iterar_lotes(queryset, chunk_size=chunk_size):
+        lote_updated, lote_historico = recalcular_lote(
+            lote,
+            referencia=referencia,
+            user=user,
+            vetorizado=vetorizado,
+        )
+        updated += lote_updated
+        historico += lote_historico
+    return {"updated": updated, "historico": historico}
+
+
+def particionar_por_aluno(queryset, partes):
+    """Divide o queryset em faixas disjuntas de aluno_id com volume parecido."""
+    contagens = list(
+        queryset.order_by()
+        .values("aluno_id")
+        .annotate(total=Count("id"))
+        .order_by("aluno_id")
+        .values_list("aluno_id", "total")
+    )
+    if not contagens:
+        return []
+    partes = max(min(partes, len(contagens)), 1)
+    alvo = sum(total for _, total in contagens) / partes
+    faixas = []
+    inicio = contagens[0][0]
+    acumulado = 0
+    for indice, (aluno_id, total) in enumerate(contagens):
+        acumulado += total
+        restantes = len(contagens) - indice - 1
+        if (
+            len(faixas) < partes - 1
+            and restantes
+            and acumulado >= alvo * (len(faixas) + 1)
+        ):
+            faixas.append((inicio, aluno_id))
+            inicio = contagens[indice + 1][0]
+    faixas.append((inicio, contagens[-1][0]))
+    return faixas
+
+
+def _recalcular_faixa(query, inicio, fim, referencia, chunk_size, vetorizado):
+    queryset = PagamentoAluno.objects.all()
+    queryset.query = query
+    try:
+        return recalcular_pagamentos(
+            queryset.filter(aluno_id__gte=inicio, aluno_id__lte=fim),
+            referencia=referencia,
+            chunk_size=chunk_size,
+            vetorizado=vetorizado,
+        )
+    finally:
+        connections.close_all()
+
+
+def recalcular_pagamentos_paralelo(
+    queryset,
+    workers,
+    referencia=None,
+    chunk_size=CHUNK_SIZE,
+    incremental=False,
+    vetorizado=False,
+):
+    """Recalcula em varios processos, um por faixa de aluno_id.
+
+    Cada processo abre a propria conexao e grava seus lotes em transacoes
+    proprias; os contadores de cada faixa sao somados no final.
+    """
+    if incremental:
+        queryset = filtrar_incremental(queryset, referencia=referencia)
+    faixas = particionar_por_aluno(queryset, workers)
+    if len(faixas) <= 1:
+        return recalcular_pagamentos(
+            queryset,
+            referencia=referencia,
+            chunk_size=chunk_size,
+            vetorizado=vetorizado,
+        )
+
+    updated = 0
+    historico = 0
+    with ProcessPoolExecutor(
+        max_workers=len(faixas),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=iniciar_worker,
+    ) as executor:
+        futures = [
+            executor.submit(
+                _recalcular_faixa,
+                queryset.query,
+                inicio,
+                fim,
+                referencia,
+                chunk_size,
+                vetorizado,
+            )
+            for inicio, fim in faixas
+        ]
+        for future in futures:
+            resultado = future.result()
+            updated += resultado["updated"]
+            historico += resultado["historico"]
+    return {"updated": updated, "historico": historico, "workers": len(faixas)}
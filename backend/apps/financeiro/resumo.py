@@ -0,0 +1,227 @@
+"""Resumo mensal de PagamentoAluno mantido a cada gravacao.
+
+Cada linha de ResumoPagamentoMensal soma os pagamentos de uma chave
+(competencia, vencimento, turma, plano, status). As gravacoes calculam a
+contribuicao dos pagamentos afetados antes e depois da alteracao e aplicam a
+diferenca com UPDATE ... SET campo = campo + delta na mesma transacao, o que
+mantem o resumo correto com gravacoes concorrentes.
+"""
+
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, Round, TruncMonth
+
+from apps.api.cache import invalidar
+
+from .models import PagamentoAluno, ResumoPagamentoMensal
+
+
+# Campos de PagamentoAluno que mudam a chave ou os valores do resumo.
+CAMPOS_RESUMO = frozenset(
+    {
+        "aluno",
+        "aluno_id",
+        "plano",
+        "plano_id",
+        "competencia",
+        "data_vencimento",
+        "status",
+        "valor",
+        "valor_pago",
+        "desconto",
+        "multa",
+        "juros",
+    }
+)
+
+CHAVE = ("competencia", "vencimento", "turma_id", "plano_id", "status")
+
+CENTAVOS = Decimal("0.01")
+ZERO = Decimal("0.00")
+
+LOTE = 1000
+
+
+def _expressoes():
+    # Mesmo calculo de api.utils.financeiro_expressions com os encargos gravados.
+    decimal_field = DecimalField(max_digits=14, decimal_places=2)
+    zero = Value(ZERO, output_field=decimal_field)
+    valor_total = ExpressionWrapper(
+        Coalesce(F("valor"), zero)
+        - Coalesce(F("desconto"), zero)
+        + Coalesce(F("multa"), zero)
+        + Coalesce(F("juros"), zero),
+        output_field=decimal_field,
+    )
+    valor_recebido = Coalesce(F("valor_pago"), valor_total, output_field=decimal_field)
+    # Arredonda cada pagamento para a soma nao depender do agrupamento (o SQLite
+    # guarda encargos com mais casas do que a coluna declara).
+    return Round(valor_total, 2), Round(valor_recebido, 2)
+
+
+def contribuicoes(queryset):
+    """Totais do queryset agrupados pela chave do resumo.
+
+    Retorna ``{(competencia, vencimento, turma_id, plano_id, status):
+    [quantidade, valor_total, valor_recebido]}``.
+    """
+    valor_total, valor_recebido = _expressoes()
+    linhas = (
+        queryset.order_by()
+        .annotate(
+            resumo_competencia=TruncMonth("competencia"),
+            resumo_vencimento=TruncMonth("data_vencimento"),
+            resumo_turma=Coalesce(F("aluno__turma_id"), Value(0)),
+            resumo_plano=Coalesce(F("plano_id"), F("aluno__plano_financeiro_id"), Value(0)),
+        )
+        .values(
+            "resumo_competencia",
+            "resumo_vencimento",
+            "resumo_turma",
+            "resumo_plano",
+            "status",
+        )
+        .annotate(
+            quantidade=Count("id"),
+            valor_total=Sum(valor_total),
+            valor_recebido=Sum(valor_recebido),
+        )
+    )
+    resultado = {}
+    for linha in linhas:
+        chave = (
+            linha["resumo_competencia"],
+            linha["resumo_vencimento"],
+            linha["resumo_turma"],
+            linha["resumo_plano"],
+            linha["status"],
+        )
+        resultado[chave] = [
+            linha["quantidade"],
+            Decimal(linha["valor_total"] or ZERO).quantize(CENTAVOS),
+            Decimal(linha["valor_recebido"] or ZERO).quantize(CENTAVOS),
+        ]
+    return resultado
+
+
+def travar(queryset):
+    """Trava as linhas de PagamentoAluno do queryset ate o fim da transacao.
+
+    Sem a trava dois gravadores do mesmo pagamento leem o mesmo "antes" e a
+    diferenca entra duas vezes no resumo. A contagem agrupada de
+    ``contribuicoes`` nao aceita FOR UPDATE, por isso a trava e uma consulta a parte.
+    """
+    list(queryset.select_for_update(of=("self",)).order_by("pk").values_list("pk", flat=True))
+
+
+def _somar(chave, quantidade, valor_total, valor_recebido):
+    filtro = dict(zip(CHAVE, chave))
+    incremento = {
+        "quantidade": F("quantidade") + quantidade,
+        "valor_total": F("valor_total") + valor_total,
+        "valor_recebido": F("valor_recebido") + valor_recebido,
+    }
+    if ResumoPagamentoMensal.objects.filter(**filtro).update(**incremento):
+        return
+    try:
+        with transaction.atomic():
+            ResumoPagamentoMensal.objects.create(
+                **filtro,
+                quantidade=quantidade,
+                valor_total=valor_total,
+                valor_recebido=valor_recebido,
+            )
+    except IntegrityError:
+        # Outra transacao criou a linha ao mesmo tempo.
+        ResumoPagamentoMensal.objects.filter(**filtro).update(**incremento)
+
+
+def aplicar_diferenca(antes, depois):
+    """Soma ao resumo ``depois - antes`` (resultados de ``contribuicoes``)."""
+    deltas = defaultdict(lambda: [0, ZERO, ZERO])
+    for sinal, totais in ((-1, antes), (1, depois)):
+        for chave, valores in totais.items():
+            delta = deltas[chave]
+            for indice, valor in enumerate(valores):
+                delta[indice] += sinal * valor
+    # Ordem fixa das chaves para transacoes concorrentes travarem as linhas na
+    # mesma sequencia.
+    with transaction.atomic():
+        for chave in sorted(deltas, key=lambda item: tuple(str(parte) for parte in item)):
+            quantidade, valor_total, valor_recebido = deltas[chave]
+            if quantidade or valor_total or valor_recebido:
+                _somar(chave, quantidade, valor_total, valor_recebido)
+
+
+@contextmanager
+def acompanhar_resumo(queryset):
+    """Mantem o resumo dos pagamentos de ``queryset`` alterados dentro do bloco.
+
+    Tudo roda em uma transacao: a contribuicao e lida antes e depois do bloco e
+    so a diferenca e gravada.
+    """
+    with transaction.atomic():
+        travar(queryset)
+        antes = contribuicoes(queryset)
+        yield
+        aplicar_diferenca(antes, contribuicoes(queryset))
+
+
+def antes_de_excluir(sender, instance, **kwargs):
+    # Roda dentro da transacao do delete.
+    pagamento = PagamentoAluno.objects.filter(pk=instance.pk)
+    travar(pagamento)
+    instance._resumo_contribuicao = contribuicoes(pagamento)
+
+
+def depois_de_excluir(sender, instance, **kwargs):
+    # Os sinais de exclusao rodam na transacao do delete, inclusive em
+    # QuerySet.delete() e na acao de excluir em massa do admin.
+    aplicar_diferenca(getattr(instance, "_resumo_contribuicao", {}), {})
+
+
+def antes_de_excluir_plano(sender, instance, **kwargs):
+    # O SET_NULL de PagamentoAluno.plano e Aluno.plano_financeiro e um UPDATE
+    # direto, sem sinais: os pagamentos que caem na chave do plano sao lidos
+    # aqui e de novo depois da exclusao.
+    afetados = PagamentoAluno.objects.filter(
+        Q(plano_id=instance.pk) | Q(plano__isnull=True, aluno__plano_financeiro_id=instance.pk)
+    )
+    travar(afetados)
+    instance._resumo_pagamentos = list(afetados.values_list("pk", flat=True))
+    instance._resumo_contribuicao = contribuicoes(
+        PagamentoAluno.objects.filter(pk__in=instance._resumo_pagamentos)
+    )
+
+
+def depois_de_excluir_plano(sender, instance, **kwargs):
+    pagamentos = PagamentoAluno.objects.filter(pk__in=getattr(instance, "_resumo_pagamentos", []))
+    aplicar_diferenca(getattr(instance, "_resumo_contribuicao", {}), contribuicoes(pagamentos))
+
+
+def reconstruir_resumo():
+    """Recalcula o resumo inteiro a partir de PagamentoAluno.
+
+    Retorna quantas linhas foram gravadas.
+    """
+    with transaction.atomic():
+        totais = contribuicoes(PagamentoAluno.objects.all())
+        ResumoPagamentoMensal.objects.all().delete()
+        ResumoPagamentoMensal.objects.bulk_create(
+            [
+                ResumoPagamentoMensal(
+                    **dict(zip(CHAVE, chave)),
+                    quantidade=quantidade,
+                    valor_total=valor_total,
+                    valor_recebido=valor_recebido,
+                )
+                for chave, (quantidade, valor_total, valor_recebido) in totais.items()
+            ],
+            batch_size=LOTE,
+        )
+        invalidar("pagamentos")
+    return len(totais)
@@ -0,0 +1,506 @@
+import shutil
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from apps.alunos.models import Aluno
+from apps.professores.models import Professor
+from apps.turmas.models import Turma
+
+from . import jobs, notas, services
+from .auditoria import historico_em_lote
+from .models import (
+    PagamentoAluno,
+    PagamentoAlunoHistorico,
+    PlanoEducacional,
+    RecalculoJob,
+)
+from .recalculo import filtrar_incremental, recalcular_pagamentos
+
+
+REFERENCIA = date(2026, 3, 20)
+
+CAMPOS_ESTADO = (
+    "pk",
+    "status",
+    "desconto",
+    "multa",
+    "juros",
+    "valor_pago",
+    "dias_atraso",
+    "data_pagamento",
+    "plano_id",
+)
+
+
+class MidiaTemporariaMixin:
+    """MEDIA_ROOT em um diretorio temporario apagado ao fim da classe."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls._media = tempfile.mkdtemp()
+        cls._media_override = override_settings(MEDIA_ROOT=cls._media)
+        cls._media_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._media_override.disable()
+        shutil.rmtree(cls._media, ignore_errors=True)
+
+
+def criar_turma():
+    professor = Professor.objects.create(
+        nome_completo="Professor Teste",
+        especialidade="Matematica",
+        telefone="11999999999",
+        email="professor@example.com",
+        tipo_vinculo=Professor.TipoVinculo.CLT,
+    )
+    return Turma.objects.create(
+        nome="Turma Teste",
+        serie_ano="1o ano",
+        turno=Turma.Turno.MANHA,
+        professor_responsavel=professor,
+        valor_mensalidade=Decimal("100.00"),
+        capacidade_maxima=30,
+    )
+
+
+def criar_aluno(turma, plano, indice):
+    return Aluno.objects.create(
+        nome_completo=f"Aluno {indice}",
+        data_nascimento=date(2012, 1, 1),
+        sexo=Aluno.Sexo.FEMININO,
+        endereco="Rua Teste",
+        telefone="11999999999",
+        data_matricula=date(2026, 1, 1),
+        turma=turma,
+        plano_financeiro=plano,
+        valor_mensalidade=Decimal("100.00"),
+    )
+
+
+class RecalculoVetorizadoTests(TestCase):
+    """O calculo vetorizado deve gravar o mesmo que aplicar_regras."""
+
+    @classmethod
+    def setUpTestData(cls):
+        turma = criar_turma()
+        planos = [
+            None,
+            # 5% de 0.10 = 0.005 e 2% de 0.25 = 0.005: meio centavo exato.
+            PlanoEducacional(desconto_percent=Decimal("5.00"), multa_percent=Decimal("2.00")),
+            # 0.033% ao dia gera juros com muitas casas (0.003885 ...).
+            PlanoEducacional(
+                desconto_percent=Decimal("3.33"),
+                juros_percent=Decimal("1.00"),
+                juros_diario_percent=Decimal("0.03"),
+            ),
+            PlanoEducacional(
+                bolsa_tipo=PlanoEducacional.BolsaTipo.PARCIAL,
+                bolsa_percent=Decimal("12.50"),
+                multa_percent=Decimal("2.00"),
+                juros_diario_percent=Decimal("0.05"),
+            ),
+            PlanoEducacional(bolsa_tipo=PlanoEducacional.BolsaTipo.INTEGRAL),
+        ]
+        valores = ["0.01", "0.10", "0.25", "0.30", "1.00", "1.01", "10.05", "33.33", "99.99"]
+        vencimentos = [REFERENCIA + timedelta(days=5), REFERENCIA, REFERENCIA - timedelta(days=7)]
+        status = [
+            PagamentoAluno.Status.EM_ABERTO,
+            PagamentoAluno.Status.ATRASADO,
+            PagamentoAluno.Status.ISENTO,
+            PagamentoAluno.Status.PAGO,
+        ]
+        indice = 0
+        for plano in planos:
+            if plano is not None:
+                plano.nome = "Plano"
+                plano.valor_mensalidade = Decimal("100.00")
+                plano.dia_vencimento = 10
+                plano.duracao_meses = 12
+                plano.save()
+            aluno = criar_aluno(turma, plano, indice)
+            for valor in valores:
+                for vencimento in vencimentos:
+                    for situacao in status:
+                        indice += 1
+                        PagamentoAluno.objects.create(
+                            aluno=aluno,
+                            competencia=vencimento.replace(day=1),
+                            valor=Decimal(valor),
+                            data_vencimento=vencimento,
+                            forma_pagamento=PagamentoAluno.FormaPagamento.PIX,
+                            status=situacao,
+                        )
+
+    def _recalcular(self, vetorizado):
+        """Estado final e historicos do recalculo, desfeitos ao terminar."""
+        with transaction.atomic():
+            with historico_em_lote() as buffer:
+                resultado = recalcular_pagamentos(
+                    PagamentoAluno.objects.all(),
+                    referencia=REFERENCIA,
+                    vetorizado=vetorizado,
+                )
+                historicos = sorted(
+                    (
+                        entrada.pagamento_id,
+                        entrada.acao,
+                        entrada.status_anterior,
+                        entrada.status_novo,
+                        entrada.valor_devido,
+                        entrada.valor_pago,
+                        tuple(
+                            (campo, mudanca["de"], mudanca["para"])
+                            for campo, mudanca in sorted(entrada.detalhes.items())
+                        ),
+                    )
+                    for entrada in buffer.entradas
+                )
+            estado = list(PagamentoAluno.objects.order_by("pk").values_list(*CAMPOS_ESTADO))
+            transaction.set_rollback(True)
+        return resultado, estado, historicos
+
+    def test_mesmas_alteracoes_e_historico(self):
+        escalar = self._recalcular(vetorizado=False)
+        vetorizado = self._recalcular(vetorizado=True)
+
+        self.assertEqual(escalar[0], vetorizado[0])
+        self.assertEqual(escalar[1], vetorizado[1])
+        self.assertEqual(escalar[2], vetorizado[2])
+        self.assertTrue(escalar[2])
+
+    def test_historico_sem_casas_extras(self):
+        _, _, historicos = self._recalcular(vetorizado=False)
+        for *_, detalhes in historicos:
+            for campo, _, para in detalhes:
+                if campo in {"desconto", "multa", "juros", "valor_pago"} and para:
+                    self.assertEqual(Decimal(para), Decimal(para).quantize(Decimal("0.01")))
+
+    def test_meio_centavo_arredonda_para_cima(self):
+        for vetorizado in (False, True):
+            with self.subTest(vetorizado=vetorizado):
+                _, estado, _ = self._recalcular(vetorizado)
+                valores = {linha[0]: dict(zip(CAMPOS_ESTADO, linha)) for linha in estado}
+                pagamento = PagamentoAluno.objects.get(
+                    aluno__plano_financeiro__desconto_percent=Decimal("5.00"),
+                    valor=Decimal("0.10"),
+                    data_vencimento=REFERENCIA,
+                    status=PagamentoAluno.Status.EM_ABERTO,
+                )
+                self.assertEqual(valores[pagamento.pk]["desconto"], Decimal("0.01"))
+
+
+class RecalculoIncrementalTests(TestCase):
+    """Rodadas incrementais diarias gravam o mesmo que o recalculo completo."""
+
+    CAMPOS = ("status", "desconto", "multa", "juros", "valor_pago", "dias_atraso", "plano_id")
+
+    @classmethod
+    def setUpTestData(cls):
+        turma = criar_turma()
+        planos = [
+            None,
+            PlanoEducacional.objects.create(
+                nome="Sem juros diario",
+                valor_mensalidade=Decimal("100.00"),
+                dia_vencimento=10,
+                duracao_meses=12,
+                multa_percent=Decimal("2.00"),
+                juros_percent=Decimal("1.00"),
+            ),
+            PlanoEducacional.objects.create(
+                nome="Com juros diario",
+                valor_mensalidade=Decimal("100.00"),
+                dia_vencimento=10,
+                duracao_meses=12,
+                multa_percent=Decimal("2.00"),
+                juros_diario_percent=Decimal("0.03"),
+            ),
+        ]
+        status = [
+            PagamentoAluno.Status.EM_ABERTO,
+            PagamentoAluno.Status.ATRASADO,
+            PagamentoAluno.Status.PAGO,
+            PagamentoAluno.Status.ISENTO,
+        ]
+        for indice, plano in enumerate(planos):
+            aluno = criar_aluno(turma, plano, indice)
+            for dias in (-40, -10, -1, 0, 1, 12, 30):
+                vencimento = REFERENCIA + timedelta(days=dias)
+                for situacao in status:
+                    PagamentoAluno.objects.create(
+                        aluno=aluno,
+                        competencia=vencimento.replace(day=1),
+                        valor=Decimal("100.00"),
+                        data_vencimento=vencimento,
+                        forma_pagamento=PagamentoAluno.FormaPagamento.PIX,
+                        status=situacao,
+                    )
+
+    def _estado(self):
+        return list(PagamentoAluno.objects.order_by("pk").values_list(*self.CAMPOS))
+
+    def _completo(self, referencia):
+        with transaction.atomic():
+            recalcular_pagamentos(PagamentoAluno.objects.all(), referencia=referencia)
+            estado = self._estado()
+            transaction.set_rollback(True)
+        return estado
+
+    def test_incremental_igual_ao_completo(self):
+        recalcular_pagamentos(PagamentoAluno.objects.all(), referencia=REFERENCIA)
+        for dias in (1, 13, 45):
+            referencia = REFERENCIA + timedelta(days=dias)
+            with self.subTest(referencia=referencia):
+                recalcular_pagamentos(
+                    PagamentoAluno.objects.all(), referencia=referencia, incremental=True
+                )
+                self.assertEqual(self._estado(), self._completo(referencia))
+
+    def test_incremental_pula_pagamentos_que_nao_mudam(self):
+        recalcular_pagamentos(PagamentoAluno.objects.all(), referencia=REFERENCIA)
+        referencia = REFERENCIA + timedelta(days=1)
+        pendentes = filtrar_incremental(PagamentoAluno.objects.all(), referencia=referencia)
+        sem_plano = pendentes.filter(
+            aluno__plano_financeiro__isnull=True,
+            status=PagamentoAluno.Status.ATRASADO,
+        )
+        self.assertTrue(sem_plano.exists())
+        self.assertFalse(pendentes.filter(data_vencimento__gte=referencia))
+
+
+@override_settings(FINANCEIRO_RECALCULO_EM_THREAD=False)
+class RecalculoJobTests(TestCase):
+    """Fila de recalculo no banco: deduplicacao, expiracao e execucao em lotes."""
+
+    PARAMETROS = {"aluno": None, "search": "", "incremental": False, "vetorizado": False}
+
+    @classmethod
+    def setUpTestData(cls):
+        turma = criar_turma()
+        cls.alunos = [criar_aluno(turma, None, indice) for indice in range(2)]
+        for aluno in cls.alunos:
+            for meses in range(5):
+                vencimento = REFERENCIA - timedelta(days=30 * meses)
+                PagamentoAluno.objects.create(
+                    aluno=aluno,
+                    competencia=vencimento.replace(day=1),
+                    valor=Decimal("100.00"),
+                    data_vencimento=vencimento,
+                    forma_pagamento=PagamentoAluno.FormaPagamento.PIX,
+                )
+
+    def _expirar(self, job):
+        RecalculoJob.objects.filter(pk=job.pk).update(
+            updated_at=timezone.now() - jobs.JOB_EXPIRACAO - timedelta(minutes=1)
+        )
+
+    def test_mesmos_parametros_reaproveitam_o_job_ativo(self):
+        job, criado = jobs.enfileirar_recalculo(self.PARAMETROS)
+        repetido, repetido_criado = jobs.enfileirar_recalculo(dict(self.PARAMETROS))
+        outro, outro_criado = jobs.enfileirar_recalculo({**self.PARAMETROS, "incremental": True})
+
+        self.assertTrue(criado)
+        self.assertEqual((repetido.pk, repetido_criado), (job.pk, False))
+        self.assertTrue(outro_criado)
+        self.assertNotEqual(outro.pk, job.pk)
+
+    def test_job_concluido_libera_a_chave(self):
+        job, _ = jobs.enfileirar_recalculo(self.PARAMETROS)
+        jobs.processar_job(job.pk)
+
+        novo, criado = jobs.enfileirar_recalculo(self.PARAMETROS)
+
+        self.assertTrue(criado)
+        self.assertNotEqual(novo.pk, job.pk)
+
+    def test_execucao_em_lotes(self):
+        job, _ = jobs.enfileirar_recalculo({**self.PARAMETROS, "aluno": self.alunos[0].pk})
+
+        jobs.processar_job(job.pk, chunk_size=2)
+
+        job.refresh_from_db()
+        pagamentos = PagamentoAluno.objects.filter(aluno=self.alunos[0])
+        self.assertEqual(job.status, RecalculoJob.Status.CONCLUIDO)
+        self.assertEqual((job.total, job.processados, job.atualizados), (5, 5, 5))
+        self.assertEqual(job.ultimo_pk, pagamentos.order_by("-pk").values_list("pk", flat=True)[0])
+        self.assertEqual(job.erros, [])
+        self.assertIsNotNone(job.finalizado_em)
+        self.assertFalse(pagamentos.filter(recalculado_em__isnull=True).exists())
+        outro_aluno = PagamentoAluno.objects.filter(aluno=self.alunos[1])
+        self.assertFalse(outro_aluno.filter(recalculado_em__isnull=False).exists())
+
+    def test_falha_em_um_lote_fica_registrada_e_o_job_continua(self):
+        job, _ = jobs.enfileirar_recalculo(self.PARAMETROS)
+        recalcular_lote = jobs.recalcular_lote
+        chamadas = []
+
+        def falhar_no_primeiro(lote, **kwargs):
+            chamadas.append(lote[-1].pk)
+            if len(chamadas) == 1:
+                raise RuntimeError("lote com problema")
+            return recalcular_lote(lote, **kwargs)
+
+        with mock.patch.object(jobs, "recalcular_lote", side_effect=falhar_no_primeiro):
+            jobs.processar_job(job.pk, chunk_size=4)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, RecalculoJob.Status.CONCLUIDO)
+        self.assertEqual(job.processados, 10)
+        self.assertEqual(job.erros, [{"ultimo_pk": chamadas[0], "erro": "lote com problema"}])
+
+    def test_job_processando_so_e_retomado_depois_de_expirar(self):
+        job, _ = jobs.enfileirar_recalculo(self.PARAMETROS)
+        self.assertEqual(jobs._reservar(job.pk).pk, job.pk)
+        primeiro = PagamentoAluno.objects.order_by("pk").values_list("pk", flat=True)[0]
+        RecalculoJob.objects.filter(pk=job.pk).update(ultimo_pk=primeiro, total=10, processados=1)
+
+        self.assertIsNone(jobs._reservar(job.pk))
+
+        self._expirar(job)
+        retomado = jobs.processar_job(job.pk)
+        retomado.refresh_from_db()
+        self.assertEqual(retomado.status, RecalculoJob.Status.CONCLUIDO)
+        self.assertEqual((retomado.total, retomado.processados), (10, 10))
+        self.assertIsNone(PagamentoAluno.objects.get(pk=primeiro).recalculado_em)
+
+    @override_settings(FINANCEIRO_RECALCULO_EM_THREAD=True)
+    def test_modo_thread_reinicia_job_abandonado(self):
+        with mock.patch.object(jobs, "iniciar_em_thread") as iniciar:
+            with self.captureOnCommitCallbacks(execute=True):
+                job, _ = jobs.enfileirar_recalculo(self.PARAMETROS)
+            iniciar.assert_called_once_with(job.pk)
+            jobs._reservar(job.pk)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                jobs.enfileirar_recalculo(self.PARAMETROS)
+            self.assertEqual(iniciar.call_count, 1)
+
+            self._expirar(job)
+            with self.captureOnCommitCallbacks(execute=True):
+                repetido, criado = jobs.enfileirar_recalculo(self.PARAMETROS)
+            self.assertEqual((repetido.pk, criado), (job.pk, False))
+            self.assertEqual(iniciar.call_count, 2)
+
+
+@override_settings(FINANCEIRO_NF_MAX_TENTATIVAS=3, FINANCEIRO_NF_BACKOFF_SEGUNDOS=60)
+class FilaNotasFiscaisTests(MidiaTemporariaMixin, TestCase):
+    """Fila de NFs: emissao, nova tentativa com espera crescente e recuperacao."""
+
+    @classmethod
+    def setUpTestData(cls):
+        aluno = criar_aluno(criar_turma(), None, 0)
+        cls.pagamento = PagamentoAluno.objects.create(
+            aluno=aluno,
+            competencia=REFERENCIA.replace(day=1),
+            valor=Decimal("100.00"),
+            data_vencimento=REFERENCIA,
+            data_pagamento=REFERENCIA,
+            forma_pagamento=PagamentoAluno.FormaPagamento.PIX,
+            status=PagamentoAluno.Status.PAGO,
+        )
+
+    def setUp(self):
+        self.falhar = False
+        gerar = mock.patch.object(services, "gerar_pdf_nota_fiscal", side_effect=self._gerar)
+        self.gerar = gerar.start()
+        self.addCleanup(gerar.stop)
+
+    def _gerar(self, pagamento):
+        if self.falhar:
+            raise RuntimeError("Renderizador indisponivel.")
+        return f"%PDF {pagamento.nf_numero}".encode()
+
+    def _atual(self):
+        return PagamentoAluno.objects.get(pk=self.pagamento.pk)
+
+    def _liberar_proxima_tentativa(self):
+        PagamentoAluno.objects.filter(pk=self.pagamento.pk).update(
+            nf_proxima_tentativa=timezone.now()
+        )
+
+    def test_emite_e_registra_historico(self):
+        self.assertTrue(self.pagamento.enfileirar_nf())
+
+        self.assertEqual(notas.processar_fila(), (1, 0))
+
+        atual = self._atual()
+        self.assertEqual(atual.nf_status, PagamentoAluno.NfStatus.EMITIDA)
+        self.assertTrue(atual.nf_numero.startswith("NF-"))
+        self.assertEqual(atual.nf_pdf.read(), f"%PDF {atual.nf_numero}".encode())
+        self.assertTrue(atual.historico.filter(acao=PagamentoAlunoHistorico.Acao.NF).exists())
+        self.assertEqual(notas.processar_fila(), (0, 0))
+
+    def test_espera_dobra_a_cada_falha_ate_uma_hora(self):
+        self.assertEqual(
+            [notas._espera(tentativas).total_seconds() for tentativas in range(1, 8)],
+            [60, 120, 240, 480, 960, 1920, 3600],
+        )
+
+    def test_falha_volta_para_a_fila_com_espera_e_vira_erro_no_limite(self):
+        self.pagamento.enfileirar_nf()
+        self.falhar = True
+
+        for tentativas, espera in ((1, 60), (2, 120)):
+            antes = timezone.now()
+            self.assertEqual(notas.processar_fila(), (0, 1))
+            atual = self._atual()
+            self.assertEqual(atual.nf_status, PagamentoAluno.NfStatus.PENDENTE)
+            self.assertEqual(atual.nf_tentativas, tentativas)
+            self.assertEqual(atual.nf_erro, "Renderizador indisponivel.")
+            self.assertGreaterEqual(atual.nf_proxima_tentativa, antes + timedelta(seconds=espera))
+            self.assertLessEqual(
+                atual.nf_proxima_tentativa, timezone.now() + timedelta(seconds=espera)
+            )
+            # Antes da espera a NF nao e reservada de novo.
+            self.assertEqual(notas.processar_fila(), (0, 0))
+            self._liberar_proxima_tentativa()
+
+        numero = self._atual().nf_numero
+        self.assertEqual(notas.processar_fila(), (0, 1))
+        atual = self._atual()
+        self.assertEqual(atual.nf_status, PagamentoAluno.NfStatus.ERRO)
+        self.assertIsNone(atual.nf_proxima_tentativa)
+        self.assertEqual(atual.nf_numero, numero)
+        self.assertEqual(self.gerar.call_count, 3)
+
+    def test_processando_abandonada_volta_para_a_fila_depois_de_expirar(self):
+        self.pagamento.enfileirar_nf()
+        reservados = notas.reservar_notas()
+        self.assertEqual([pagamento.pk for pagamento in reservados], [self.pagamento.pk])
+        self.assertEqual(self._atual().nf_status, PagamentoAluno.NfStatus.PROCESSANDO)
+
+        self.assertEqual(notas.reservar_notas(), [])
+
+        PagamentoAluno.objects.filter(pk=self.pagamento.pk).update(
+            updated_at=timezone.now() - notas.NF_EXPIRACAO - timedelta(minutes=1)
+        )
+        self.assertEqual(notas.processar_fila(), (1, 0))
+        self.assertEqual(self._atual().nf_status, PagamentoAluno.NfStatus.EMITIDA)
+
+    def test_numero_reservado_sem_pdf_e_recuperado(self):
+        self.falhar = True
+        with self.assertRaises(RuntimeError):
+            self.pagamento.emitir_nf()
+        reservado = self._atual()
+        self.assertEqual(reservado.nf_status, PagamentoAluno.NfStatus.NAO_SOLICITADA)
+        self.assertTrue(reservado.nf_numero)
+        self.assertFalse(reservado.nf_pdf)
+
+        self.falhar = False
+        self.assertEqual(notas.recuperar_reservadas(), 1)
+        self.assertEqual(self._atual().nf_status, PagamentoAluno.NfStatus.PENDENTE)
+        self.assertEqual(notas.processar_fila(), (1, 0))
+        atual = self._atual()
+        self.assertEqual(atual.nf_numero, reservado.nf_numero)
+        self.assertEqual(atual.nf_status, PagamentoAluno.NfStatus.EMITIDA)
+        self.assertEqual(notas.recuperar_reservadas(), 0)
@@ -2,6 +2,8 @@ import os
 from pathlib import Path
 from urllib.parse import parse_qs, unquote, urlparse
 
+from django.core.exceptions import ImproperlyConfigured
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 # =========================
@@ -162,6 +164,9 @@ elif USE_SQLITE or not DB_NAME:
             "ENGINE": "django.db.backends.sqlite3",
             "NAME": BASE_DIR / SQLITE_NAME,
             "CONN_MAX_AGE": 60,
+            # Banco de teste em arquivo: o SQLite em memoria compartilhado entre
+            # threads falha na hora com "table is locked" em vez de esperar.
+            "TEST": {"NAME": BASE_DIR / f"test_{Path(SQLITE_NAME).name}"},
         }
     }
 else:
@@ -181,16 +186,92 @@ else:
 # CACHE / SESSION
 # =========================
 CACHE_TTL = int(os.getenv("CACHE_TTL", "300"))
-DASHBOARD_CACHE_TTL = int(os.getenv("DASHBOARD_CACHE_TTL", "30"))
 
-CACHES = {
-    "default": {
+# locmem: um cache por processo. file: diretorio CACHE_DIR compartilhado pelos workers
+# do gunicorn (cada entrada gravada em arquivo temporario e renomeada). db: tabela no
+# banco principal (rode createcachetable). file e db descartam entradas ao passar de
+# CACHE_MAX_ENTRIES.
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "locmem").strip().lower()
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1000"))
+CACHE_BACKENDS = {
+    "locmem": {
         "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
         "LOCATION": "cejamsys-local-cache",
+    },
+    "file": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.getenv("CACHE_DIR", str(BASE_DIR / "cache")),
+    },
+    "db": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "cejamsys_cache",
+    },
+}
+if CACHE_BACKEND not in CACHE_BACKENDS:
+    raise ImproperlyConfigured("CACHE_BACKEND invalido. Use locmem, file ou db.")
+# Dashboards e relatorios ficam em cache ate a versao dos dados que leem mudar (ver
+# api.cache). Com locmem a troca de versao so chega ao processo que gravou, entao o
+# TTL padrao continua curto.
+DASHBOARD_CACHE_TTL = int(
+    os.getenv("DASHBOARD_CACHE_TTL", "30" if CACHE_BACKEND == "locmem" else "3600")
+)
+# Por quantos segundos depois de expirar uma entrada ainda e servida enquanto uma
+# thread a recalcula (0 desliga: quem encontra a entrada vencida espera o calculo).
+# Uma entrada com versao antiga (de antes de uma gravacao) nunca e servida.
+DASHBOARD_CACHE_STALE = int(os.getenv("DASHBOARD_CACHE_STALE", "600"))
+# Limite da trava de calculo de uma chave e da espera dos workers sem a trava.
+DASHBOARD_CACHE_LOCK_TIMEOUT = int(os.getenv("DASHBOARD_CACHE_LOCK_TIMEOUT", "30"))
+
+CACHES = {
+    "default": {
+        **CACHE_BACKENDS[CACHE_BACKEND],
         "TIMEOUT": CACHE_TTL,
+        "OPTIONS": {"MAX_ENTRIES": CACHE_MAX_ENTRIES},
     }
 }
 
+# =========================
+# FINANCEIRO
+# =========================
+# Calcula multa, juros, dias_atraso e status ATRASADO na consulta em vez de
+# depender da rotina noturna atualizar_status_financeiro.
+FINANCEIRO_CALCULO_VIRTUAL = os.getenv("FINANCEIRO_CALCULO_VIRTUAL", "").lower() in {
+    "1",
+    "true",
+    "yes",
+}
+# Executa o job de recalculo da API em uma thread do proprio processo web. Desative
+# quando houver um worker rodando processar_recalculos.
+FINANCEIRO_RECALCULO_EM_THREAD = os.getenv("FINANCEIRO_RECALCULO_EM_THREAD", "true").lower() in {
+    "1",
+    "true",
+    "yes",
+}
+# Meses completos de PagamentoAlunoHistorico mantidos no banco; o restante vai para
+# arquivos mensais em media com arquivar_historico_financeiro.
+FINANCEIRO_HISTORICO_RETENCAO_MESES = int(os.getenv("FINANCEIRO_HISTORICO_RETENCAO_MESES", "12"))
+# Fila de notas fiscais (processar_notas_fiscais): tentativas antes de marcar ERRO e
+# espera base entre tentativas, dobrada a cada falha (maximo de 1 hora).
+FINANCEIRO_NF_MAX_TENTATIVAS = int(os.getenv("FINANCEIRO_NF_MAX_TENTATIVAS", "5"))
+FINANCEIRO_NF_BACKOFF_SEGUNDOS = int(os.getenv("FINANCEIRO_NF_BACKOFF_SEGUNDOS", "60"))
+# O PDF unico da exportacao mensal e montado inteiro em memoria pelo pypdf; acima deste
+# numero de notas a exportacao exige o ZIP, que e transmitido com memoria constante.
+FINANCEIRO_NF_EXPORTACAO_PDF_MAX = int(os.getenv("FINANCEIRO_NF_EXPORTACAO_PDF_MAX", "300"))
+
+# =========================
+# PDF
+# =========================
+# Processos renderizadores mantidos aquecidos (engine e fontes carregados) para
+# contratos e notas fiscais. 0 renderiza no proprio processo.
+PDF_POOL_SIZE = int(os.getenv("PDF_POOL_SIZE", "2"))
+# Segundos que um PDF pode levar no pool antes de o job ser abortado.
+PDF_POOL_TIMEOUT = int(os.getenv("PDF_POOL_TIMEOUT", "60"))
+# Templates de contrato compilados mantidos em memoria por processo (LRU).
+CONTRATOS_TEMPLATE_CACHE_SIZE = int(os.getenv("CONTRATOS_TEMPLATE_CACHE_SIZE", "64"))
+# Prefixo de uma location internal do Nginx apontando para MEDIA_ROOT. Quando definido,
+# os downloads de PDF respondem com X-Accel-Redirect e o Nginx envia o arquivo.
+PDF_X_ACCEL_PREFIX = os.getenv("PDF_X_ACCEL_PREFIX", "")
+
 # =========================
 # AUTH / PASSWORDS
 # =========================